@@ -0,0 +1,117 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+# ---------------------------------------------------------------------------
+#   Startup benchmark: import time and first-invocation time of the UDQ connector modules
+#
+#   Each sample runs in a fresh interpreter (like a Lambda cold start): import the connector module, then invoke it
+#   twice with a recorded event against stand-in backends (see udq_backends). Reports the median import, first
+#   (cold) invocation and second (warm) invocation times per connector, to track init duration over releases
+#
+#   Usage (from src/libs/udq_helper_utils):
+#       python benchmarks/bench_cold_start.py [--samples 5] [--connector timestream synthetic] [--profile] [--json]
+#
+#   --profile enables UDQ_COLD_START_PROFILE in the samples and prints the slowest module imports of the last one
+# ---------------------------------------------------------------------------
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# connector name -> (module directory variable in udq_backends, module name, reader variable, recorded event)
+CONNECTORS = {
+    'timestream': ('TIMESTREAM_READER_DIR', 'udq_data_reader', 'TIMESTREAM_UDQ_READER', 'timestream_entity_event.json'),
+    'synthetic': ('SYNTHETIC_READER_DIR', 'synthetic_udq_reader', 'RENDER_READER', 'synthetic_entity_event.json'),
+}
+
+# runs in the fresh interpreter, prints one JSON line with its timings
+SAMPLE_SCRIPT = '''
+import time
+start = time.perf_counter()
+import json, logging, sys
+sys.path.insert(0, {benchmarks_dir!r})
+import udq_backends
+setup_ms = (time.perf_counter() - start) * 1000
+
+start = time.perf_counter()
+module = udq_backends.import_from(getattr(udq_backends, {module_dir!r}), {module_name!r})
+import_ms = (time.perf_counter() - start) * 1000
+
+logging.getLogger().setLevel(logging.WARNING)
+reader = getattr(module, {reader!r})
+if hasattr(reader, 'query_client'):
+    reader.query_client = udq_backends.PagedTimestreamQueryClient(udq_backends.load_fixture('timestream_query_page.json'))
+if hasattr(module, 'iottm'):
+    module.iottm = udq_backends.StubIoTTwinMakerClient()
+event = udq_backends.load_fixture({event!r})
+
+timings = []
+for _ in range(2):
+    start = time.perf_counter()
+    reader.process_query(event)
+    timings.append((time.perf_counter() - start) * 1000)
+
+print(json.dumps({{'setup_ms': setup_ms, 'import_ms': import_ms, 'first_invocation_ms': timings[0], 'warm_invocation_ms': timings[1],
+                  'modules_loaded': len(sys.modules)}}))
+'''
+
+
+def run_sample(name, profile):
+    module_dir, module_name, reader, event = CONNECTORS[name]
+    script = SAMPLE_SCRIPT.format(benchmarks_dir=BENCHMARKS_DIR, module_dir=module_dir, module_name=module_name, reader=reader, event=event)
+    env = dict(os.environ)
+    if profile:
+        env['UDQ_COLD_START_PROFILE'] = '1'
+    completed = subprocess.run([sys.executable, '-c', script], capture_output=True, text=True, env=env)
+    if completed.returncode != 0:
+        raise Exception(f"{name} sample failed: {completed.stderr.strip()}")
+    result, cold_start_profile = None, None
+    for line in completed.stdout.splitlines():
+        if line.startswith('{"udqColdStartProfile"'):
+            cold_start_profile = json.loads(line)['udqColdStartProfile']
+        elif line.startswith('{"setup_ms"'):
+            result = json.loads(line)
+    result['profile'] = cold_start_profile
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark import and first-invocation time of the UDQ connector modules')
+    parser.add_argument('--samples', type=int, default=5)
+    parser.add_argument('--connector', nargs='+', default=list(CONNECTORS), choices=list(CONNECTORS))
+    parser.add_argument('--profile', action='store_true', help="record per-module import times with UDQ_COLD_START_PROFILE")
+    parser.add_argument('--json', action='store_true', help="print the results as JSON")
+    args = parser.parse_args()
+
+    results = {}
+    for name in args.connector:
+        try:
+            samples = [run_sample(name, args.profile) for _ in range(args.samples)]
+        except Exception as err:
+            print(f"skipping {name}: {err}", file=sys.stderr)
+            continue
+        results[name] = {metric: round(statistics.median(sample[metric] for sample in samples), 2)
+                         for metric in ('import_ms', 'first_invocation_ms', 'warm_invocation_ms', 'modules_loaded')}
+        results[name]['profile'] = samples[-1]['profile']
+
+    if args.json:
+        print(json.dumps({name: {k: v for k, v in result.items() if k != 'profile' or args.profile} for name, result in results.items()}))
+        return
+
+    print(f"median of {args.samples} fresh interpreters")
+    print(f"  {'connector':<12} {'import ms':>10} {'first call ms':>14} {'warm call ms':>13} {'modules':>8}")
+    for name, result in results.items():
+        print(f"  {name:<12} {result['import_ms']:>10.1f} {result['first_invocation_ms']:>14.1f} {result['warm_invocation_ms']:>13.1f} {result['modules_loaded']:>8.0f}")
+        if result['profile']:
+            print(f"    init phases (ms): {result['profile']['initPhasesMs']}")
+            for entry in result['profile']['imports'][:10]:
+                print(f"    {entry['module']:<40} self {entry['selfMs']:>8.1f} ms  cumulative {entry['cumulativeMs']:>8.1f} ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+# ---------------------------------------------------------------------------
+#   Micro-benchmark: cost of grouping UDQ rows by entityPropertyReference
+#
+#   Compares the previous reference model (plain classes, json.dumps in ExternalIdPropertyRef.__hash__, a fresh
+#   reference per row) with the interned __slots__ model (IoTTwinMakerReferenceTable, precomputed hashes)
+#
+#   Usage (from src/libs/udq_helper_utils):
+#       python benchmarks/bench_reference_grouping.py [--rows 50000] [--repeat 5]
+# ---------------------------------------------------------------------------
+
+import argparse
+import json
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from udq_utils.udq_models import IoTTwinMakerReference, ExternalIdPropertyRef, IoTTwinMakerReferenceTable
+
+
+class LegacyExternalIdPropertyRef():
+    """
+    Copy of the pre-__slots__ ExternalIdPropertyRef, kept here as the "before" baseline
+    """
+
+    def __init__(self, external_id_property: dict, property_name: str):
+        self.external_id_property = external_id_property
+        self.property_name = property_name
+
+    def __hash__(self):
+        return hash((json.dumps(self.external_id_property), self.property_name))
+
+    def __eq__(self, other):
+        return (self.external_id_property, self.property_name) == (other.external_id_property, other.property_name)
+
+
+class LegacyIoTTwinMakerReference():
+    """
+    Copy of the pre-__slots__ IoTTwinMakerReference, kept here as the "before" baseline
+    """
+
+    def __init__(self, ecp=None, eip=None):
+        self.ecp = ecp
+        self.eip = eip
+
+    def __hash__(self):
+        return hash((self.ecp, self.eip))
+
+    def __eq__(self, other):
+        return (self.ecp, self.eip) == (other.ecp, other.eip)
+
+
+def make_rows(num_rows, num_assets=100, properties=('alarm_status', 'RPM', 'Temperature')):
+    """
+    Raw (asset id, measure name) pairs, as a multi-entity Timestream query would return them
+    """
+    return [(f"Mixer_{i % num_assets}", properties[i % len(properties)]) for i in range(num_rows)]
+
+
+def group_legacy(rows):
+    groups = {}
+    for asset_id, measure_name in rows:
+        ref = LegacyIoTTwinMakerReference(eip=LegacyExternalIdPropertyRef({'telemetryAssetId': asset_id}, measure_name))
+        groups.setdefault(ref, []).append(measure_name)
+    return groups
+
+
+def group_uninterned(rows):
+    groups = {}
+    for asset_id, measure_name in rows:
+        ref = IoTTwinMakerReference(eip=ExternalIdPropertyRef({'telemetryAssetId': asset_id}, measure_name))
+        groups.setdefault(ref, []).append(measure_name)
+    return groups
+
+
+def group_interned(rows):
+    table = IoTTwinMakerReferenceTable()
+    groups = {}
+    for asset_id, measure_name in rows:
+        ref = table.external_id_property({'telemetryAssetId': asset_id}, measure_name)
+        groups.setdefault(ref, []).append(measure_name)
+    return groups
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark grouping UDQ rows by entityPropertyReference')
+    parser.add_argument('--rows', type=int, default=50000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    rows = make_rows(args.rows)
+    assert len(group_legacy(rows)) == len(group_uninterned(rows)) == len(group_interned(rows))
+
+    print(f"grouping {args.rows} rows, best of {args.repeat}")
+    baseline = None
+    for name, fn in [('before (legacy references)', group_legacy),
+                     ('after (slots, no interning)', group_uninterned),
+                     ('after (interned)', group_interned)]:
+        best = min(timeit.repeat(lambda: fn(rows), number=1, repeat=args.repeat))
+        baseline = baseline or best
+        print(f"  {name:<30} {best * 1000:8.1f} ms  {baseline / best:5.1f}x")
+
+
+if __name__ == '__main__':
+    main()
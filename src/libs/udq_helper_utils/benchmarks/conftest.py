@@ -0,0 +1,79 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+# ---------------------------------------------------------------------------
+#   Benchmark suite for the UDQ framework and sample connectors
+#
+#   Usage (from src/libs/udq_helper_utils):
+#       pip install -r benchmarks/requirements.txt
+#       python -m pytest benchmarks --benchmark-only
+#
+#   The behaviour checks (test_timestream_reader) are skipped by --benchmark-only, run them with
+#       python -m pytest benchmarks --benchmark-disable
+#
+#   AWS clients are replaced with stubs serving the recorded fixtures (see udq_backends), no AWS credentials or network
+#   access are needed
+# ---------------------------------------------------------------------------
+
+import tracemalloc
+
+import pytest
+
+from udq_backends import TIMESTREAM_READER_DIR, SYNTHETIC_READER_DIR, StubIoTTwinMakerClient, import_from
+
+_RESULTS = []
+
+
+@pytest.fixture(scope='session')
+def timestream_reader_module():
+    return import_from(TIMESTREAM_READER_DIR, 'udq_data_reader')
+
+
+@pytest.fixture(scope='session')
+def synthetic_reader_module():
+    pytest.importorskip('numpy')
+    module = import_from(SYNTHETIC_READER_DIR, 'synthetic_udq_reader')
+    module.iottm = StubIoTTwinMakerClient()
+    return module
+
+
+@pytest.fixture
+def measure(request):
+    """
+    Benchmark fn(), then record its throughput (rows/s) and peak traced memory for the summary report
+
+    Large inputs run fewer rounds to keep the suite fast. With --benchmark-disable, fn() only runs once and nothing is recorded
+    """
+    pytest.importorskip('pytest_benchmark')
+    benchmark = request.getfixturevalue('benchmark')
+
+    def run(fn, num_rows, label=None):
+        rounds = 20 if num_rows <= 10_000 else 3
+        result = benchmark.pedantic(fn, rounds=rounds, iterations=1, warmup_rounds=1)
+        if benchmark.stats is None:
+            return result
+
+        tracemalloc.start()
+        try:
+            fn()
+            _, peak_bytes = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+
+        mean_seconds = benchmark.stats.stats.mean
+        benchmark.extra_info['rows'] = num_rows
+        benchmark.extra_info['rows_per_second'] = round(num_rows / mean_seconds) if mean_seconds else None
+        benchmark.extra_info['peak_memory_mb'] = round(peak_bytes / (1024 * 1024), 2)
+        _RESULTS.append((label or benchmark.name, num_rows, mean_seconds, benchmark.extra_info['rows_per_second'], benchmark.extra_info['peak_memory_mb']))
+        return result
+
+    return run
+
+
+def pytest_terminal_summary(terminalreporter):
+    if not _RESULTS:
+        return
+    terminalreporter.section('UDQ throughput and peak memory')
+    terminalreporter.write_line(f"{'benchmark':<70} {'rows':>8} {'mean ms':>10} {'rows/s':>12} {'peak MB':>9}")
+    for name, num_rows, mean_seconds, rows_per_second, peak_memory_mb in _RESULTS:
+        terminalreporter.write_line(f"{name:<70} {num_rows:>8} {mean_seconds * 1000:>10.2f} {rows_per_second or 0:>12} {peak_memory_mb:>9}")
@@ -0,0 +1,84 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+# Behaviour checks of the Timestream reader run alongside the benchmarks, against stub query clients
+
+import pytest
+
+from udq_backends import load_fixture
+from udq_utils.udq_downsample import Downsampling, MINMAX
+
+
+class RollupTimestreamQueryClient:
+    """
+    Stands in for the boto3 timestream-query client: answers the time range queries of the rollup tables from the given
+    (first, last) interval starts, and every other query with an empty page. Records the queried tables
+    """
+
+    def __init__(self, time_ranges):
+        self.time_ranges = time_ranges
+        self.tables = []
+
+    def query(self, QueryString, NextToken=None, MaxRows=None):
+        table_name = QueryString.split('FROM "', 1)[1].split('"."', 1)[1].split('"', 1)[0]
+        if QueryString.startswith('SELECT min(time) AS first_time'):
+            first_time, last_time = self.time_ranges.get(table_name, (None, None))
+            column_info = [{'Name': 'first_time', 'Type': {'ScalarType': 'TIMESTAMP'}}, {'Name': 'last_time', 'Type': {'ScalarType': 'TIMESTAMP'}}]
+            data = [{'ScalarValue': first_time} if first_time else {'NullValue': True},
+                    {'ScalarValue': last_time} if last_time else {'NullValue': True}]
+            return {'ColumnInfo': column_info, 'Rows': [{'Data': data}]}
+        if not QueryString.startswith('DESCRIBE'):
+            self.tables.append(table_name)
+        return {'ColumnInfo': [], 'Rows': []}
+
+
+@pytest.mark.parametrize('time_range, expected_table', [
+    # the hourly rollups cover the whole 30 day window
+    (('2022-02-01 00:00:00.000000000', '2022-03-31 00:00:00.000000000'), 'Telemetry_1h'),
+    # partially built: the rollups start after the window start
+    (('2022-03-10 00:00:00.000000000', '2022-03-31 00:00:00.000000000'), 'Telemetry'),
+    # not caught up: the last rollup interval ends before the window end
+    (('2022-02-01 00:00:00.000000000', '2022-03-20 00:00:00.000000000'), 'Telemetry'),
+    # not built at all
+    ((None, None), 'Telemetry'),
+])
+def test_timestream_rollup_tier_covers_window(timestream_reader_module, time_range, expected_table):
+    event = dict(load_fixture('timestream_entity_event.json'), selectedProperties=['RPM'],
+                 startTime='2022-03-01T00:00:00Z', endTime='2022-03-31T00:00:00Z')
+    query_client = RollupTimestreamQueryClient({'Telemetry_1h': time_range})
+    reader = timestream_reader_module.TimestreamReader(query_client, 'CookieFactoryTelemetry', 'Telemetry', rollup_tables='1h:Telemetry_1h')
+    reader.downsampling = Downsampling(1000, MINMAX)
+    reader.process_query(event)
+    assert query_client.tables == [expected_table]
+
+
+class DownsampledTimestreamQueryClient:
+    """
+    Stands in for the boto3 timestream-query client: answers downsampled queries with one bucket row per call, whose min
+    value is null, and records the MaxRows of each call
+    """
+
+    def __init__(self):
+        self.max_rows = []
+
+    def query(self, QueryString, NextToken=None, MaxRows=None):
+        if QueryString.startswith('DESCRIBE'):
+            return {'ColumnInfo': [], 'Rows': []}
+        self.max_rows.append(MaxRows)
+        names = ['TelemetryAssetId', 'measure_name', 'bucket', 'first_time', 'first_value', 'min_time', 'min_value', 'max_time', 'max_value',
+                 'last_time', 'last_value']
+        data = ['Mixer_2', 'RPM', '2022-03-04 00:00:00.000000000', '2022-03-04 00:00:01.000000000', '10.0', '2022-03-04 00:00:02.000000000', None,
+                '2022-03-04 00:00:03.000000000', '30.0', '2022-03-04 00:00:04.000000000', '20.0']
+        return {'ColumnInfo': [{'Name': name, 'Type': {'ScalarType': 'VARCHAR'}} for name in names],
+                'Rows': [{'Data': [{'ScalarValue': value} if value is not None else {'NullValue': True} for value in data]}]}
+
+
+def test_timestream_downsampled_page_skips_null_values(timestream_reader_module):
+    event = dict(load_fixture('timestream_entity_event.json'), selectedProperties=['RPM'], maxResults=100)
+    query_client = DownsampledTimestreamQueryClient()
+    reader = timestream_reader_module.TimestreamReader(query_client, 'CookieFactoryTelemetry', 'Telemetry')
+    reader.downsampling = Downsampling(1000, MINMAX)
+    result = reader.process_query(event)
+    # each bucket row yields up to 4 values, so pages of maxResults values hold at most maxResults // 4 rows
+    assert query_client.max_rows == [25]
+    assert [value['value']['doubleValue'] for value in result['propertyValues'][0]['values']] == ['10.0', '30.0', '20.0']
@@ -0,0 +1,133 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+import pytest
+
+from udq_backends import ROW_COUNTS, load_fixture, scale_query_page, StubTimestreamQueryClient
+from udq_utils.udq import SingleEntityReader, IoTTwinMakerDataRow, IoTTwinMakerUdqResponse, IoTTwinMakerUdqColumnarResponse
+from udq_utils.udq_models import IoTTwinMakerUdqRequest
+
+
+class InMemoryDataRow(IoTTwinMakerDataRow):
+
+    def __init__(self, reference, timestamp, value):
+        self._reference = reference
+        self._timestamp = timestamp
+        self._value = value
+
+    def get_iottwinmaker_reference(self):
+        return self._reference
+
+    def get_iso8601_timestamp(self):
+        return self._timestamp
+
+    def get_value(self):
+        return self._value
+
+
+class InMemoryRowReader(SingleEntityReader):
+    """
+    Serves pre-built rows, so only the framework's marshalling is measured
+    """
+    max_response_bytes = None
+
+    def __init__(self, response):
+        self.response = response
+
+    def entity_query(self, request):
+        return self.response
+
+
+def build_rows(request, num_rows):
+    references = [request.reference_table.entity_component_property(request.entity_id, request.component_name, p) for p in request.selected_properties]
+    return [InMemoryDataRow(references[i % len(references)], '2022-03-04T20:43:%02d.%09dZ' % (i % 60, i), float(i)) for i in range(num_rows)]
+
+
+@pytest.mark.parametrize('fixture_name', ['timestream_entity_event.json', 'timestream_component_type_event.json'])
+def test_parse_request(measure, fixture_name):
+    event = load_fixture(fixture_name)
+    measure(lambda: IoTTwinMakerUdqRequest.parse(event), 1)
+
+
+@pytest.mark.parametrize('num_rows', ROW_COUNTS)
+def test_process_query_marshall_rows(measure, num_rows):
+    event = load_fixture('timestream_entity_event.json')
+    reader = InMemoryRowReader(IoTTwinMakerUdqResponse(build_rows(IoTTwinMakerUdqRequest.parse(event), num_rows)))
+    result = measure(lambda: reader.process_query(event), num_rows)
+    assert sum(len(property_value['values']) for property_value in result['propertyValues']) == num_rows
+
+
+@pytest.mark.parametrize('num_rows', ROW_COUNTS)
+def test_process_query_marshall_columns(measure, num_rows):
+    event = load_fixture('timestream_entity_event.json')
+    rows = build_rows(IoTTwinMakerUdqRequest.parse(event), num_rows)
+    references = list({row.get_iottwinmaker_reference(): None for row in rows})
+    reference_ids = [references.index(row.get_iottwinmaker_reference()) for row in rows]
+    reader = InMemoryRowReader(IoTTwinMakerUdqColumnarResponse(references, reference_ids, [row.get_iso8601_timestamp() for row in rows],
+                                                               [row.get_value() for row in rows]))
+    result = measure(lambda: reader.process_query(event), num_rows)
+    assert sum(len(property_value['values']) for property_value in result['propertyValues']) == num_rows
+
+
+@pytest.mark.parametrize('num_rows', ROW_COUNTS)
+def test_process_query_paginated(measure, num_rows):
+    event = load_fixture('timestream_entity_event.json')
+    reader = InMemoryRowReader(IoTTwinMakerUdqResponse(build_rows(IoTTwinMakerUdqRequest.parse(event), num_rows)))
+    reader.max_response_bytes = 5 * 1024 * 1024
+    result = measure(lambda: reader.process_query(event), num_rows)
+
+    # the pages following the measured one join back up to every row
+    num_paged_rows = sum(len(property_value['values']) for property_value in result['propertyValues'])
+    while result['nextToken']:
+        result = reader.process_query(dict(event, nextToken=result['nextToken']))
+        num_paged_rows += sum(len(property_value['values']) for property_value in result['propertyValues'])
+    assert num_paged_rows == num_rows
+
+
+@pytest.mark.parametrize('num_rows', ROW_COUNTS)
+def test_timestream_page_to_rows(measure, timestream_reader_module, num_rows):
+    page = scale_query_page(load_fixture('timestream_query_page.json'), num_rows)
+    convert = timestream_reader_module.TimestreamReader._convert_timestream_query_page_to_udq_response
+
+    def parse_page():
+        response = convert(page, 'Mixer_2_06ac63c4-d68d-4723-891a-8e758f8456ef', 'MixerComponent', 'Mixer')
+        return [(row.get_iottwinmaker_reference(), row.get_iso8601_timestamp(), row.get_value()) for row in response.rows]
+
+    assert len(measure(parse_page, num_rows)) == num_rows
+
+
+@pytest.mark.parametrize('num_rows', ROW_COUNTS)
+@pytest.mark.parametrize('page_name', ['timestream_query_page.json', 'timestream_alarm_query_page.json'])
+def test_timestream_page_to_columns(measure, timestream_reader_module, page_name, num_rows):
+    page = scale_query_page(load_fixture(page_name), num_rows)
+    convert = timestream_reader_module.TimestreamReader._convert_timestream_query_page_to_udq_columnar_response
+
+    def decode_page():
+        return convert(page, 'Mixer_2_06ac63c4-d68d-4723-891a-8e758f8456ef', 'MixerComponent', 'Mixer')
+
+    assert len(measure(decode_page, num_rows)) == num_rows
+
+
+@pytest.mark.parametrize('num_rows', ROW_COUNTS)
+@pytest.mark.parametrize('fixture_names', [('timestream_entity_event.json', 'timestream_query_page.json'),
+                                           ('timestream_component_type_event.json', 'timestream_alarm_query_page.json')])
+def test_timestream_process_query(measure, timestream_reader_module, fixture_names, num_rows):
+    event_name, page_name = fixture_names
+    event = dict(load_fixture(event_name), maxResults=num_rows)
+    reader = timestream_reader_module.TimestreamReader(StubTimestreamQueryClient(scale_query_page(load_fixture(page_name), num_rows)),
+                                                       'CookieFactoryTelemetry', 'Telemetry')
+    reader.max_response_bytes = None
+    result = measure(lambda: reader.process_query(event), num_rows)
+    assert sum(len(property_value['values']) for property_value in result['propertyValues']) == num_rows
+
+
+@pytest.mark.parametrize('num_rows', ROW_COUNTS)
+def test_synthetic_reader_process_query(measure, synthetic_reader_module, num_rows):
+    event = load_fixture('synthetic_entity_event.json')
+    # a window long enough for num_rows points of each selected property at the sample data interval
+    window_seconds = num_rows * synthetic_reader_module.DATA_INTERVAL
+    event = dict(event, maxResults=num_rows, endDateTime=event['startDateTime'] + window_seconds)
+    reader = synthetic_reader_module.RenderValuesReader()
+    reader.max_response_bytes = None
+    result = measure(lambda: reader.process_query(event), num_rows)
+    assert sum(len(property_value['values']) for property_value in result['propertyValues']) == num_rows
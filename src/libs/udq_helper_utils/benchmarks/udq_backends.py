@@ -0,0 +1,170 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+# ---------------------------------------------------------------------------
+#   Stand-in backends for running UDQ connectors locally, shared by the benchmark suite and the replay harness
+#
+#   - canned Timestream query pages (recorded fixtures, optionally scaled and paged)
+#   - a stub IoT TwinMaker client for the synthetic replay connector
+#   - an in-memory dataset connector, serving generated series without any backend
+# ---------------------------------------------------------------------------
+
+import copy
+import json
+import math
+import os
+import sys
+import time
+from bisect import bisect_right
+from datetime import datetime, timezone
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+SRC_DIR = os.path.abspath(os.path.join(BENCHMARKS_DIR, '..', '..', '..'))
+FIXTURES_DIR = os.path.join(BENCHMARKS_DIR, 'fixtures')
+
+UDQ_HELPER_UTILS_DIR = os.path.join(SRC_DIR, 'libs', 'udq_helper_utils')
+TIMESTREAM_READER_DIR = os.path.join(SRC_DIR, 'modules', 'timestream_telemetry', 'lambda_function')
+SYNTHETIC_READER_DIR = os.path.join(SRC_DIR, 'workspaces', 'cookiefactoryv3', 'cdk', 'synthetic_replay_connector')
+
+# row counts every scaled benchmark runs at
+ROW_COUNTS = [100, 10_000, 100_000]
+
+if UDQ_HELPER_UTILS_DIR not in sys.path:
+    sys.path.insert(0, UDQ_HELPER_UTILS_DIR)
+
+# boto3 clients are created at import time by the sample connectors, they only need a region to be constructed
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+
+from udq_utils.udq import SingleEntityReader, IoTTwinMakerUdqColumnarResponse
+from udq_utils.udq_cursor import Cursor, CursorCodec
+
+
+def load_fixture(name):
+    with open(os.path.join(FIXTURES_DIR, name)) as f:
+        return json.load(f)
+
+
+def scale_query_page(page, num_rows):
+    """
+    Repeat the rows of a recorded Timestream page up to num_rows, giving each row a distinct timestamp
+    """
+    rows = []
+    recorded_rows = page['Rows']
+    for i in range(num_rows):
+        row = copy.deepcopy(recorded_rows[i % len(recorded_rows)])
+        seconds = i // len(recorded_rows)
+        row['Data'][2] = {'ScalarValue': time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(1646352000 + seconds)) + '.%09d' % (i % len(recorded_rows))}
+        rows.append(row)
+    return dict(page, Rows=rows)
+
+
+class StubTimestreamQueryClient:
+    """
+    Stands in for the boto3 timestream-query client, serving one recorded page for every query
+    """
+
+    def __init__(self, page):
+        self.page = page
+        self.calls = 0
+
+    def query(self, **kwargs):
+        self.calls += 1
+        return self.page
+
+
+class PagedTimestreamQueryClient:
+    """
+    Stands in for the boto3 timestream-query client, serving the rows of a canned page in pages of MaxRows (or
+    page_rows) rows with NextTokens, and simulating the backend latency of each call
+    """
+
+    def __init__(self, page, page_rows=1000, latency_seconds=0.0):
+        self.page = page
+        self.page_rows = page_rows
+        self.latency_seconds = latency_seconds
+        self.calls = 0
+
+    def query(self, QueryString, NextToken=None, MaxRows=None):
+        self.calls += 1
+        if self.latency_seconds:
+            time.sleep(self.latency_seconds)
+        offset = int(NextToken) if NextToken else 0
+        page_rows = min(MaxRows or self.page_rows, self.page_rows)
+        rows = self.page['Rows'][offset:offset + page_rows]
+        result = {'QueryId': f"local-{self.calls}", 'ColumnInfo': self.page['ColumnInfo'], 'Rows': rows,
+                  'QueryStatus': {'CumulativeBytesScanned': 100 * len(rows)}}
+        if offset + page_rows < len(self.page['Rows']):
+            result['NextToken'] = str(offset + page_rows)
+        return result
+
+
+class StubIoTTwinMakerClient:
+    """
+    Stands in for the boto3 iottwinmaker client used by the synthetic replay connector
+    """
+
+    def __init__(self, generate_error_states=False):
+        self.generate_error_states = generate_error_states
+
+    def get_entity(self, **kwargs):
+        return {'components': {'synthetics': {'properties': {'generate_error_states': {'value': {'booleanValue': self.generate_error_states}}}}}}
+
+
+class InMemoryDatasetReader(SingleEntityReader):
+    """
+    Serves every selected property of any entity from one generated in-memory series (a sine wave sampled every
+    interval_seconds), paging by maxResults with cursor tokens. Baseline for the framework's own overhead
+    """
+
+    def __init__(self, start_seconds=None, duration_seconds=7 * 86400, interval_seconds=1):
+        if start_seconds is None:
+            start_seconds = int(time.time()) - duration_seconds
+        self.cursor_codec = CursorCodec()
+        self._epoch_seconds = list(range(start_seconds, start_seconds + duration_seconds, interval_seconds))
+        self._timestamps = [datetime.fromtimestamp(seconds, timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.000Z') for seconds in self._epoch_seconds]
+        self._values = [math.sin(seconds / 600) * 50 + 50 for seconds in self._epoch_seconds]
+
+    def entity_query(self, request):
+        lo = bisect_right(self._epoch_seconds, _epoch_seconds(request.start_time))
+        hi = bisect_right(self._epoch_seconds, _epoch_seconds(request.end_time))
+        positions = range(lo, hi) if request.order_by.name == 'ASCENDING' else range(hi - 1, lo - 1, -1)
+
+        cursor = self.cursor_codec.decode(request)
+        references, reference_ids, timestamps, values = [], [], [], []
+        remaining = request.max_rows or math.inf
+        next_token = None
+        for property_index in range(cursor.property_index, len(request.selected_properties)):
+            offset = cursor.row_offset if property_index == cursor.property_index else 0
+            page = positions[offset:offset + remaining] if remaining != math.inf else positions[offset:]
+            references.append(request.reference_table.entity_component_property(request.entity_id, request.component_name,
+                                                                                request.selected_properties[property_index]))
+            reference_ids.extend([len(references) - 1] * len(page))
+            timestamps.extend(self._timestamps[i] for i in page)
+            values.extend(self._values[i] for i in page)
+            remaining -= len(page)
+            if offset + len(page) < len(positions):
+                next_token = self.cursor_codec.encode(Cursor(property_index, offset + len(page)), request)
+                break
+        return IoTTwinMakerUdqColumnarResponse(references, reference_ids, timestamps, values, next_token)
+
+
+def _epoch_seconds(iso8601):
+    return datetime.fromisoformat(iso8601.replace('Z', '+00:00')).timestamp()
+
+
+def import_from(directory, module_name):
+    """
+    Import a connector module from its Lambda source directory (which it expects as working directory for its data files)
+
+    The directory stays on sys.path, as the Lambda task root does, for the modules the connector imports on first use
+    """
+    if module_name in sys.modules:
+        return sys.modules[module_name]
+    cwd = os.getcwd()
+    if directory not in sys.path:
+        sys.path.insert(0, directory)
+    try:
+        os.chdir(directory)
+        return __import__(module_name)
+    finally:
+        os.chdir(cwd)
@@ -0,0 +1,353 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+# ---------------------------------------------------------------------------
+#   Local UDQ replay server and load generator
+#
+#   Replays captured UDQ events against a connector (any IoTTwinMakerUnifiedDataQuery instance) with stand-in backends,
+#   simulating dashboards: N panels x M viewers, each viewer refreshing each panel every refresh interval over a window
+#   ending "now". Reports latency percentiles, throughput and memory per connector
+#
+#   Usage (from src/libs/udq_helper_utils/benchmarks):
+#       # drive a connector in-process
+#       python udq_replay.py load --connector timestream --panels 8 --viewers 20 --refresh-seconds 5 --duration-seconds 60
+#
+#       # each built-in connector in its own process, so memory figures are independent
+#       python udq_replay.py load --connector all --time-scale 10
+#
+#       # your own connector, e.g. the READER instance in path/to/lambda_function/my_reader.py
+#       python udq_replay.py load --connector my_reader:READER --connector-path path/to/lambda_function --events my_events/*.json
+#
+#       # serve a connector on the Lambda invoke API (POST /2015-03-31/functions/<name>/invocations), and load it over HTTP
+#       python udq_replay.py serve --connector timestream --port 9000
+#       python udq_replay.py load --url http://localhost:9000 --events fixtures/timestream_entity_event.json
+#
+#   Built-in connectors use stand-in backends (see udq_backends), no AWS credentials or network access are needed:
+#   - timestream: TimestreamReader over canned Timestream pages (--rows rows, paged with simulated --backend-latency-ms)
+#   - synthetic: the cookiefactoryv3 synthetic replay connector over its compiled replay dataset (requires numpy)
+#   - memory: an in-memory dataset connector, measuring the framework's own overhead
+# ---------------------------------------------------------------------------
+
+import argparse
+import copy
+import glob
+import json
+import logging
+import random
+import resource
+import subprocess
+import sys
+import threading
+import time
+import tracemalloc
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from udq_backends import FIXTURES_DIR, TIMESTREAM_READER_DIR, SYNTHETIC_READER_DIR, load_fixture, scale_query_page, PagedTimestreamQueryClient, \
+    StubIoTTwinMakerClient, InMemoryDatasetReader, import_from
+
+
+def build_timestream_connector(args):
+    module = import_from(TIMESTREAM_READER_DIR, 'udq_data_reader')
+    page = scale_query_page(load_fixture('timestream_query_page.json'), args.rows)
+    return module.TimestreamReader(PagedTimestreamQueryClient(page, latency_seconds=args.backend_latency_ms / 1000), 'replay', 'telemetry')
+
+
+def build_synthetic_connector(args):
+    module = import_from(SYNTHETIC_READER_DIR, 'synthetic_udq_reader')
+    module.iottm = StubIoTTwinMakerClient()
+    return module.RENDER_READER
+
+
+def build_memory_connector(args):
+    return InMemoryDatasetReader()
+
+
+# built-in connector name -> (factory, default captured events)
+CONNECTORS = {
+    'timestream': (build_timestream_connector, ['timestream_entity_event.json']),
+    'synthetic': (build_synthetic_connector, ['synthetic_entity_event.json']),
+    'memory': (build_memory_connector, ['timestream_entity_event.json']),
+}
+
+
+def build_connector(args):
+    """
+    :return: the connector for --connector, a built-in name or module:attribute (an instance, or a class constructed without arguments)
+    """
+    if args.connector in CONNECTORS:
+        return CONNECTORS[args.connector][0](args)
+    module_name, _, attribute = args.connector.partition(':')
+    module = import_from(args.connector_path, module_name) if args.connector_path else __import__(module_name)
+    connector = getattr(module, attribute)
+    return connector() if isinstance(connector, type) else connector
+
+
+def load_events(args):
+    if args.events:
+        paths = sorted(path for pattern in args.events for path in glob.glob(pattern))
+    else:
+        paths = [f"{FIXTURES_DIR}/{name}" for name in CONNECTORS.get(args.connector, (None, ['timestream_entity_event.json']))[1]]
+    if not paths:
+        raise ValueError(f"No captured UDQ events found for {args.events}")
+    events = []
+    for path in paths:
+        with open(path) as f:
+            events.append(json.load(f))
+    return events
+
+
+def _iso8601(epoch_seconds):
+    return datetime.fromtimestamp(epoch_seconds, timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.') + '%03dZ' % (epoch_seconds % 1 * 1000)
+
+
+def window_event(event, end_seconds, window_seconds):
+    """
+    A copy of a captured event querying the window_seconds ending at end_seconds (epoch seconds)
+    """
+    event = copy.deepcopy(event)
+    start_seconds = end_seconds - window_seconds
+    event['startTime'] = _iso8601(start_seconds)
+    event['endTime'] = _iso8601(end_seconds)
+    event['startDateTime'] = int(start_seconds)
+    event['endDateTime'] = int(end_seconds)
+    event.pop('nextToken', None)
+    return event
+
+
+def refresh_schedule(panels, viewers, refresh_seconds, duration_seconds, seed=0):
+    """
+    Dashboard refresh pattern: every viewer refreshes every panel each refresh interval, starting at a random phase
+
+    :return: sorted (seconds since start, panel index) pairs
+    """
+    rng = random.Random(seed)
+    schedule = []
+    for panel in range(panels):
+        for _ in range(viewers):
+            t = rng.uniform(0, refresh_seconds)
+            while t < duration_seconds:
+                schedule.append((t, panel))
+                t += refresh_seconds
+    schedule.sort()
+    return schedule
+
+
+def percentile(sorted_values, p):
+    """
+    Nearest-rank percentile of an already sorted list
+    """
+    if not sorted_values:
+        return None
+    return sorted_values[min(len(sorted_values) - 1, max(0, int(round(p / 100 * len(sorted_values) + 0.5)) - 1))]
+
+
+def http_invoker(url):
+    def invoke(event):
+        request = urllib.request.Request(f"{url.rstrip('/')}/2015-03-31/functions/function/invocations", data=json.dumps(event).encode('utf-8'),
+                                         headers={'Content-Type': 'application/json'})
+        with urllib.request.urlopen(request) as response:
+            result = json.loads(response.read())
+            if response.headers.get('X-Amz-Function-Error'):
+                raise Exception(result.get('errorMessage'))
+            return result
+    return invoke
+
+
+def run_load(invoke, events, args):
+    """
+    Replay the refresh schedule against invoke(event), in (optionally time-compressed) real time
+
+    Latency is measured from each request's scheduled send time, so requests queued behind a saturated connector count
+    their waiting time. Service time only measures the invocation itself
+    """
+    schedule = refresh_schedule(args.panels, args.viewers, args.refresh_seconds, args.duration_seconds, args.seed)
+    latencies, service_times, errors = [], [], []
+    lock = threading.Lock()
+    simulated_start = time.time()
+
+    def send(scheduled_at, panel):
+        event = window_event(events[panel % len(events)], simulated_start + scheduled_at, args.window_seconds)
+        invoke_start = time.perf_counter()
+        try:
+            # follow nextTokens like IoT TwinMaker clients do for a panel
+            pages = 0
+            while True:
+                result = invoke(event)
+                pages += 1
+                if not result.get('nextToken') or pages >= args.max_pages:
+                    break
+                event = dict(event, nextToken=result['nextToken'])
+        except Exception as err:
+            with lock:
+                errors.append(repr(err))
+            return
+        end = time.perf_counter()
+        with lock:
+            service_times.append(end - invoke_start)
+            latencies.append(end - (wall_start + scheduled_at / args.time_scale))
+
+    if args.trace_memory:
+        tracemalloc.start()
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    wall_start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        for scheduled_at, panel in schedule:
+            delay = wall_start + scheduled_at / args.time_scale - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            executor.submit(send, scheduled_at, panel)
+    elapsed = time.perf_counter() - wall_start
+    traced_peak = tracemalloc.get_traced_memory()[1] if args.trace_memory else None
+    if args.trace_memory:
+        tracemalloc.stop()
+    rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    latencies.sort()
+    service_times.sort()
+    return {
+        'connector': args.url or args.connector,
+        'requests': len(schedule),
+        'errors': len(errors),
+        'first_error': errors[0] if errors else None,
+        'elapsed_seconds': round(elapsed, 3),
+        'throughput_rps': round(len(latencies) / elapsed, 1) if elapsed else None,
+        'latency_p50_ms': _ms(percentile(latencies, 50)),
+        'latency_p90_ms': _ms(percentile(latencies, 90)),
+        'latency_p99_ms': _ms(percentile(latencies, 99)),
+        'latency_max_ms': _ms(latencies[-1] if latencies else None),
+        'service_p50_ms': _ms(percentile(service_times, 50)),
+        'service_p99_ms': _ms(percentile(service_times, 99)),
+        # ru_maxrss is reported in KiB on Linux
+        'peak_rss_mb': round(rss_after / 1024, 1),
+        'rss_growth_mb': round((rss_after - rss_before) / 1024, 1),
+        'traced_peak_mb': round(traced_peak / (1024 * 1024), 1) if traced_peak is not None else None,
+    }
+
+
+def _ms(seconds):
+    return round(seconds * 1000, 2) if seconds is not None else None
+
+
+REPORT_COLUMNS = ['connector', 'requests', 'errors', 'throughput_rps', 'latency_p50_ms', 'latency_p90_ms', 'latency_p99_ms', 'latency_max_ms',
+                  'service_p50_ms', 'service_p99_ms', 'peak_rss_mb', 'rss_growth_mb']
+
+
+def print_report(reports):
+    print(' '.join(f"{column:>15}" for column in REPORT_COLUMNS))
+    for report in reports:
+        print(' '.join(f"{str(report.get(column)):>15}" for column in REPORT_COLUMNS))
+        if report.get('first_error'):
+            print(f"  first error: {report['first_error']}")
+
+
+def load_command(args):
+    if args.connector == 'all':
+        # one process per connector, so the memory figures don't include the other connectors
+        reports = []
+        for name in CONNECTORS:
+            command = [sys.executable, __file__] + [arg if arg != 'all' else name for arg in sys.argv[1:]] + ['--json']
+            completed = subprocess.run(command, capture_output=True, text=True)
+            if completed.returncode != 0:
+                print(f"{name}: failed\n{completed.stderr.strip().splitlines()[-1] if completed.stderr.strip() else ''}", file=sys.stderr)
+                continue
+            reports.append(json.loads(completed.stdout.strip().splitlines()[-1]))
+        print_report(reports)
+        return
+
+    events = load_events(args)
+    if args.url:
+        invoke = http_invoker(args.url)
+    else:
+        invoke = build_connector(args).process_query
+        # the sample connectors log every query result at INFO, which would dominate local measurements
+        logging.getLogger().setLevel(args.log_level)
+    report = run_load(invoke, events, args)
+    if args.json:
+        print(json.dumps(report))
+    else:
+        print_report([report])
+
+
+def serve_command(args):
+    connector = build_connector(args)
+
+    class InvokeHandler(BaseHTTPRequestHandler):
+        """
+        Serves the Lambda invoke API: the request body is the UDQ event, the response body the UDQ response
+        """
+
+        def do_POST(self):
+            event = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+            headers = {}
+            try:
+                result = connector.process_query(event)
+            except Exception as err:
+                result = {'errorMessage': str(err), 'errorType': type(err).__name__}
+                headers['X-Amz-Function-Error'] = 'Unhandled'
+            body = json.dumps(result).encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            for name, value in headers.items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    logging.getLogger().setLevel(args.log_level)
+    server = ThreadingHTTPServer((args.host, args.port), InvokeHandler)
+    print(f"Serving {args.connector} on http://{args.host}:{server.server_address[1]}/2015-03-31/functions/function/invocations")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Local UDQ replay server and load generator")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    def add_connector_args(subparser):
+        subparser.add_argument('--connector', default='timestream',
+                               help=f"built-in connector ({', '.join(CONNECTORS)}, or all for load), or module:attribute of an IoTTwinMakerUnifiedDataQuery")
+        subparser.add_argument('--connector-path', help="directory to import a module:attribute connector from")
+        subparser.add_argument('--rows', type=int, default=10_000, help="rows in the canned Timestream result")
+        subparser.add_argument('--backend-latency-ms', type=float, default=20, help="simulated latency of each canned Timestream call")
+        subparser.add_argument('--log-level', default='WARNING', help="root log level while the connector runs")
+
+    load = subparsers.add_parser('load', help="replay a dashboard refresh pattern and report latency, throughput and memory")
+    add_connector_args(load)
+    load.add_argument('--url', help="load a replay server (or any Lambda invoke API endpoint) instead of an in-process connector")
+    load.add_argument('--events', nargs='+', help="captured UDQ event JSON files (globs), assigned to panels round-robin")
+    load.add_argument('--panels', type=int, default=8)
+    load.add_argument('--viewers', type=int, default=10)
+    load.add_argument('--refresh-seconds', type=float, default=5)
+    load.add_argument('--duration-seconds', type=float, default=30)
+    load.add_argument('--window-seconds', type=float, default=3600, help="length of the window ending 'now' each refresh queries")
+    load.add_argument('--concurrency', type=int, default=8, help="concurrent invocations, like the Lambda's reserved concurrency")
+    load.add_argument('--time-scale', type=float, default=1, help="run the schedule this many times faster than real time")
+    load.add_argument('--max-pages', type=int, default=100, help="nextTokens followed per panel refresh")
+    load.add_argument('--seed', type=int, default=0)
+    load.add_argument('--trace-memory', action='store_true', help="also report the peak traced Python allocation (slows the connector)")
+    load.add_argument('--json', action='store_true', help="print the report as JSON")
+    load.set_defaults(func=load_command)
+
+    serve = subparsers.add_parser('serve', help="serve a connector on the Lambda invoke API")
+    add_connector_args(serve)
+    serve.add_argument('--host', default='127.0.0.1')
+    serve.add_argument('--port', type=int, default=9000)
+    serve.set_defaults(func=serve_command)
+
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    arguments = parse_args()
+    arguments.func(arguments)
@@ -1,29 +1,154 @@
 # Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved. 2021
 # SPDX-License-Identifier: Apache-2.0
 
-import sqlparse
+import os
+from functools import lru_cache
+from string import Formatter
+
+# number of distinct query shapes (e.g. per number of selected properties / filter operator) to keep compiled
+QUERY_TEMPLATE_CACHE_SIZE = 128
+
+# sample literal substituted into each placeholder when tokenizing a query template
+SAMPLE_LITERAL = 'abc'
+
+# characters that could terminate or escape a single-quoted literal in the eyes of the tokenizer
+UNSAFE_LITERAL_CHARS = ("'", "\\")
+
+# re-tokenize every rendered query and compare it with the token context of its template (tokenized once), the same
+# guarantee as detectInjection for a sqlparse pass per query. Set UDQ_SQL_VERIFY_TOKEN_CONTEXT=false to rely on the
+# literal check alone
+VERIFY_TOKEN_CONTEXT = os.environ.get('UDQ_SQL_VERIFY_TOKEN_CONTEXT', 'true').lower() in ('1', 'true', 'yes')
+
+
+class QueryTemplate:
+    """
+    A query shape tokenized once, whose placeholders can only be filled with literal values
+
+    Every placeholder in the template must be enclosed in single quotes, e.g. "WHERE userId = '{user_id}'", so a
+    substituted value that neither contains a quote nor a backslash stays a single string literal token. Such a value
+    cannot change the token context of the query, which is what SQLDetector.detectInjection verifies by re-tokenizing.
+    Unless UDQ_SQL_VERIFY_TOKEN_CONTEXT is false, render also verifies it against the template's token context, tokenized
+    once
+    """
+
+    def __init__(self, template: str):
+        self._template = template
+        self._fields = []
+        parsed = list(Formatter().parse(template))
+        for i, (literal_text, field_name, format_spec, conversion) in enumerate(parsed):
+            if field_name is None:
+                continue
+            next_literal_text = parsed[i + 1][0] if i + 1 < len(parsed) else ''
+            if not field_name or format_spec or conversion or not literal_text.endswith("'") or not next_literal_text.startswith("'"):
+                raise ValueError(f"Placeholder [{field_name}] must be a named single-quoted literal in query template: {template}")
+            self._fields.append(field_name)
+        self._token_context = None
+
+    @property
+    def template(self) -> str:
+        return self._template
+
+    @property
+    def token_context(self):
+        """
+        The token context of the template, tokenized once on first use (rendering doesn't need it)
+        """
+        if self._token_context is None:
+            self._token_context = SQLDetector.getQueryContext(self._template.format(**{field: SAMPLE_LITERAL for field in self._fields}))
+        return self._token_context
+
+    def render(self, **literals) -> str:
+        """
+        Substitute the given literal values into the template
+
+        Raises an Exception if a value is missing, is not a string, could break out of its enclosing literal, or (unless
+        verification is disabled) changes the rendered query's token context from the template's
+        """
+        for field in self._fields:
+            value = literals.get(field)
+            if type(value) is not str:
+                raise Exception(f"Query literal [{field}] must be a string, got: {value!r}")
+            for unsafe_char in UNSAFE_LITERAL_CHARS:
+                if unsafe_char in value:
+                    raise Exception(f"Detected potential injection from query literal [{field}]: {value}")
+        query = self._template.format(**literals)
+        if VERIFY_TOKEN_CONTEXT:
+            self.verify(query)
+        return query
+
+    def verify(self, query: str):
+        """
+        Raises an Exception if the token context of a query rendered from this template differs from the template's
+        """
+        if SQLDetector.getQueryContext(query) != self.token_context:
+            raise Exception(f'Detected potential injection from query: {query}')
+
+
+@lru_cache(maxsize=QUERY_TEMPLATE_CACHE_SIZE)
+def _compile_query_template(template: str) -> QueryTemplate:
+    return QueryTemplate(template)
+
 
 class SQLDetector:
-    
-    def getSubTokenCount(self, token):
+
+    @staticmethod
+    def getSubTokenCount(token):
         count = 0
         for _ in token.flatten():
             count += 1
         return count
 
 
-    def getQueryContext(self, query):
+    @staticmethod
+    def getQueryContext(query):
+        # sqlparse is only needed to tokenize, import it on first use to keep it out of the cold start
+        import sqlparse
+
         tokenContext = []
         statements = sqlparse.parse(query)
         for statement in statements:
             for token in statement.tokens:
-                tokenContext.append(self.getSubTokenCount(token))
+                tokenContext.append(SQLDetector.getSubTokenCount(token))
         return tokenContext
 
 
+    @staticmethod
+    @lru_cache(maxsize=QUERY_TEMPLATE_CACHE_SIZE)
+    def _getSampleQueryContext(sampleQuery):
+        return tuple(SQLDetector.getQueryContext(sampleQuery))
+
+
+    def compileQuery(self, template):
+        """Compile a query template into a QueryTemplate, validating each distinct template only once.
+
+        Compiled templates are kept in an LRU cache, so per request only the substituted literals are validated.
+
+        Parameters
+        ----------
+            template: string, required
+                The query shape, with str.format placeholders that are each enclosed in single quotes.
+
+        Returns
+        -------
+            The compiled QueryTemplate. Throws Exception if a placeholder is not a single-quoted literal.
+
+        Examples
+        --------
+            detector = SQLDetector()
+
+            template = detector.compileQuery("SELECT * FROM users WHERE userId = '{user_id}'")
+
+            template.render(user_id='abc_ef-gh') # no issue, no exception
+
+            template.render(user_id="abc' OR 1=1 --") # Exception throws!
+        """
+        return _compile_query_template(template)
+
+
     def detectInjection(self, sampleQuery, query):
         """Detection potential SQL Injection by comparing token context of sample query and real time query.
         Note: whitespace tokens expected to match as well.
+        The token context of each distinct sample query is computed once and cached.
 
         Parameters
         ----------
@@ -48,9 +173,7 @@ class SQLDetector:
             query_injected = "SELECT * FROM users WHERE userId = 'abc' OR 1=1"
             detector.detectInjection(sample_query, query_injected) # Exception throws!
         """
-        sampleTokenContext = self.getQueryContext(sampleQuery)
+        sampleTokenContext = list(self._getSampleQueryContext(sampleQuery))
         tokenContext = self.getQueryContext(query)
         if not sampleTokenContext == tokenContext:
             raise Exception(f'Detected potential injection from query: {query}')
-
-    
@@ -19,6 +19,12 @@ from udq_utils.udq_models import IoTTwinMakerReference, IoTTwinMakerUnifiedDataQ
 #        your implementation is a wrapper on the data rows retrieved from your data source and is responsible for
 #        extracting the entityPropertyReference, timestamp, and value from the data row
 #
+#      alternatively, return an IoTTwinMakerUdqColumnarResponse with parallel arrays of reference ids, timestamps and values
+#        this avoids creating a python object per data point and lets the framework group and serialize values in bulk
+#
+#      connectors that make several backend calls per request can instead extend AsyncSingleEntityReader / AsyncMultiEntityReader
+#        and fan the calls out concurrently with udq_utils.udq_async.gather_with_concurrency
+#
 #   3. Invoke process_query(lambda_event) in your lambda handler on your connector implementation
 #      this will invoke IoTTwinMakerUnifiedDataQuery.process_query() which will handle JSON payload marshalling/unmarshalling and
 #      invoke your above implementations to fetch and process the query results
@@ -100,6 +106,75 @@ class IoTTwinMakerUdqResponse:
     def next_token(self):
         return self._next_token
 
+    def iterate_values(self):
+        """
+        Yield (IoTTwinMakerReference, ISO8601 timestamp, value) for each row
+        """
+        for row in self._rows:
+            timestamp = row.get_iso8601_timestamp()
+            if timestamp is None:
+                timestamp = row.get_timestamp().strftime('%Y-%m-%dT%H:%M:%S.000Z')
+            yield row.get_iottwinmaker_reference(), timestamp, row.get_value()
+
+    def __str__(self):
+        return str(self.__dict__)
+
+
+class IoTTwinMakerUdqColumnarResponse:
+    """
+    IoTTwinMakerUdqColumnarResponse is a columnar alternative to IoTTwinMakerUdqResponse for connectors returning many data points
+
+    Instead of one IoTTwinMakerDataRow per value it consists of:
+    - references: the distinct IoTTwinMakerReferences in this response
+    - reference_ids: for each data point, the index of its reference in references
+    - timestamps: for each data point, the timestamp as an ISO8601 string
+    - values: for each data point, the data value as a python-native type
+    and an optional nextToken for pagination
+
+    The UDQ framework groups the columns by reference id and serializes each group in bulk
+    """
+
+    def __init__(self, references: List[IoTTwinMakerReference], reference_ids: List[int], timestamps: List[str], values: List,
+                 next_token: str = None):
+        if not len(reference_ids) == len(timestamps) == len(values):
+            raise ValueError(f"Column lengths do not match: reference_ids[{len(reference_ids)}], timestamps[{len(timestamps)}], values[{len(values)}]")
+        self._references = references
+        self._reference_ids = reference_ids
+        self._timestamps = timestamps
+        self._values = values
+        self._next_token = next_token
+
+    @property
+    def references(self):
+        return self._references
+
+    @property
+    def reference_ids(self):
+        return self._reference_ids
+
+    @property
+    def timestamps(self):
+        return self._timestamps
+
+    @property
+    def values(self):
+        return self._values
+
+    @property
+    def next_token(self):
+        return self._next_token
+
+    def __len__(self):
+        return len(self._reference_ids)
+
+    def iterate_values(self):
+        """
+        Yield (IoTTwinMakerReference, ISO8601 timestamp, value) for each data point
+        """
+        references = self._references
+        for reference_id, timestamp, value in zip(self._reference_ids, self._timestamps, self._values):
+            yield references[reference_id], timestamp, value
+
     def __str__(self):
         return str(self.__dict__)
 
@@ -124,3 +199,27 @@ class MultiEntityReader(IoTTwinMakerUnifiedDataQuery, ABC):
     @abstractmethod
     def component_type_query(self, request: IoTTwinMakerUDQComponentTypeRequest) -> IoTTwinMakerUdqResponse:
         raise NotImplementedError("component_type_query not implemented")
+
+
+class AsyncSingleEntityReader(SingleEntityReader, ABC):
+    """
+    Interface for an AWS IoT TwinMaker UDQ connector that supports single-entity queries with an async implementation
+
+    Connector authors must implement the entity_query coroutine. process_query runs it on an event loop shared across warm
+    invocations, use process_query_async when already running in an event loop
+    """
+    @abstractmethod
+    async def entity_query(self, request: IoTTwinMakerUDQEntityRequest) -> IoTTwinMakerUdqResponse:
+        raise NotImplementedError("entity_query not implemented")
+
+
+class AsyncMultiEntityReader(MultiEntityReader, ABC):
+    """
+    Interface for an AWS IoT TwinMaker UDQ connector that supports multi-entity queries with an async implementation
+
+    Connector authors must implement the component_type_query coroutine. process_query runs it on an event loop shared across
+    warm invocations, use process_query_async when already running in an event loop
+    """
+    @abstractmethod
+    async def component_type_query(self, request: IoTTwinMakerUDQComponentTypeRequest) -> IoTTwinMakerUdqResponse:
+        raise NotImplementedError("component_type_query not implemented")
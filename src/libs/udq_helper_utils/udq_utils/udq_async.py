@@ -0,0 +1,69 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+import asyncio
+import functools
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+# ---------------------------------------------------------------------------
+#   Async helpers for UDQ connectors
+#
+#   The event loop and its thread pool live at module level so they are created once per Lambda container and reused
+#   across warm invocations. Blocking SDK calls (e.g. boto3) are run on the thread pool with run_blocking, and
+#   independent sub-queries can be fanned out with gather_with_concurrency
+# ---------------------------------------------------------------------------
+
+# default cap on concurrent sub-queries / blocking calls per invocation
+DEFAULT_MAX_CONCURRENCY = 10
+try:
+    DEFAULT_MAX_CONCURRENCY = int(os.environ['UDQ_MAX_CONCURRENCY'])
+except:
+    pass # use default concurrency
+
+_EVENT_LOOP = None
+
+
+def get_event_loop() -> asyncio.AbstractEventLoop:
+    """
+    :return: the event loop shared across invocations in this container, created on first use
+    """
+    global _EVENT_LOOP
+    if _EVENT_LOOP is None or _EVENT_LOOP.is_closed():
+        _EVENT_LOOP = asyncio.new_event_loop()
+        _EVENT_LOOP.set_default_executor(ThreadPoolExecutor(max_workers=DEFAULT_MAX_CONCURRENCY, thread_name_prefix='udq'))
+    return _EVENT_LOOP
+
+
+def run_coroutine(coro):
+    """
+    Run a coroutine to completion on the shared event loop from synchronous code (e.g. a Lambda handler)
+    """
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return get_event_loop().run_until_complete(coro)
+    coro.close()
+    raise RuntimeError("run_coroutine called from a running event loop, await the coroutine (e.g. process_query_async) instead")
+
+
+async def run_blocking(func, *args, **kwargs):
+    """
+    Run a blocking function (e.g. a boto3 client call) on the event loop's thread pool and await its result
+    """
+    return await asyncio.get_running_loop().run_in_executor(None, functools.partial(func, *args, **kwargs))
+
+
+async def gather_with_concurrency(*aws, limit: int = None):
+    """
+    Like asyncio.gather, but runs at most `limit` of the given awaitables at a time
+
+    Results are returned in the order of the given awaitables
+    """
+    semaphore = asyncio.Semaphore(limit or DEFAULT_MAX_CONCURRENCY)
+
+    async def run_limited(aw):
+        async with semaphore:
+            return await aw
+
+    return await asyncio.gather(*[run_limited(aw) for aw in aws])
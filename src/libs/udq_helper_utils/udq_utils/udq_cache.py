@@ -0,0 +1,158 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+
+# ---------------------------------------------------------------------------
+#   Warm-container response cache for repeated UDQ requests
+#
+#   Dashboards with many viewers send the same UDQ request for the same entity and window over and over. A ResponseCache
+#   assigned to IoTTwinMakerUnifiedDataQuery.response_cache keeps marshalled responses in the Lambda container, keyed by a
+#   normalized fingerprint of the request, and evicts least recently used entries once its byte budget is exceeded.
+#   Responses are held serialized, so a caller changing a response it got (or put) doesn't change the cached one
+#
+#   Windows that end before now - settle_seconds can no longer change and are kept for historical_ttl_seconds, windows
+#   touching "now" only for ttl_seconds. The cache is opt-in: set UDQ_RESPONSE_CACHE_MAX_BYTES to enable a shared cache
+#   for all connectors, or assign a ResponseCache to a connector
+# ---------------------------------------------------------------------------
+
+DEFAULT_TTL_SECONDS = 5
+DEFAULT_HISTORICAL_TTL_SECONDS = 300
+DEFAULT_SETTLE_SECONDS = 60
+
+
+def request_cache_key(request, page_position=None) -> str:
+    """
+    Normalized fingerprint of everything that determines a UDQ response: workspace, entity or component type, entity
+    properties, selected properties, filters, window, order, page size and page token
+
+    :param page_position: fingerprints the request resumed at this page position instead of its own
+    """
+    fields = [
+        request.udq_context['workspace_id'],
+        request.entity_id,
+        request.component_name,
+        request.component_type_id,
+        request.udq_context['properties'],
+        request.selected_properties,
+        request.property_filters,
+        request.start_time,
+        request.end_time,
+        request.order_by.name,
+        request.max_rows,
+        request.next_token,
+        page_position if page_position is not None else request.page_position,
+    ]
+    return hashlib.sha256(json.dumps(fields, sort_keys=True, separators=(',', ':'), default=str).encode('utf-8')).hexdigest()
+
+
+def request_end_epoch_seconds(request):
+    """
+    End of the request window in epoch seconds, or None if it can't be determined
+    """
+    if request.end_datetime is not None:
+        return request.end_datetime.replace(tzinfo=timezone.utc).timestamp()
+    try:
+        return datetime.fromisoformat(request.end_time.replace('Z', '+00:00')).timestamp()
+    except (AttributeError, ValueError):
+        return None
+
+
+class ResponseCache:
+    """
+    Thread-safe LRU + TTL cache of marshalled UDQ responses, bounded by their total serialized size
+    """
+
+    def __init__(self, max_bytes: int, ttl_seconds: float = DEFAULT_TTL_SECONDS, historical_ttl_seconds: float = DEFAULT_HISTORICAL_TTL_SECONDS,
+                 settle_seconds: float = DEFAULT_SETTLE_SECONDS, clock=time.time):
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.historical_ttl_seconds = historical_ttl_seconds
+        self.settle_seconds = settle_seconds
+        self._clock = clock
+        self._entries = OrderedDict() # key -> (expires_at, size, serialized response)
+        self._size = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @property
+    def size_bytes(self) -> int:
+        return self._size
+
+    def __len__(self):
+        return len(self._entries)
+
+    def ttl_for(self, request) -> float:
+        """
+        Time to live for a request's response: longer for windows that ended in the past and can no longer change
+        """
+        end_seconds = request_end_epoch_seconds(request)
+        if end_seconds is not None and end_seconds < self._clock() - self.settle_seconds:
+            return self.historical_ttl_seconds
+        return self.ttl_seconds
+
+    def get(self, key: str):
+        """
+        :return: a copy of the cached response for key, or None on a miss
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > self._clock():
+                self._entries.move_to_end(key)
+                self.hits += 1
+            else:
+                if entry is not None:
+                    self._remove(key)
+                self.misses += 1
+                return None
+        return json.loads(entry[2])
+
+    def put(self, key: str, response: dict, ttl_seconds: float):
+        """
+        Cache a response, evicting the least recently used entries to stay within max_bytes
+        Responses larger than the whole cache are not cached
+        """
+        if ttl_seconds <= 0:
+            return
+        serialized = json.dumps(response)
+        size = len(serialized)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (self._clock() + ttl_seconds, size, serialized)
+            self._size += size
+            while self._size > self.max_bytes:
+                oldest_key = next(iter(self._entries))
+                self._remove(oldest_key)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+    def _remove(self, key):
+        _, size, _ = self._entries.pop(key)
+        self._size -= size
+
+
+def default_response_cache():
+    """
+    :return: a ResponseCache configured from UDQ_RESPONSE_CACHE_* environment variables, or None if not enabled
+    """
+    max_bytes = os.environ.get('UDQ_RESPONSE_CACHE_MAX_BYTES')
+    if not max_bytes:
+        return None
+    return ResponseCache(int(max_bytes),
+                         ttl_seconds=float(os.environ.get('UDQ_RESPONSE_CACHE_TTL_SECONDS', DEFAULT_TTL_SECONDS)),
+                         historical_ttl_seconds=float(os.environ.get('UDQ_RESPONSE_CACHE_HISTORICAL_TTL_SECONDS', DEFAULT_HISTORICAL_TTL_SECONDS)))
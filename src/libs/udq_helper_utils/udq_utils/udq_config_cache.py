@@ -0,0 +1,106 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+import logging
+import os
+import threading
+import time
+
+# ---------------------------------------------------------------------------
+#   Warm-container cache of configuration values with stale-while-revalidate
+#
+#   Connectors may read control flags from another service on every request, e.g. a property of an IoT TwinMaker entity
+#   switching a simulation mode. A ConfigCache keeps the loaded value in the warm container:
+#
+#       generate_errors = config_cache.get(('generate_error_states', workspace_id), lambda: load_flag(workspace_id))
+#
+#   A value younger than ttl_seconds is returned as is. Up to stale_seconds after that, the stale value is still
+#   returned immediately while a single background thread reloads it; older (or missing) values are loaded synchronously.
+#   When a reload fails the last known value keeps being served, a synchronous load without a value to fall back on
+#   raises. Defaults are read from UDQ_CONFIG_TTL_SECONDS and UDQ_CONFIG_STALE_SECONDS, a TTL of 0 loads every time
+# ---------------------------------------------------------------------------
+
+LOGGER = logging.getLogger(__name__)
+
+DEFAULT_CONFIG_TTL_SECONDS = 30
+DEFAULT_CONFIG_STALE_SECONDS = 300
+
+
+class ConfigCache:
+    """
+    Thread-safe TTL cache of configuration values, serving stale values while they are refreshed in the background
+    """
+
+    def __init__(self, ttl_seconds: float = DEFAULT_CONFIG_TTL_SECONDS, stale_seconds: float = DEFAULT_CONFIG_STALE_SECONDS,
+                 clock=time.time):
+        self.ttl_seconds = ttl_seconds
+        self.stale_seconds = stale_seconds
+        self._clock = clock
+        self._entries = {} # key -> (loaded_at, value)
+        self._refreshing = set()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+
+    def get(self, key, load):
+        """
+        The value for key, calling load() synchronously if it isn't held or is too old, or in the background if it is stale
+        """
+        if self.ttl_seconds <= 0:
+            return load()
+        now = self._clock()
+        with self._lock:
+            entry = self._entries.get(key)
+            age = now - entry[0] if entry is not None else None
+            if age is not None and age < self.ttl_seconds:
+                self.hits += 1
+                return entry[1]
+            if age is not None and age < self.ttl_seconds + self.stale_seconds:
+                self.stale_hits += 1
+                if key not in self._refreshing:
+                    self._refreshing.add(key)
+                    threading.Thread(target=self._refresh, args=(key, load), daemon=True).start()
+                return entry[1]
+            self.misses += 1
+
+        try:
+            value = load()
+        except Exception as e:
+            if entry is None:
+                raise
+            LOGGER.warning("Failed to reload configuration [%s], serving the last known value: %s", key, e)
+            return entry[1]
+        self._store(key, value)
+        return value
+
+    def invalidate(self, key=None):
+        """
+        Drop the value for key, or all values
+        """
+        with self._lock:
+            if key is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(key, None)
+
+    def _refresh(self, key, load):
+        try:
+            self._store(key, load())
+        except Exception as e:
+            LOGGER.warning("Failed to refresh configuration [%s] in the background: %s", key, e)
+        finally:
+            with self._lock:
+                self._refreshing.discard(key)
+
+    def _store(self, key, value):
+        with self._lock:
+            self._entries[key] = (self._clock(), value)
+
+
+def default_config_cache():
+    """
+    :return: a ConfigCache configured from UDQ_CONFIG_* environment variables
+    """
+    return ConfigCache(float(os.environ.get('UDQ_CONFIG_TTL_SECONDS', DEFAULT_CONFIG_TTL_SECONDS)),
+                       stale_seconds=float(os.environ.get('UDQ_CONFIG_STALE_SECONDS', DEFAULT_CONFIG_STALE_SECONDS)))
@@ -0,0 +1,222 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+import base64
+import hashlib
+import hmac
+import json
+import logging
+import os
+import struct
+import zlib
+
+from udq_utils.udq_models import IoTTwinMakerUdqRequest
+
+# ---------------------------------------------------------------------------
+#   Resumable cursor tokens for connectors without native pagination
+#
+#   A cursor records where a connector stopped (the index of the selected property and the row offset within it) so the
+#   next page can resume in O(1) instead of re-scanning earlier data. Tokens are compact (base64url of 19 bytes, an 11 byte
+#   cursor and an 8 byte signature) and signed with an HMAC over the cursor and a fingerprint of the request, so a token
+#   is rejected if it was tampered with or is replayed against a different query
+#
+#   Connectors merging several backend queries (e.g. one per measure) resume each of them from its own backend token,
+#   CompositeCursorCodec packs these positions into one signed nextToken
+#
+#   Set UDQ_CURSOR_SECRET_ARN on the connector Lambda to sign tokens with a private key held in AWS Secrets Manager (the
+#   CDK stacks generate one per deployment and grant the readers access), it is read once per container. The key is not
+#   passed in the environment, where anyone reading the function configuration could forge tokens with it (UDQ_CURSOR_SECRET
+#   sets it directly for local runs). Without either, tokens are signed with a random key of the container, so they only
+#   resume on the container that issued them: no key is derived from public values such as the function name
+# ---------------------------------------------------------------------------
+
+CURSOR_TOKEN_VERSION = 1
+
+# version, property index, row offset
+_CURSOR_FORMAT = '>BHQ'
+_CURSOR_SIZE = struct.calcsize(_CURSOR_FORMAT)
+_SIGNATURE_SIZE = 8
+
+_CONTAINER_SECRET = None
+
+LOGGER = logging.getLogger(__name__)
+
+
+class Cursor:
+    """
+    Position of a paginated connector response: the index of the selected property and the row offset within it
+    """
+    __slots__ = ('_property_index', '_row_offset')
+
+    def __init__(self, property_index: int = 0, row_offset: int = 0):
+        self._property_index = property_index
+        self._row_offset = row_offset
+
+    @property
+    def property_index(self) -> int:
+        return self._property_index
+
+    @property
+    def row_offset(self) -> int:
+        return self._row_offset
+
+    def __eq__(self, other):
+        if not isinstance(other, Cursor):
+            return NotImplemented
+        return (self._property_index, self._row_offset) == (other._property_index, other._row_offset)
+
+    def __repr__(self):
+        return f"Cursor(property_index={self._property_index}, row_offset={self._row_offset})"
+
+
+def request_fingerprint(request: IoTTwinMakerUdqRequest) -> bytes:
+    """
+    Digest of the fields that identify a query, independent of its page (nextToken and maxResults)
+    """
+    fields = [
+        request.udq_context['workspace_id'],
+        request.entity_id,
+        request.component_name,
+        request.component_type_id,
+        request.selected_properties,
+        request.start_time,
+        request.end_time,
+        request.order_by.name,
+        request.property_filters,
+    ]
+    return hashlib.sha256(json.dumps(fields, sort_keys=True, separators=(',', ':')).encode('utf-8')).digest()
+
+
+def default_cursor_secret() -> bytes:
+    """
+    UDQ_CURSOR_SECRET, or the secret UDQ_CURSOR_SECRET_ARN refers to (read once per container), or a random key generated
+    once per container if neither is set or the secret can't be read
+    """
+    global _CONTAINER_SECRET
+    secret = os.environ.get('UDQ_CURSOR_SECRET')
+    if secret:
+        return secret.encode('utf-8')
+    if _CONTAINER_SECRET is None:
+        secret_arn = os.environ.get('UDQ_CURSOR_SECRET_ARN')
+        if secret_arn:
+            try:
+                _CONTAINER_SECRET = _read_secret(secret_arn)
+            except Exception:
+                LOGGER.warning("Could not read the cursor secret [%s], nextTokens are signed with a random key and only resume "
+                               "on the container that issued them", secret_arn, exc_info=True)
+        elif 'AWS_LAMBDA_FUNCTION_NAME' in os.environ:
+            LOGGER.warning("UDQ_CURSOR_SECRET_ARN is not set, nextTokens are signed with a random key and only resume on the "
+                           "container that issued them")
+        if _CONTAINER_SECRET is None:
+            _CONTAINER_SECRET = os.urandom(32)
+    return _CONTAINER_SECRET
+
+
+def _read_secret(secret_arn) -> bytes:
+    import boto3
+    secret = boto3.client('secretsmanager').get_secret_value(SecretId=secret_arn)['SecretString']
+    if not secret:
+        raise ValueError(f"Secret [{secret_arn}] is empty")
+    return secret.encode('utf-8')
+
+
+class CursorCodec:
+    """
+    Encodes Cursors into signed nextTokens bound to a request, and decodes them back
+
+    Example:
+        codec = CursorCodec()
+        next_token = codec.encode(Cursor(property_index=1, row_offset=500), request)
+        ...
+        cursor = codec.decode(next_page_request) # Cursor(property_index=1, row_offset=500), or Cursor() for the first page
+    """
+
+    def __init__(self, secret: bytes = None):
+        self._secret = secret if secret is not None else default_cursor_secret()
+
+    def encode(self, cursor: Cursor, request: IoTTwinMakerUdqRequest) -> str:
+        payload = struct.pack(_CURSOR_FORMAT, CURSOR_TOKEN_VERSION, cursor.property_index, cursor.row_offset)
+        token = payload + self._sign(payload, request_fingerprint(request))
+        return base64.urlsafe_b64encode(token).decode('ascii').rstrip('=')
+
+    def decode(self, request: IoTTwinMakerUdqRequest, token: str = None) -> Cursor:
+        """
+        Decode the request's nextToken (or `token`, e.g. a token unwrapped from a prefixed nextToken), or return the
+        initial Cursor if there is none
+
+        Raises an Exception if the token is malformed, was tampered with, or belongs to a different query
+        """
+        if token is None:
+            token = request.next_token
+        if not token:
+            return Cursor()
+        try:
+            raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        except Exception:
+            raise Exception(f"Invalid nextToken[{token}]")
+        payload, signature = raw[:_CURSOR_SIZE], raw[_CURSOR_SIZE:]
+        if len(payload) != _CURSOR_SIZE or not hmac.compare_digest(signature, self._sign(payload, request_fingerprint(request))):
+            raise Exception(f"Invalid nextToken[{token}] for this request")
+        version, property_index, row_offset = struct.unpack(_CURSOR_FORMAT, payload)
+        if version != CURSOR_TOKEN_VERSION:
+            raise Exception(f"Unsupported nextToken version[{version}]")
+        return Cursor(property_index, row_offset)
+
+    def _sign(self, payload: bytes, fingerprint: bytes) -> bytes:
+        return hmac.new(self._secret, payload + fingerprint, hashlib.sha256).digest()[:_SIGNATURE_SIZE]
+
+
+class CompositeCursorCodec:
+    """
+    Encodes a list of JSON-serializable positions (e.g. one backend NextToken per measure, None for finished ones) into
+    one signed nextToken bound to a request, marked with a prefix so connectors can tell it from other tokens
+
+    Example:
+        codec = CompositeCursorCodec('udqpm:')
+        next_token = codec.encode([['<timestream token>', 20], None], request)
+        ...
+        if codec.accepts(next_page_request.next_token):
+            positions = codec.decode(next_page_request) # [['<timestream token>', 20], None]
+    """
+
+    def __init__(self, prefix: str, secret: bytes = None):
+        self._prefix = prefix
+        self._secret = secret if secret is not None else default_cursor_secret()
+
+    @property
+    def prefix(self) -> str:
+        return self._prefix
+
+    def accepts(self, token) -> bool:
+        return bool(token) and token.startswith(self._prefix)
+
+    def encode(self, positions: list, request: IoTTwinMakerUdqRequest) -> str:
+        payload = zlib.compress(json.dumps([CURSOR_TOKEN_VERSION, positions], separators=(',', ':')).encode('utf-8'))
+        token = self._sign(payload, request_fingerprint(request)) + payload
+        return self._prefix + base64.urlsafe_b64encode(token).decode('ascii').rstrip('=')
+
+    def decode(self, request: IoTTwinMakerUdqRequest, token: str = None) -> list:
+        """
+        Decode the request's nextToken (or `token`) back into its positions
+
+        Raises an Exception if the token is malformed, was tampered with, or belongs to a different query
+        """
+        if token is None:
+            token = request.next_token
+        if not self.accepts(token):
+            raise Exception(f"Invalid nextToken[{token}]")
+        encoded = token[len(self._prefix):]
+        try:
+            raw = base64.urlsafe_b64decode(encoded + '=' * (-len(encoded) % 4))
+        except Exception:
+            raise Exception(f"Invalid nextToken[{token}]")
+        signature, payload = raw[:_SIGNATURE_SIZE], raw[_SIGNATURE_SIZE:]
+        if not payload or not hmac.compare_digest(signature, self._sign(payload, request_fingerprint(request))):
+            raise Exception(f"Invalid nextToken[{token}] for this request")
+        version, positions = json.loads(zlib.decompress(payload))
+        if version != CURSOR_TOKEN_VERSION:
+            raise Exception(f"Unsupported nextToken version[{version}]")
+        return positions
+
+    def _sign(self, payload: bytes, fingerprint: bytes) -> bytes:
+        return hmac.new(self._secret, payload + fingerprint, hashlib.sha256).digest()[:_SIGNATURE_SIZE]
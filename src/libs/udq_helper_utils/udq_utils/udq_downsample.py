@@ -0,0 +1,210 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+import math
+import os
+
+# ---------------------------------------------------------------------------
+#   Server-side downsampling of long-range UDQ queries
+#
+#   A panel zoomed out to 30 days draws ~1,500 pixels, shipping every raw point to the browser is wasted work. When
+#   downsampling is enabled, IoTTwinMakerUnifiedDataQuery reduces each numeric property series of the connector response
+#   to about max_points values, either with
+#   - 'lttb': Largest-Triangle-Three-Buckets, keeping the visually significant points
+#   - 'minmax': the first, min, max and last value of each time bucket (buckets aligned to multiples of the bucket width)
+#
+#   Downsampling is enabled for all requests of a connector (IoTTwinMakerUnifiedDataQuery.downsampling, or the
+#   UDQ_DOWNSAMPLE_MAX_POINTS / UDQ_DOWNSAMPLE_METHOD environment variables), or per entity / component type with the
+#   udqDownsampleMaxPoints / udqDownsampleMethod properties. Connectors that can aggregate natively (e.g. Timestream bin())
+#   push the bucketing into the backend query by overriding IoTTwinMakerUnifiedDataQuery.pushes_down_downsampling
+#
+#   Downsampling uses NumPy, which is imported on first use (e.g. available from the AWS SDK for pandas Lambda layer).
+#   It applies to the values of one connector response, i.e. per page for paginated connectors
+# ---------------------------------------------------------------------------
+
+LTTB = 'lttb'
+MINMAX = 'minmax'
+DOWNSAMPLE_METHODS = (LTTB, MINMAX)
+
+# entity / component type properties enabling downsampling for their requests
+MAX_POINTS_PROPERTY = 'udqDownsampleMaxPoints'
+METHOD_PROPERTY = 'udqDownsampleMethod'
+
+# min/max buckets contribute up to 4 values each (first, min, max, last)
+VALUES_PER_MINMAX_BUCKET = 4
+
+NANOS_PER_MILLI = 1_000_000
+
+
+def _numpy():
+    try:
+        import numpy
+    except ImportError:
+        raise Exception("Downsampling requires numpy, add it to the connector Lambda (e.g. the AWS SDK for pandas layer)")
+    return numpy
+
+
+class Downsampling:
+    """
+    Downsampling configuration: the target number of values per property series, and the method
+    """
+    __slots__ = ('_max_points', '_method')
+
+    def __init__(self, max_points: int, method: str = LTTB):
+        if method not in DOWNSAMPLE_METHODS:
+            raise ValueError(f"Unsupported downsampling method [{method}], expected one of {DOWNSAMPLE_METHODS}")
+        if max_points < VALUES_PER_MINMAX_BUCKET:
+            raise ValueError(f"Downsampling max_points must be at least {VALUES_PER_MINMAX_BUCKET}, got {max_points}")
+        self._max_points = max_points
+        self._method = method
+
+    @property
+    def max_points(self) -> int:
+        return self._max_points
+
+    @property
+    def method(self) -> str:
+        return self._method
+
+    def bucket_width_ms(self, start_ns: int, end_ns: int) -> int:
+        """
+        Width in milliseconds of the min/max buckets covering (start, end] with about max_points values
+        """
+        num_buckets = max(1, self._max_points // VALUES_PER_MINMAX_BUCKET)
+        return max(1, math.ceil((end_ns - start_ns) / num_buckets / NANOS_PER_MILLI))
+
+    @staticmethod
+    def from_request(request):
+        """
+        :return: the Downsampling configured by the udqDownsampleMaxPoints / udqDownsampleMethod properties of the
+                 request's entity or component type, or None if not configured
+        """
+        properties = request.udq_context['properties']
+        max_points_value = (properties.get(MAX_POINTS_PROPERTY) or {}).get('value') or {}
+        max_points = max_points_value.get('integerValue', max_points_value.get('longValue'))
+        if max_points is None:
+            return None
+        method_value = (properties.get(METHOD_PROPERTY) or {}).get('value') or {}
+        return Downsampling(int(max_points), method_value.get('stringValue', LTTB))
+
+    def __repr__(self):
+        return f"Downsampling(max_points={self._max_points}, method={self._method!r})"
+
+
+def default_downsampling():
+    """
+    :return: a Downsampling configured from the UDQ_DOWNSAMPLE_* environment variables, or None if not enabled
+    """
+    max_points = os.environ.get('UDQ_DOWNSAMPLE_MAX_POINTS')
+    if not max_points:
+        return None
+    return Downsampling(int(max_points), os.environ.get('UDQ_DOWNSAMPLE_METHOD', LTTB))
+
+
+def lttb_indices(timestamps_ns, values, max_points: int):
+    """
+    Largest-Triangle-Three-Buckets over a series sorted by time
+
+    :return: the sorted indices of the max_points selected values (all indices if the series is not larger)
+    """
+    np = _numpy()
+    n = len(timestamps_ns)
+    if n <= max_points or max_points < 3:
+        return np.arange(n)
+
+    # relative times keep nanosecond epochs within float precision
+    x = (timestamps_ns - timestamps_ns[0]).astype(np.float64)
+    y = values
+
+    # the first and last values are always kept, the values in between are split into max_points - 2 buckets
+    edges = np.linspace(1, n - 1, max_points - 1).astype(np.int64)
+    counts = np.diff(edges)
+    average_x = np.add.reduceat(x[:n - 1], edges[:-1]) / counts
+    average_y = np.add.reduceat(y[:n - 1], edges[:-1]) / counts
+
+    selected = np.empty(max_points, dtype=np.int64)
+    selected[0] = 0
+    selected[-1] = n - 1
+    a = 0
+    num_buckets = max_points - 2
+    for i in range(num_buckets):
+        lo, hi = edges[i], edges[i + 1]
+        # the third triangle vertex is the average of the next bucket (the last value for the last bucket)
+        if i + 1 < num_buckets:
+            next_x, next_y = average_x[i + 1], average_y[i + 1]
+        else:
+            next_x, next_y = x[n - 1], y[n - 1]
+        areas = np.abs((x[a] - next_x) * (y[lo:hi] - y[a]) - (x[a] - x[lo:hi]) * (next_y - y[a]))
+        a = lo + int(np.argmax(areas))
+        selected[i + 1] = a
+    return selected
+
+
+def minmax_indices(timestamps_ns, values, bucket_width_ns: int):
+    """
+    First, min, max and last value of each time bucket of a series sorted by time, with buckets aligned to multiples of
+    bucket_width_ns since the epoch (like Timestream bin())
+
+    :return: the sorted, distinct indices of the selected values
+    """
+    np = _numpy()
+    n = len(timestamps_ns)
+    if n == 0:
+        return np.arange(0)
+
+    buckets = timestamps_ns // bucket_width_ns
+    starts = np.flatnonzero(np.concatenate(([True], buckets[1:] != buckets[:-1])))
+    lasts = np.concatenate((starts[1:], [n])) - 1
+    # sorting by (bucket, value) puts each bucket's min first, (bucket, -value) its max, stable for ties
+    argmins = np.lexsort((values, buckets))[starts]
+    argmaxs = np.lexsort((-values, buckets))[starts]
+    return np.unique(np.concatenate((starts, argmins, argmaxs, lasts)))
+
+
+def _is_numeric(values) -> bool:
+    return all(type(value) is float or type(value) is int for value in values)
+
+
+def downsample_response(udq_response, downsampling: Downsampling, start_time: str, end_time: str):
+    """
+    Downsample each numeric property series of a connector response, keeping the response's order
+    Series that are not numeric or already within max_points are kept as is
+
+    :return: an IoTTwinMakerUdqColumnarResponse with the downsampled values
+    """
+    from udq_utils.udq import IoTTwinMakerUdqColumnarResponse
+    from udq_utils.udq_window_cache import iso8601_to_epoch_ns
+
+    np = _numpy()
+
+    series_by_reference = {}
+    for reference, timestamp, value in udq_response.iterate_values():
+        series = series_by_reference.get(reference)
+        if series is None:
+            series = series_by_reference[reference] = ([], [])
+        series[0].append(timestamp)
+        series[1].append(value)
+
+    bucket_width_ns = downsampling.bucket_width_ms(iso8601_to_epoch_ns(start_time), iso8601_to_epoch_ns(end_time)) * NANOS_PER_MILLI
+
+    references, reference_ids, timestamps, values = [], [], [], []
+    for reference, (series_timestamps, series_values) in series_by_reference.items():
+        if len(series_values) > downsampling.max_points and _is_numeric(series_values):
+            timestamps_ns = np.fromiter((iso8601_to_epoch_ns(timestamp) for timestamp in series_timestamps), dtype=np.int64, count=len(series_timestamps))
+            order = np.argsort(timestamps_ns, kind='stable')
+            sorted_values = np.asarray(series_values, dtype=np.float64)[order]
+            if downsampling.method == LTTB:
+                selected = lttb_indices(timestamps_ns[order], sorted_values, downsampling.max_points)
+            else:
+                selected = minmax_indices(timestamps_ns[order], sorted_values, bucket_width_ns)
+            # map back to positions in the response, so descending series stay descending
+            positions = np.sort(order[selected]).tolist()
+            series_timestamps = [series_timestamps[i] for i in positions]
+            series_values = [series_values[i] for i in positions]
+
+        reference_ids.extend([len(references)] * len(series_values))
+        references.append(reference)
+        timestamps.extend(series_timestamps)
+        values.extend(series_values)
+
+    return IoTTwinMakerUdqColumnarResponse(references, reference_ids, timestamps, values, udq_response.next_token)
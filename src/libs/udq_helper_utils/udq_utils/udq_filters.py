@@ -0,0 +1,186 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+import math
+from typing import List
+
+# ---------------------------------------------------------------------------
+#   Compilation of UDQ propertyFilters into backend predicates
+#
+#   Every propertyFilters entry of a request is parsed into a PropertyFilter (operator, typed value) and compiled into a
+#   SQL predicate fragment for a QueryTemplate (see udq_utils.sql_detector), e.g. for a narrow table with one measure per
+#   row:
+#
+#       fragment, literals = compile_property_filters(parse_property_filters(request.property_filters),
+#                                                     property_column='measure_name',
+#                                                     value_columns={'stringValue': 'measure_value::varchar', ...})
+#       ->  " AND (measure_name <> '{f0_property}' OR measure_value::varchar = '{f0_value}')", {'f0_property': ..., 'f0_value': ...}
+#
+#   A filter constrains the rows of its own property, rows of the other selected properties pass. Operators are
+#   whitelisted and values are substituted as normalized single-quoted literals (cast to the column type), so a filter
+#   can't alter the query shape. Unsupported operators or value types raise instead of being silently ignored
+# ---------------------------------------------------------------------------
+
+# UDQ filter operator -> SQL comparison operator
+FILTER_OPERATORS = {
+    '=': '=', '==': '=', 'EQUAL': '=', 'EQUALS': '=',
+    '!=': '<>', '<>': '<>', 'NOT_EQUAL': '<>', 'NOT_EQUALS': '<>',
+    '<': '<', 'LESS_THAN': '<',
+    '<=': '<=', 'LESS_THAN_OR_EQUAL': '<=', 'LESS_THAN_OR_EQUALS': '<=',
+    '>': '>', 'GREATER_THAN': '>',
+    '>=': '>=', 'GREATER_THAN_OR_EQUAL': '>=', 'GREATER_THAN_OR_EQUALS': '>=',
+}
+
+# UDQ value type -> SQL type the literal is cast to (strings are compared as plain literals)
+FILTER_VALUE_TYPES = {
+    'stringValue': None,
+    'doubleValue': 'DOUBLE',
+    'integerValue': 'BIGINT',
+    'longValue': 'BIGINT',
+    'booleanValue': 'BOOLEAN',
+}
+
+
+class PropertyFilter:
+    """
+    A parsed UDQ property filter: the property it applies to (None for all properties), the SQL operator, and the typed value
+    """
+    __slots__ = ('_property_name', '_operator', '_value_type', '_value')
+
+    def __init__(self, property_name, operator: str, value_type: str, value):
+        self._property_name = property_name
+        self._operator = operator
+        self._value_type = value_type
+        self._value = value
+
+    @property
+    def property_name(self):
+        return self._property_name
+
+    @property
+    def operator(self) -> str:
+        return self._operator
+
+    @property
+    def value_type(self) -> str:
+        return self._value_type
+
+    @property
+    def value(self):
+        return self._value
+
+    @staticmethod
+    def parse(entry: dict):
+        """
+        Parse a propertyFilters entry, e.g. {'propertyName': 'alarm_status', 'operator': '=', 'value': {'stringValue': 'ACTIVE'}}
+
+        Raises an Exception for unsupported operators and value types, or values not matching their type
+        """
+        operator = FILTER_OPERATORS.get(str(entry.get('operator', '')).strip().upper())
+        if operator is None:
+            raise Exception(f"Unsupported property filter operator[{entry.get('operator')}], supported: {sorted(FILTER_OPERATORS)}")
+        value = entry.get('value') or {}
+        value_types = [value_type for value_type in value if value_type in FILTER_VALUE_TYPES]
+        if len(value_types) != 1:
+            raise Exception(f"Property filter value must have exactly one of {list(FILTER_VALUE_TYPES)}, got: {value}")
+        value_type = value_types[0]
+        return PropertyFilter(entry.get('propertyName'), operator, value_type, PropertyFilter._coerce(value_type, value[value_type]))
+
+    @staticmethod
+    def _coerce(value_type, raw):
+        try:
+            if value_type == 'stringValue':
+                if type(raw) is not str:
+                    raise ValueError()
+                return raw
+            if value_type == 'doubleValue':
+                value = float(raw)
+                if not math.isfinite(value):
+                    raise ValueError()
+                return value
+            if value_type in ('integerValue', 'longValue'):
+                if type(raw) is bool or (type(raw) is float and not raw.is_integer()):
+                    raise ValueError()
+                return int(raw)
+            if type(raw) is bool:
+                return raw
+            if str(raw).lower() in ('true', 'false'):
+                return str(raw).lower() == 'true'
+            raise ValueError()
+        except (TypeError, ValueError):
+            raise Exception(f"Invalid {value_type} in property filter: {raw!r}")
+
+    def literal(self) -> str:
+        """
+        The value as the normalized string substituted into the query (numbers and booleans can't contain quotes)
+        """
+        if self._value_type == 'stringValue':
+            return self._value
+        if self._value_type == 'booleanValue':
+            return 'true' if self._value else 'false'
+        return repr(self._value)
+
+    def matches(self, value) -> bool:
+        """
+        Evaluate the filter against a value in memory, for connectors that can't push it down
+        """
+        if value is None:
+            return False
+        try:
+            if self._value_type == 'stringValue':
+                value = str(value)
+            elif self._value_type == 'booleanValue':
+                value = value if type(value) is bool else str(value).lower() == 'true'
+            else:
+                value = float(value)
+        except (TypeError, ValueError):
+            return False
+        operator = self._operator
+        if operator == '=':
+            return value == self._value
+        if operator == '<>':
+            return value != self._value
+        if operator == '<':
+            return value < self._value
+        if operator == '<=':
+            return value <= self._value
+        if operator == '>':
+            return value > self._value
+        return value >= self._value
+
+    def __repr__(self):
+        return f"PropertyFilter({self._property_name!r} {self._operator} {self._value_type}:{self._value!r})"
+
+
+def parse_property_filters(entries) -> List[PropertyFilter]:
+    return [PropertyFilter.parse(entry) for entry in entries or []]
+
+
+def compile_property_filters(filters: List[PropertyFilter], property_column: str, value_columns: dict, prefix: str = 'f'):
+    """
+    Compile filters into an " AND ..." predicate fragment for a QueryTemplate, and the literals to render it with
+
+    :param property_column: column holding the property name of a row, e.g. 'measure_name'
+    :param value_columns: UDQ value type -> column holding values of that type, e.g. {'doubleValue': 'measure_value::double'}
+    :param prefix: prefix of the generated placeholder names ('{f0_property}', '{f0_value}', ...)
+    :return: (fragment, literals), the fragment only depends on the filters' properties, operators and value types
+    """
+    clauses = []
+    literals = {}
+    for i, property_filter in enumerate(filters):
+        value_column = value_columns.get(property_filter.value_type)
+        if value_column is None:
+            raise Exception(f"Property filter value type [{property_filter.value_type}] is not supported by this connector")
+        value_placeholder = f"{prefix}{i}_value"
+        cast_type = FILTER_VALUE_TYPES[property_filter.value_type]
+        value_expression = f"'{{{value_placeholder}}}'" if cast_type is None else f"CAST('{{{value_placeholder}}}' AS {cast_type})"
+        comparison = f"{value_column} {property_filter.operator} {value_expression}"
+        literals[value_placeholder] = property_filter.literal()
+
+        if property_filter.property_name is None:
+            clauses.append(f" AND {comparison}")
+        else:
+            property_placeholder = f"{prefix}{i}_property"
+            literals[property_placeholder] = property_filter.property_name
+            clauses.append(f" AND ({property_column} <> '{{{property_placeholder}}}' OR {comparison})")
+    return ''.join(clauses), literals
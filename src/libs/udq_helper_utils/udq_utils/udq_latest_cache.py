@@ -0,0 +1,99 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+import os
+import threading
+import time
+from collections import OrderedDict
+
+# ---------------------------------------------------------------------------
+#   Warm-container cache of the latest value per series
+#
+#   Scenes with many alarm or status tiles ask for the latest value of the same property of every asset, one request per
+#   asset (orderByTime DESCENDING, maxResults 1). A connector can instead scan the latest value of all assets at once
+#   (e.g. a Timestream max_by(value, time) query grouped by asset) and keep the result in a LatestValueCache, so the
+#   other tiles' requests are served from memory:
+#
+#       latest = cache.get(key, start_ns, end_ns, series=asset_id)
+#       if latest is None:
+#           scanned = scan_latest_values(start_ns, end_ns) # {asset id: (time epoch ns, timestamp, value)}
+#           cache.put(key, start_ns, scanned)
+#           latest = cache.get(key, start_ns, end_ns, series=asset_id)
+#
+#   A scan answers later requests whose window starts at or after the scanned window start, for series whose latest
+#   value isn't after the requested window end. Values ingested after the scan are missed for up to ttl_seconds: a cached
+#   answer may be older than data already in the backend, and a nextToken resuming after it (e.g. the regular descending
+#   query without the returned row) may repeat or skip the rows ingested since. Keep the TTL short (seconds, about the
+#   refresh interval of the tiles)
+#
+#   The cache is opt-in, set UDQ_LATEST_VALUE_MAX_ENTRIES (and optionally UDQ_LATEST_VALUE_TTL_SECONDS) to enable it
+# ---------------------------------------------------------------------------
+
+DEFAULT_LATEST_VALUE_TTL_SECONDS = 5
+DEFAULT_LATEST_VALUE_MAX_ENTRIES = 1024
+
+
+class LatestValueCache:
+    """
+    Thread-safe LRU + TTL cache of latest value scans, each the {series: (time epoch ns, timestamp, value)} of a window
+    """
+
+    def __init__(self, max_entries: int = DEFAULT_LATEST_VALUE_MAX_ENTRIES, ttl_seconds: float = DEFAULT_LATEST_VALUE_TTL_SECONDS,
+                 clock=time.time):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._clock = clock
+        self._entries = OrderedDict() # key -> (expires_at, start_ns, latest values)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, start_ns: int, end_ns: int, series=None):
+        """
+        Latest values in the window (start_ns, end_ns] from the scan held for key, of the given series or of all series
+
+        :return: {series: (time epoch ns, timestamp, value)} without the series having no value in the window, or None if
+                 the scan doesn't cover the window (missing, expired, starting after start_ns, or with a latest value
+                 after end_ns, which may hide the latest value of the window)
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] <= self._clock() or entry[1] > start_ns:
+                self.misses += 1
+                return None
+            latest = entry[2]
+            if series is not None:
+                latest = {series: latest[series]} if series in latest else {}
+            if any(latest_value[0] > end_ns for latest_value in latest.values()):
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+        return {series_key: latest_value for series_key, latest_value in latest.items() if latest_value[0] > start_ns}
+
+    def put(self, key, start_ns: int, latest: dict):
+        """
+        Hold the latest values scanned for a window starting at start_ns, evicting the least recently used scans
+        """
+        with self._lock:
+            self._entries[key] = (self._clock() + self.ttl_seconds, start_ns, latest)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+def default_latest_value_cache():
+    """
+    :return: a LatestValueCache configured from UDQ_LATEST_VALUE_* environment variables, or None if not enabled
+    """
+    max_entries = os.environ.get('UDQ_LATEST_VALUE_MAX_ENTRIES')
+    if not max_entries:
+        return None
+    ttl_seconds = float(os.environ.get('UDQ_LATEST_VALUE_TTL_SECONDS', DEFAULT_LATEST_VALUE_TTL_SECONDS))
+    if ttl_seconds <= 0:
+        return None
+    return LatestValueCache(int(max_entries), ttl_seconds=ttl_seconds)
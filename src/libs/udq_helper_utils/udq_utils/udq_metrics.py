@@ -0,0 +1,141 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+import json
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+
+# ---------------------------------------------------------------------------
+#   Per-invocation UDQ instrumentation, emitted as CloudWatch Embedded Metric Format (EMF) log lines
+#
+#   IoTTwinMakerUnifiedDataQuery.process_query times its own phases (Parse, Query, Marshall, Paginate) and counts rows,
+#   references and response bytes. Connectors can time their own sub-phases through request.metrics, e.g.
+#
+#       with request.metrics.phase('BackendQuery'):
+#           page = client.query(...)
+#
+#   Metrics are disabled unless a namespace is configured (UDQ_METRICS_NAMESPACE or
+#   IoTTwinMakerUnifiedDataQuery.metrics_namespace). When disabled, request.metrics is a shared no-op object
+#   see https://docs.aws.amazon.com/AmazonCloudWatch/latest/monitoring/CloudWatch_Embedded_Metric_Format_Specification.html
+# ---------------------------------------------------------------------------
+
+
+class NullQueryMetrics:
+    """
+    No-op metrics recorder used when instrumentation is disabled
+    """
+    enabled = False
+
+    _NULL_PHASE = nullcontext()
+
+    def phase(self, name: str):
+        return self._NULL_PHASE
+
+    def add_timing(self, name: str, milliseconds: float):
+        pass
+
+    def add_count(self, name: str, count: int = 1):
+        pass
+
+    def set_property(self, name: str, value):
+        pass
+
+    def emit(self, writer=print):
+        return None
+
+
+NULL_QUERY_METRICS = NullQueryMetrics()
+
+
+class QueryMetrics:
+    """
+    Records phase timings (milliseconds) and counters for one UDQ invocation and emits them as one EMF log line
+
+    Phase metrics are named '<phase>Time', repeated phases of the same name are summed. Properties are logged alongside
+    the metrics without becoming metrics or dimensions (e.g. the query id). Safe to record from connector worker threads
+    """
+    enabled = True
+
+    def __init__(self, namespace: str, dimensions: dict):
+        self._namespace = namespace
+        self._dimensions = dimensions
+        self._timings = {}
+        self._counts = {}
+        self._properties = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def phase(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_timing(name, (time.perf_counter() - start) * 1000)
+
+    def add_timing(self, name: str, milliseconds: float):
+        with self._lock:
+            self._timings[name] = self._timings.get(name, 0.0) + milliseconds
+
+    def add_count(self, name: str, count: int = 1):
+        with self._lock:
+            self._counts[name] = self._counts.get(name, 0) + count
+
+    def set_property(self, name: str, value):
+        self._properties[name] = value
+
+    @property
+    def timings(self) -> dict:
+        return self._timings
+
+    @property
+    def counts(self) -> dict:
+        return self._counts
+
+    def to_emf(self) -> dict:
+        metric_definitions = [{'Name': f"{name}Time", 'Unit': 'Milliseconds'} for name in self._timings]
+        metric_definitions += [{'Name': name, 'Unit': 'Bytes' if name.endswith('Bytes') else 'Count'} for name in self._counts]
+
+        emf = {
+            '_aws': {
+                'Timestamp': int(time.time() * 1000),
+                'CloudWatchMetrics': [{
+                    'Namespace': self._namespace,
+                    'Dimensions': [list(self._dimensions.keys())],
+                    'Metrics': metric_definitions,
+                }],
+            },
+        }
+        emf.update(self._properties)
+        emf.update(self._dimensions)
+        emf.update({f"{name}Time": round(value, 3) for name, value in self._timings.items()})
+        emf.update(self._counts)
+        return emf
+
+    def emit(self, writer=print) -> str:
+        """
+        Write the metrics as a single EMF JSON line (to stdout by default, which Lambda forwards to CloudWatch Logs)
+        """
+        line = json.dumps(self.to_emf(), separators=(',', ':'), default=str)
+        writer(line)
+        return line
+
+
+def parse_emf_line(line: str) -> dict:
+    """
+    Parse an EMF log line back into {metric name: value}, validating that every declared metric is present
+
+    Intended for verifying the instrumentation locally, e.g. against captured Lambda output
+    """
+    emf = json.loads(line)
+    metrics = {}
+    for directive in emf['_aws']['CloudWatchMetrics']:
+        for dimension_set in directive['Dimensions']:
+            for dimension in dimension_set:
+                if dimension not in emf:
+                    raise ValueError(f"Dimension [{dimension}] missing from EMF line: {line}")
+        for metric in directive['Metrics']:
+            if metric['Name'] not in emf:
+                raise ValueError(f"Metric [{metric['Name']}] missing from EMF line: {line}")
+            metrics[metric['Name']] = emf[metric['Name']]
+    return metrics
@@ -1,73 +1,328 @@
 # Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved. 2021
 # SPDX-License-Identifier: Apache-2.0
 
+import asyncio
+import base64
+import inspect
 import json
+import os
+import time
 from abc import ABC
 from datetime import datetime
 from enum import Enum
+from itertools import chain
+from operator import itemgetter
+from types import MappingProxyType
 from typing import List
 
+from udq_utils.udq_cache import default_response_cache, request_cache_key
+from udq_utils.udq_downsample import Downsampling, default_downsampling
+from udq_utils.udq_metrics import NULL_QUERY_METRICS, QueryMetrics
+from udq_utils.udq_prefetch import default_page_remainder_store
+from udq_utils.udq_profile import record_invocation
+
+# Lambda responses are capped at 6 MB, process_query cuts the propertyValues page at this many serialized bytes
+# can be overridden per connector with IoTTwinMakerUnifiedDataQuery.max_response_bytes (None disables the cut)
+DEFAULT_MAX_RESPONSE_BYTES = 5 * 1024 * 1024
+try:
+    DEFAULT_MAX_RESPONSE_BYTES = int(os.environ['UDQ_MAX_RESPONSE_BYTES'])
+except:
+    pass # use default budget
+
+# CloudWatch namespace for the EMF metrics emitted by process_query, instrumentation is disabled when unset
+# can be overridden per connector with IoTTwinMakerUnifiedDataQuery.metrics_namespace
+DEFAULT_METRICS_NAMESPACE = os.environ.get('UDQ_METRICS_NAMESPACE') or None
+
+# prefix of the nextToken returned when process_query cuts a page short, to tell it apart from connector tokens
+PAGE_TOKEN_PREFIX = 'udqpage:'
+
 class EntityComponentPropertyRef():
     """
     Represents an entity-component-property reference that uniquely identifies an AWS IoT TwinMaker property
     Consists of an entityId, componentName, and propertyName
+
+    Instances are immutable and hash once on construction, so they are cheap to use as grouping keys
     """
+    __slots__ = ('_entity_id', '_component_name', '_property_name', '_hash')
 
     def __init__(self, entity_id: str, component_name: str, property_name: str):
-        self.entity_id = entity_id
-        self.component_name = component_name
-        self.property_name = property_name
+        self._entity_id = entity_id
+        self._component_name = component_name
+        self._property_name = property_name
+        self._hash = hash((entity_id, component_name, property_name))
+
+    @property
+    def entity_id(self) -> str:
+        return self._entity_id
+
+    @property
+    def component_name(self) -> str:
+        return self._component_name
+
+    @property
+    def property_name(self) -> str:
+        return self._property_name
 
     def __hash__(self):
-        return hash((self.entity_id, self.component_name, self.property_name))
+        return self._hash
 
     def __eq__(self, other):
-        return (self.entity_id, self.component_name, self.property_name) == (other.entity_id, other.component_name, other.property_name)
+        if self is other:
+            return True
+        if not isinstance(other, EntityComponentPropertyRef):
+            return NotImplemented
+        return self._hash == other._hash and \
+            (self._entity_id, self._component_name, self._property_name) == (other._entity_id, other._component_name, other._property_name)
+
+    def __repr__(self):
+        return f"EntityComponentPropertyRef({self._entity_id!r}, {self._component_name!r}, {self._property_name!r})"
 
 class ExternalIdPropertyRef():
     """
     Represents an externalIdProperty reference that uniquely identifies an AWS IoT TwinMaker property across entities
     Consists of a key-value map externalIdProperty and propertyName
+
+    Instances are immutable and hash once on construction, so they are cheap to use as grouping keys
     """
+    __slots__ = ('_external_id_property', '_property_name', '_key', '_hash')
 
     def __init__(self, external_id_property: dict, property_name: str):
-        self.external_id_property = external_id_property
-        self.property_name = property_name
+        self._external_id_property = MappingProxyType(dict(external_id_property))
+        self._property_name = property_name
+        self._key = (ExternalIdPropertyRef.external_id_key(external_id_property), property_name)
+        self._hash = hash(self._key)
+
+    @staticmethod
+    def external_id_key(external_id_property: dict) -> tuple:
+        """
+        Hashable, order-independent key for an externalIdProperty map
+        """
+        return tuple(sorted(external_id_property.items()))
+
+    @property
+    def external_id_property(self):
+        """
+        Read-only view of the externalIdProperty map
+        """
+        return self._external_id_property
+
+    @property
+    def property_name(self) -> str:
+        return self._property_name
 
     def __hash__(self):
-        return hash((json.dumps(self.external_id_property), self.property_name))
+        return self._hash
 
     def __eq__(self, other):
-        return (self.external_id_property, self.property_name) == (other.external_id_property, other.property_name)
+        if self is other:
+            return True
+        if not isinstance(other, ExternalIdPropertyRef):
+            return NotImplemented
+        return self._hash == other._hash and self._key == other._key
+
+    def __repr__(self):
+        return f"ExternalIdPropertyRef({dict(self._external_id_property)!r}, {self._property_name!r})"
 
 class IoTTwinMakerReference():
     """
     Represents a unique reference to a property in AWS IoT TwinMaker
     May include an EntityComponentPropertyRef or an ExternalIdPropertyRef
     """
+    __slots__ = ('_ecp', '_eip', '_hash')
 
     def __init__(self, ecp: EntityComponentPropertyRef = None, eip: ExternalIdPropertyRef = None):
-        self.ecp = ecp
-        self.eip = eip
+        self._ecp = ecp
+        self._eip = eip
+        self._hash = hash((ecp, eip))
+
+    @property
+    def ecp(self) -> EntityComponentPropertyRef:
+        return self._ecp
+
+    @property
+    def eip(self) -> ExternalIdPropertyRef:
+        return self._eip
 
     def __hash__(self):
-        return hash((self.ecp, self.eip))
+        return self._hash
 
     def __eq__(self, other):
-        return (self.ecp, self.eip) == (other.ecp, other.eip)
+        if self is other:
+            return True
+        if not isinstance(other, IoTTwinMakerReference):
+            return NotImplemented
+        return self._hash == other._hash and (self._ecp, self._eip) == (other._ecp, other._eip)
+
+    def __repr__(self):
+        return f"IoTTwinMakerReference(ecp={self._ecp!r}, eip={self._eip!r})"
 
     def serialize(self):
         ret = {}
-        if self.ecp:
-            ret['entityId'] = self.ecp.entity_id
-            ret['componentName'] = self.ecp.component_name
-            ret['propertyName'] = self.ecp.property_name
-        if self.eip:
-            ret['externalIdProperty'] = self.eip.external_id_property
-            ret['propertyName'] = self.eip.property_name
+        if self._ecp:
+            ret['entityId'] = self._ecp.entity_id
+            ret['componentName'] = self._ecp.component_name
+            ret['propertyName'] = self._ecp.property_name
+        if self._eip:
+            ret['externalIdProperty'] = dict(self._eip.external_id_property)
+            ret['propertyName'] = self._eip.property_name
         return ret
 
+class IoTTwinMakerReferenceTable():
+    """
+    Per-request intern table for IoTTwinMakerReferences
+
+    Connectors typically produce the same few references for thousands of rows. Looking references up here by their raw
+    fields returns one shared instance (and a stable integer id, usable with IoTTwinMakerUdqColumnarResponse) per distinct
+    reference instead of constructing and hashing a new reference per row
+    """
+    __slots__ = ('_references', '_ids')
+
+    def __init__(self):
+        self._references = []
+        self._ids = {}
+
+    @property
+    def references(self) -> List[IoTTwinMakerReference]:
+        """
+        The distinct references interned so far, indexed by their id
+        """
+        return self._references
+
+    def entity_component_property_id(self, entity_id: str, component_name: str, property_name: str) -> int:
+        key = ('ecp', entity_id, component_name, property_name)
+        ref_id = self._ids.get(key)
+        if ref_id is None:
+            ref_id = self._add(key, IoTTwinMakerReference(ecp=EntityComponentPropertyRef(entity_id, component_name, property_name)))
+        return ref_id
+
+    def external_id_property_id(self, external_id_property: dict, property_name: str) -> int:
+        key = ('eip', ExternalIdPropertyRef.external_id_key(external_id_property), property_name)
+        ref_id = self._ids.get(key)
+        if ref_id is None:
+            ref_id = self._add(key, IoTTwinMakerReference(eip=ExternalIdPropertyRef(external_id_property, property_name)))
+        return ref_id
+
+    def entity_component_property(self, entity_id: str, component_name: str, property_name: str) -> IoTTwinMakerReference:
+        return self._references[self.entity_component_property_id(entity_id, component_name, property_name)]
+
+    def external_id_property(self, external_id_property: dict, property_name: str) -> IoTTwinMakerReference:
+        return self._references[self.external_id_property_id(external_id_property, property_name)]
+
+    def _add(self, key, reference):
+        ref_id = len(self._references)
+        self._references.append(reference)
+        self._ids[key] = ref_id
+        return ref_id
+
+    def __len__(self):
+        return len(self._references)
+
+
+
+def serialize_value(val):
+    """
+    Marshall a python native type into its common IoT TwinMaker value type
+    """
+    if type(val) is str:
+        return {
+            'stringValue': val
+        }
+    elif type(val) is float:
+        return {
+            'doubleValue': str(val) # Note: the UDQ interface expects string value returns instead of JSON-native types
+        }
+    elif type(val) is bool:
+        return {
+            'booleanValue': str(val)
+        }
+    elif type(val) is int:
+        return {
+            'integerValue': str(val)
+        }
+    elif type(val) is dict:
+        return {
+            'mapValue': {k: serialize_value(v) for (k,v) in val.items()}
+        }
+    else:
+        assert False
+
+# value keys for the scalar types that can be serialized in bulk
+_SCALAR_VALUE_KEYS = {
+    str: 'stringValue',
+    float: 'doubleValue',
+    bool: 'booleanValue',
+    int: 'integerValue',
+}
+
+def serialize_values(values):
+    """
+    Marshall a list of python native values into IoT TwinMaker value types
+    Homogeneous scalar columns (the common case for a single property) are serialized without per-value type dispatch
+    """
+    value_types = set(map(type, values))
+    if len(value_types) == 1:
+        value_type = value_types.pop()
+        key = _SCALAR_VALUE_KEYS.get(value_type)
+        if value_type is str:
+            return [{key: val} for val in values]
+        elif key is not None:
+            return [{key: str(val)} for val in values]
+    return [serialize_value(val) for val in values]
+
+# serialized sizes (as json.dumps writes them) of the fixed parts of a marshalled value {'time': ..., 'value': {key: ...}},
+# of a propertyValues group {'entityPropertyReference': ..., 'values': [...]}, and of a list item separator
+_VALUE_OVERHEAD_BYTES = len(json.dumps({'time': '', 'value': {'': ''}}))
+_GROUP_OVERHEAD_BYTES = len(json.dumps({'entityPropertyReference': None, 'values': []})) - len('null')
+_SEPARATOR_BYTES = len(', ')
+
+_get_time = itemgetter('time')
+_get_value = itemgetter('value')
+
+def _is_plain_json_text(text):
+    # text json.dumps writes as-is between its quotes
+    return text.isascii() and text.isprintable() and '"' not in text and '\\' not in text
+
+def _serialized_value_bytes(value):
+    """
+    Serialized size of one marshalled value, from its string lengths when it is a plain text scalar
+    """
+    inner = value.get('value')
+    if len(value) == 2 and type(inner) is dict and len(inner) == 1:
+        time_text = value.get('time')
+        (key, text), = inner.items()
+        if type(time_text) is str and type(text) is str and _is_plain_json_text(time_text + key + text):
+            return _VALUE_OVERHEAD_BYTES + len(time_text) + len(key) + len(text)
+    return len(json.dumps(value))
+
+def _serialized_values_bytes(values):
+    """
+    Serialized size of a list of marshalled values, without its brackets
 
+    Lists of plain text scalars (the common case) are sized in bulk from their joined strings, without serializing them
+    """
+    if not values:
+        return 0
+    separators = _SEPARATOR_BYTES * (len(values) - 1)
+    try:
+        if sum(map(len, values)) == 2 * len(values):
+            strings = list(chain.from_iterable(chain.from_iterable(map(dict.items, map(_get_value, values)))))
+            if len(strings) == 2 * len(values):
+                text = ''.join(chain(map(_get_time, values), strings))
+                if _is_plain_json_text(text):
+                    return len(text) + _VALUE_OVERHEAD_BYTES * len(values) + separators
+    except (TypeError, AttributeError, KeyError):
+        pass # not only scalars (e.g. mapValue), size them one by one
+    return sum(map(_serialized_value_bytes, values)) + separators
+
+def _list_bytes(items_bytes):
+    # size of a serialized list from the summed sizes of its items, each counted with a trailing separator
+    return items_bytes - _SEPARATOR_BYTES + len('[]') if items_bytes else len('[]')
+
+def _serialized_property_value_bytes(property_value):
+    """
+    Serialized size of a propertyValues group
+    """
+    return _GROUP_OVERHEAD_BYTES + len(json.dumps(property_value['entityPropertyReference'])) + _serialized_values_bytes(property_value['values'])
 
 
 class IoTTwinMakerUnifiedDataQuery(ABC):
@@ -77,54 +332,313 @@ class IoTTwinMakerUnifiedDataQuery(ABC):
     delegates to the connector author's DataRow implementation to extract necessary fields for response construction
     """
 
-    def process_query(self, lambda_event):
-        from udq_utils.udq import SingleEntityReader, MultiEntityReader
+    # serialized size budget for the propertyValues of one response, see DEFAULT_MAX_RESPONSE_BYTES
+    max_response_bytes = DEFAULT_MAX_RESPONSE_BYTES
+
+    # CloudWatch namespace for per-invocation EMF metrics, see DEFAULT_METRICS_NAMESPACE and udq_utils.udq_metrics
+    metrics_namespace = DEFAULT_METRICS_NAMESPACE
+
+    # opt-in warm-container cache of marshalled responses, see udq_utils.udq_cache (shared by all connectors when configured from the environment)
+    response_cache = default_response_cache()
 
+    # opt-in incremental fetch of sliding windows, see udq_utils.udq_window_cache (applies to process_query)
+    window_cache = None
+
+    # opt-in downsampling of numeric property series, see udq_utils.udq_downsample (can also be enabled per entity / component type)
+    downsampling = default_downsampling()
+
+    # opt-in warm-container store of the rest of responses cut at max_response_bytes, see udq_utils.udq_prefetch
+    # without it, resuming a cut page re-runs the connector query and re-marshals its whole response to slice the next page
+    page_remainders = default_page_remainder_store()
+
+    def process_query(self, lambda_event):
         # parse the raw lambda event into a structured IoTTwinMakerUdqRequest request object
+        parse_start = time.perf_counter()
         request = IoTTwinMakerUdqRequest.parse(lambda_event)
+        metrics = self._start_metrics(request, parse_start)
+
+        try:
+            # serve repeated requests from the warm-container cache, if enabled
+            cached_response = self._get_cached_response(request)
+            if cached_response is not None:
+                return cached_response
+
+            # resume a page cut short from the rest of the response kept in memory, if enabled
+            remainder = self._take_page_remainder(request)
+            if remainder is not None:
+                return self._cache_response(request, self._paginate_response(request, *remainder))
+
+            # invoke the approriate entity reader function based on the request, or throw error if not supported
+            request._downsampling = Downsampling.from_request(request) or self.downsampling
+            with metrics.phase('Query'):
+                if self.window_cache is not None and self.window_cache.accepts(request):
+                    # serve the overlap with previously fetched windows from memory, querying only the uncovered delta
+                    udq_response = self.window_cache.query(request, lambda sub_request: self._run_query(sub_request, sub_request.event))
+                    pushed_down = False
+                else:
+                    udq_response = self._run_query(request, lambda_event)
+                    pushed_down = request.downsampling is not None and self.pushes_down_downsampling(request)
+
+            if request.downsampling is not None and not pushed_down:
+                udq_response = self._downsample_response(request, udq_response)
+
+            return self._cache_response(request, self._marshall_response(request, udq_response))
+        except Exception:
+            metrics.add_count('Errors')
+            raise
+        finally:
+            metrics.emit()
+            record_invocation(parse_start)
+
+    async def process_query_async(self, lambda_event):
+        """
+        Async variant of process_query, for callers already running in an event loop
+        Supports both async and sync readers
+        """
+        parse_start = time.perf_counter()
+        request = IoTTwinMakerUdqRequest.parse(lambda_event)
+        metrics = self._start_metrics(request, parse_start)
+
+        try:
+            cached_response = self._get_cached_response(request)
+            if cached_response is not None:
+                return cached_response
+
+            remainder = self._take_page_remainder(request)
+            if remainder is not None:
+                return self._cache_response(request, self._paginate_response(request, *remainder))
+
+            request._downsampling = Downsampling.from_request(request) or self.downsampling
+            with metrics.phase('Query'):
+                if self.window_cache is not None and self.window_cache.accepts(request):
+                    # the window cache fetches synchronously: run it off the event loop, the sub-queries of async readers
+                    # are scheduled back onto the loop, sync readers are queried on the same thread
+                    loop = asyncio.get_running_loop()
+                    async_reader = inspect.iscoroutinefunction(self._query_method(request, lambda_event))
+                    def fetch(sub_request):
+                        if not async_reader:
+                            return self._run_query(sub_request, sub_request.event)
+                        return asyncio.run_coroutine_threadsafe(self._run_query_async(sub_request, sub_request.event), loop).result()
+                    udq_response = await loop.run_in_executor(None, self.window_cache.query, request, fetch)
+                    pushed_down = False
+                else:
+                    udq_response = await self._run_query_async(request, lambda_event)
+                    pushed_down = request.downsampling is not None and self.pushes_down_downsampling(request)
+
+            if request.downsampling is not None and not pushed_down:
+                udq_response = self._downsample_response(request, udq_response)
+
+            return self._cache_response(request, self._marshall_response(request, udq_response))
+        except Exception:
+            metrics.add_count('Errors')
+            raise
+        finally:
+            metrics.emit()
+            record_invocation(parse_start)
+
+    def _run_query(self, request, lambda_event):
+        udq_response = self._dispatch_query(request, lambda_event)
+        if inspect.isawaitable(udq_response):
+            # async readers are run on the event loop shared across warm invocations
+            from udq_utils.udq_async import run_coroutine
+            udq_response = run_coroutine(udq_response)
+        return udq_response
+
+    async def _run_query_async(self, request, lambda_event):
+        query = self._query_method(request, lambda_event)
+        if inspect.iscoroutinefunction(query):
+            udq_response = query(request)
+        else:
+            # sync readers block on their backend calls, run them on the event loop's thread pool rather than on the loop
+            udq_response = await asyncio.get_running_loop().run_in_executor(None, query, request)
+        if inspect.isawaitable(udq_response):
+            udq_response = await udq_response
+        return udq_response
+
+    def pushes_down_downsampling(self, request) -> bool:
+        """
+        Whether this connector applies request.downsampling in its backend query (e.g. with Timestream bin()), in which case
+        the framework doesn't downsample the response. Override in connectors that can aggregate natively
+        """
+        return False
+
+    def _downsample_response(self, request, udq_response):
+        from udq_utils.udq_downsample import downsample_response
+
+        with request.metrics.phase('Downsample'):
+            return downsample_response(udq_response, request.downsampling, request.start_time, request.end_time)
+
+    def metrics_dimensions(self, request) -> dict:
+        """
+        CloudWatch dimensions for this connector's metrics, override to add connector-specific dimensions
+        """
+        return {
+            'Connector': self.__class__.__name__,
+            'QueryType': 'Entity' if isinstance(request, IoTTwinMakerUDQEntityRequest) else 'ComponentType',
+        }
+
+    def _start_metrics(self, request, parse_start):
+        # instrumentation is disabled unless a namespace is configured, in which case requests keep the no-op recorder
+        if not self.metrics_namespace:
+            return NULL_QUERY_METRICS
+        metrics = QueryMetrics(self.metrics_namespace, self.metrics_dimensions(request))
+        metrics.add_timing('Parse', (time.perf_counter() - parse_start) * 1000)
+        request._metrics = metrics
+        return metrics
+
+    def _get_cached_response(self, request):
+        if self.response_cache is None:
+            return None
+        with request.metrics.phase('CacheLookup'):
+            request._cache_key = request_cache_key(request)
+            cached_response = self.response_cache.get(request._cache_key)
+        request.metrics.add_count('CacheHits' if cached_response is not None else 'CacheMisses')
+        return cached_response
+
+    def _cache_response(self, request, response):
+        if self.response_cache is not None:
+            self.response_cache.put(request._cache_key, response, self.response_cache.ttl_for(request))
+        return response
+
+    def _take_page_remainder(self, request):
+        if self.page_remainders is None or not request.page_position:
+            return None
+        remainder = self.page_remainders.take(request_cache_key(request))
+        if remainder is not None:
+            request.metrics.add_count('PageRemainderHits', 1)
+        return remainder
+
+    def _marshall_response(self, request, udq_response):
+        # marshall the connector response into the propertyValues structure
+        with request.metrics.phase('Marshall'):
+            property_values = self._marshall_property_values(udq_response)
+        return self._paginate_response(request, property_values, udq_response.next_token)
+
+    def _paginate_response(self, request, property_values, connector_next_token):
+        """
+        Marshall the page of property_values (the full marshalled connector response) resumed at the request page position
+        into the final UDQ response, cutting it if it exceeds max_response_bytes
+
+        Without page_remainders, the next page is resumed by re-running the same connector query and slicing its response
+        """
+        metrics = request.metrics
+
+        # resume a page previously cut short by the framework, and cut this one if it exceeds the size budget
+        with metrics.phase('Paginate'):
+            page, page_position, page_bytes = self._paginate_property_values(property_values, request.page_position, self.max_response_bytes)
+        if page_position is not None:
+            next_token = encode_page_token(request.next_token, page_position)
+            if self.page_remainders is not None:
+                self.page_remainders.put(request_cache_key(request, page_position), (property_values, connector_next_token))
+        else:
+            next_token = connector_next_token
+
+        # marshall propertyValues and nextToken into final UDQ response
+        result = {
+            'propertyValues': page,
+            'nextToken': next_token if next_token else None
+        }
+
+        if metrics.enabled:
+            metrics.add_count('References', len(page))
+            metrics.add_count('Rows', sum(len(property_value['values']) for property_value in page))
+            if page_bytes is None:
+                page_bytes = _list_bytes(sum(_serialized_property_value_bytes(property_value) + _SEPARATOR_BYTES for property_value in page))
+            # the size of the response is that of its envelope around the page, already sized during pagination
+            metrics.add_count('ResponseBytes', len(json.dumps({'propertyValues': [], 'nextToken': result['nextToken']})) - len('[]') + page_bytes)
+        return result
+
+    @staticmethod
+    def _paginate_property_values(property_values, resume_position=None, max_bytes=None):
+        """
+        Skip the values before resume_position and cut the remaining property_values once their serialized size exceeds max_bytes
+
+        Positions are (propertyValues index, values index) pairs into the full marshalled connector response, which is
+        deterministic for a given connector request. At least one value is always returned so pagination makes progress.
+        Sizes are summed from the string lengths of the values, only the values of the group crossing max_bytes are sized
+        one by one
+
+        :return: the page of property_values, the position to resume from (None if the page is complete), and the
+            serialized size of the page (None without max_bytes)
+        """
+        if resume_position:
+            start_group, start_offset = resume_position
+            property_values = property_values[start_group:]
+            if property_values:
+                first = property_values[0]
+                property_values[0] = {'entityPropertyReference': first['entityPropertyReference'], 'values': first['values'][start_offset:]}
+        else:
+            start_group, start_offset = 0, 0
+
+        if max_bytes is None:
+            return property_values, None, None
+
+        page = []
+        page_bytes = 0
+        remaining = max_bytes
+        for i, property_value in enumerate(property_values):
+            group_size = _serialized_property_value_bytes(property_value)
+            if group_size <= remaining:
+                page.append(property_value)
+                page_bytes += group_size + _SEPARATOR_BYTES
+                remaining -= group_size + _SEPARATOR_BYTES
+                continue
+
+            # this group doesn't fit: take as many of its values as the remaining budget allows
+            values = property_value['values']
+            group_size = _GROUP_OVERHEAD_BYTES + len(json.dumps(property_value['entityPropertyReference']))
+            remaining -= group_size + _SEPARATOR_BYTES
+            count = 0
+            for value in values:
+                value_size = _serialized_value_bytes(value)
+                remaining -= value_size + _SEPARATOR_BYTES
+                if remaining < 0 and (page or count > 0):
+                    break
+                group_size += value_size + (_SEPARATOR_BYTES if count > 0 else 0)
+                count += 1
+            if count > 0:
+                page.append({'entityPropertyReference': property_value['entityPropertyReference'], 'values': values[:count]})
+                page_bytes += group_size + _SEPARATOR_BYTES
+            if count < len(values):
+                return page, (start_group + i, count + (start_offset if i == 0 else 0)), _list_bytes(page_bytes)
+
+        return page, None, _list_bytes(page_bytes)
+
+    def _dispatch_query(self, request, lambda_event):
+        return self._query_method(request, lambda_event)(request)
+
+    def _query_method(self, request, lambda_event):
+        """
+        The reader method serving the request: entity_query or component_type_query
+        """
+        from udq_utils.udq import SingleEntityReader, MultiEntityReader
 
-        # invoke the approriate entity reader function based on the request, or throw error if not supported
         if (isinstance(request, IoTTwinMakerUDQEntityRequest)):
             if isinstance(self, SingleEntityReader):
-                udq_response = self.entity_query(request)
+                return self.entity_query
             else:
                 raise NotImplementedError(f"Received entity request but this processor ({self.__class__.__name__}) doesn't support it")
         elif (isinstance(request, IoTTwinMakerUDQComponentTypeRequest)):
             if isinstance(self, MultiEntityReader):
-                udq_response = self.component_type_query(request)
+                return self.component_type_query
             else:
                 raise NotImplementedError(f"Received component type request but this processor ({self.__class__.__name__}) doesn't support it")
         else:
             raise NotImplementedError(f"Received unknown UDQ request type: {lambda_event}")
 
-        # inline helper to marshall python native types into common IoT TwinMaker types
-        def serialize_value(val):
-            if type(val) is str:
-                return {
-                    'stringValue': val
-                }
-            elif type(val) is float:
-                return {
-                    'doubleValue': str(val) # Note: the UDQ interface expects string value returns instead of JSON-native types
-                }
-            elif type(val) is bool:
-                return {
-                    'booleanValue': str(val)
-                }
-            elif type(val) is int:
-                return {
-                    'integerValue': str(val)
-                }
-            elif type(val) is dict:
-                return {
-                    'mapValue': {k: serialize_value(v) for (k,v) in val.items()}
-                }
-            else:
-                assert False
+    @staticmethod
+    def _marshall_property_values(udq_response):
+        from udq_utils.udq import IoTTwinMakerUdqColumnarResponse
+
+        if isinstance(udq_response, IoTTwinMakerUdqColumnarResponse):
+            return IoTTwinMakerUnifiedDataQuery._marshall_columns(udq_response)
+        return IoTTwinMakerUnifiedDataQuery._marshall_rows(udq_response.rows)
 
+    @staticmethod
+    def _marshall_rows(rows):
         # marshall data rows into property values grouped by entityPropertyReference
         entity_prop_ref_to_values = {}
-        for row in udq_response.rows:
+        for row in rows:
             ref = row.get_iottwinmaker_reference()
             if ref not in entity_prop_ref_to_values:
                 entity_prop_ref_to_values[ref] = []
@@ -143,12 +657,48 @@ class IoTTwinMakerUnifiedDataQuery(ABC):
                 'entityPropertyReference': ref.serialize(),
                 'values': entity_prop_ref_to_values[ref]
             })
+        return property_values
 
-        # marshall propertyValues and nextToken into final UDQ response
-        return {
-            'propertyValues': property_values,
-            'nextToken': udq_response.next_token if udq_response.next_token else None
-        }
+    @staticmethod
+    def _marshall_columns(udq_response):
+        # group the parallel timestamp/value columns by reference id, keeping first-seen order of the references
+        grouped = {}
+        for ref_id, ts, val in zip(udq_response.reference_ids, udq_response.timestamps, udq_response.values):
+            group = grouped.get(ref_id)
+            if group is None:
+                group = grouped[ref_id] = ([], [])
+            group[0].append(ts)
+            group[1].append(val)
+
+        # serialize each group in bulk
+        references = udq_response.references
+        property_values = []
+        for ref_id, (timestamps, values) in grouped.items():
+            property_values.append({
+                'entityPropertyReference': references[ref_id].serialize(),
+                'values': [{'time': ts, 'value': value} for ts, value in zip(timestamps, serialize_values(values))]
+            })
+        return property_values
+
+def encode_page_token(connector_token, page_position):
+    """
+    Encode a framework-level nextToken: the connector's nextToken for the page and the position to resume from within it
+    """
+    payload = json.dumps([connector_token, page_position[0], page_position[1]], separators=(',', ':'))
+    return PAGE_TOKEN_PREFIX + base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii')
+
+def decode_page_token(token):
+    """
+    Decode a nextToken into (connector token, page position)
+    Tokens not produced by encode_page_token are connector tokens and are returned as-is with no page position
+    """
+    if not token or not token.startswith(PAGE_TOKEN_PREFIX):
+        return token, None
+    try:
+        connector_token, group, offset = json.loads(base64.urlsafe_b64decode(token[len(PAGE_TOKEN_PREFIX):].encode('ascii')))
+    except Exception:
+        raise Exception(f"Invalid nextToken[{token}]")
+    return connector_token, (int(group), int(offset))
 
 class OrderBy(Enum):
     ASCENDING = 1
@@ -217,7 +767,8 @@ class IoTTwinMakerUdqRequest():
         self._startTime = IoTTwinMakerUdqRequest.get_required_field(self._event, 'startTime')
         self._endTime = IoTTwinMakerUdqRequest.get_required_field(self._event, 'endTime')
 
-        self._nextToken = event.get('nextToken')
+        # a nextToken from a page cut short by the framework wraps the connector's nextToken for that page
+        self._nextToken, self._page_position = decode_page_token(event.get('nextToken'))
         self._maxRows = event.get('maxResults')
 
         def get_order_by(event):
@@ -232,6 +783,19 @@ class IoTTwinMakerUdqRequest():
 
         self._property_filters = self._event.get('propertyFilters', [])
 
+        self._reference_table = IoTTwinMakerReferenceTable()
+
+        self._metrics = NULL_QUERY_METRICS
+
+        self._downsampling = None
+
+    @property
+    def event(self) -> dict:
+        """
+        The raw UDQ request event this request was parsed from
+        """
+        return self._event
+
     @property
     def udq_context(self):
         """
@@ -305,6 +869,14 @@ class IoTTwinMakerUdqRequest():
         """
         return self._nextToken
 
+    @property
+    def page_position(self):
+        """
+        For requests resuming a page cut short by the framework, the (propertyValues index, values index) position to resume from
+        Handled by IoTTwinMakerUnifiedDataQuery.process_query, connectors don't need to use it
+        """
+        return self._page_position
+
     @property
     def max_rows(self) -> int:
         """
@@ -326,6 +898,28 @@ class IoTTwinMakerUdqRequest():
         """
         return self._property_filters
 
+    @property
+    def reference_table(self) -> IoTTwinMakerReferenceTable:
+        """
+        Intern table for the IoTTwinMakerReferences produced while servicing this request
+        """
+        return self._reference_table
+
+    @property
+    def metrics(self):
+        """
+        Metrics recorder for this request, connectors can use it to time their own phases and count backend work
+        A no-op recorder unless instrumentation is enabled, see udq_utils.udq_metrics
+        """
+        return self._metrics
+
+    @property
+    def downsampling(self) -> Downsampling:
+        """
+        Downsampling to apply to this request's property series, or None. Set by the framework from the connector and
+        entity / component type configuration, see udq_utils.udq_downsample
+        """
+        return self._downsampling
 
     @staticmethod
     def parse(event):
@@ -0,0 +1,118 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+import os
+import threading
+import time
+from collections import OrderedDict
+
+# ---------------------------------------------------------------------------
+#   Background prefetch of backend pages for paginated UDQ requests
+#
+#   IoT TwinMaker fetches a paginated history one page at a time, each page a cold round trip to the backend. When a
+#   connector returns a page with a backend NextToken, it can hand the fetch of the next page to a PagePrefetcher: the
+#   page is fetched on a background thread while the current one is marshalled, and kept in the warm container keyed by
+#   the token the response returns. The follow-up request bringing that token back takes the page from memory, e.g.
+#
+#       page = prefetcher.take((query_string, next_token, max_rows))
+#       if page is None:
+#           page = run_query(query_string, next_token, max_rows)
+#       if 'NextToken' in page:
+#           prefetcher.prefetch((query_string, page['NextToken'], max_rows), lambda: run_query(...), executor)
+#
+#   Pages are taken at most once and dropped after ttl_seconds (the follow-up may land on another container, or never
+#   come). A failed prefetch is treated as a miss so the caller queries synchronously. The prefetcher is opt-in: set
+#   UDQ_PREFETCH_MAX_PAGES to the number of pages a container may hold
+#
+#   The framework uses the same store for the rest of responses it cuts at max_response_bytes: the next page resumes from
+#   it instead of re-running the connector query, when UDQ_PAGE_REMAINDER_MAX_PAGES is set
+# ---------------------------------------------------------------------------
+
+DEFAULT_PREFETCH_TTL_SECONDS = 60
+
+
+class PagePrefetcher:
+    """
+    Thread-safe store of prefetched (or prefetching) backend pages, bounded by a number of pages and a TTL
+    """
+
+    def __init__(self, max_pages: int, ttl_seconds: float = DEFAULT_PREFETCH_TTL_SECONDS, clock=time.time):
+        self.max_pages = max_pages
+        self.ttl_seconds = ttl_seconds
+        self._clock = clock
+        self._entries = OrderedDict() # key -> (expires_at, future or None, page)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def prefetch(self, key, fetch, executor):
+        """
+        Start fetch() on the executor in the background, unless the page for key is already held
+        """
+        with self._lock:
+            if key in self._entries:
+                return
+            self._store(key, executor.submit(fetch), None)
+
+    def put(self, key, page):
+        """
+        Hold an already fetched page, e.g. a page only partially returned that the next request resumes from
+        """
+        with self._lock:
+            self._store(key, None, page)
+
+    def take(self, key, timeout: float = None):
+        """
+        Remove and return the page for key, waiting for its fetch to finish if needed
+
+        :return: the page, or None if it isn't held, expired, or its fetch failed
+        """
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None or entry[0] <= self._clock():
+                self.misses += 1
+                return None
+            self.hits += 1
+        _, future, page = entry
+        if future is None:
+            return page
+        try:
+            return future.result(timeout)
+        except Exception:
+            with self._lock:
+                self.hits -= 1
+                self.misses += 1
+            return None
+
+    def _store(self, key, future, page):
+        now = self._clock()
+        for expired_key in [k for k, (expires_at, _, _) in self._entries.items() if expires_at <= now]:
+            del self._entries[expired_key]
+        self._entries[key] = (now + self.ttl_seconds, future, page)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_pages:
+            _, (_, evicted_future, _) = self._entries.popitem(last=False)
+            if evicted_future is not None:
+                evicted_future.cancel()
+
+
+def default_page_prefetcher():
+    """
+    :return: a PagePrefetcher configured from UDQ_PREFETCH_* environment variables, or None if not enabled
+    """
+    max_pages = os.environ.get('UDQ_PREFETCH_MAX_PAGES')
+    if not max_pages:
+        return None
+    return PagePrefetcher(int(max_pages), ttl_seconds=float(os.environ.get('UDQ_PREFETCH_TTL_SECONDS', DEFAULT_PREFETCH_TTL_SECONDS)))
+
+
+def default_page_remainder_store():
+    """
+    :return: a PagePrefetcher holding the rest of responses cut at max_response_bytes (see
+        IoTTwinMakerUnifiedDataQuery.page_remainders), configured from UDQ_PAGE_REMAINDER_* environment variables, or
+        None if not enabled
+    """
+    max_pages = os.environ.get('UDQ_PAGE_REMAINDER_MAX_PAGES')
+    if not max_pages:
+        return None
+    return PagePrefetcher(int(max_pages), ttl_seconds=float(os.environ.get('UDQ_PAGE_REMAINDER_TTL_SECONDS', DEFAULT_PREFETCH_TTL_SECONDS)))
@@ -0,0 +1,187 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+import json
+import os
+import sys
+import threading
+import time
+
+# ---------------------------------------------------------------------------
+#   Cold-start profiling and lazy initialization for UDQ connector Lambdas
+#
+#   Heavy imports (boto3, pandas, ...) and client creation at module import time add to every cold start, even for
+#   invocations that never need them. Connectors wrap them in a LazyResource created at module level: it is built on
+#   first use and then shared across warm invocations of the container, e.g.
+#
+#       QUERY_CLIENT = LazyResource('timestream-query client', lambda: boto3.Session().client('timestream-query'))
+#       ...
+#       QUERY_CLIENT.query(QueryString=...) # attribute access is forwarded to the resource, building it if needed
+#
+#   Set UDQ_COLD_START_PROFILE=1 on the Lambda to record the import time of every module imported after udq_profile
+#   (import it first in the handler module), the build time of each LazyResource and the duration of the first
+#   invocation. The profile is logged as one JSON line ({"udqColdStartProfile": ...}) after the first invocation
+# ---------------------------------------------------------------------------
+
+PROFILE_ENABLED = os.environ.get('UDQ_COLD_START_PROFILE', '').lower() in ('1', 'true', 'yes')
+
+# number of slowest module imports included in the profile
+PROFILE_TOP_IMPORTS = 25
+
+
+class ColdStartProfile:
+    """
+    Records module import times (self and cumulative milliseconds), named init phases and the first invocation
+    """
+
+    def __init__(self):
+        self._imports = {} # module name -> [self ms, cumulative ms]
+        self._init_phases = {} # name -> ms
+        self._first_invocation_ms = None
+        self._created_at = time.perf_counter()
+        self._lock = threading.Lock()
+        self._import_stack = []
+
+    def record_import(self, module_name, cumulative_ms, children_ms):
+        with self._lock:
+            self._imports[module_name] = [cumulative_ms - children_ms, cumulative_ms]
+
+    def record_init_phase(self, name, milliseconds):
+        with self._lock:
+            self._init_phases[name] = self._init_phases.get(name, 0.0) + milliseconds
+
+    def record_first_invocation(self, milliseconds):
+        """
+        :return: True if this was the first invocation recorded
+        """
+        with self._lock:
+            if self._first_invocation_ms is not None:
+                return False
+            self._first_invocation_ms = milliseconds
+            return True
+
+    def to_dict(self, top_imports=PROFILE_TOP_IMPORTS) -> dict:
+        slowest = sorted(self._imports.items(), key=lambda item: item[1][1], reverse=True)[:top_imports]
+        return {
+            'profiledImportMs': round(sum(self_ms for self_ms, _ in self._imports.values()), 3),
+            'imports': [{'module': name, 'selfMs': round(self_ms, 3), 'cumulativeMs': round(cumulative_ms, 3)} for name, (self_ms, cumulative_ms) in slowest],
+            'initPhasesMs': {name: round(ms, 3) for name, ms in self._init_phases.items()},
+            'firstInvocationMs': round(self._first_invocation_ms, 3) if self._first_invocation_ms is not None else None,
+            'sinceProfileStartMs': round((time.perf_counter() - self._created_at) * 1000, 3),
+        }
+
+    def emit(self, writer=print) -> str:
+        line = json.dumps({'udqColdStartProfile': self.to_dict()}, separators=(',', ':'))
+        writer(line)
+        return line
+
+
+class _TimedLoader:
+    """
+    Wraps a module loader to time its exec_module, attributing nested imports to the importing module
+    """
+
+    def __init__(self, loader, profile):
+        self._loader = loader
+        self._profile = profile
+
+    def __getattr__(self, name):
+        return getattr(self._loader, name)
+
+    def create_module(self, spec):
+        return self._loader.create_module(spec)
+
+    def exec_module(self, module):
+        stack = self._profile._import_stack
+        stack.append(0.0)
+        start = time.perf_counter()
+        try:
+            self._loader.exec_module(module)
+        finally:
+            cumulative_ms = (time.perf_counter() - start) * 1000
+            children_ms = stack.pop()
+            if stack:
+                stack[-1] += cumulative_ms
+            self._profile.record_import(module.__name__, cumulative_ms, children_ms)
+
+
+class _TimingFinder:
+    """
+    Meta path finder delegating to the other finders, wrapping the loaders it finds with _TimedLoader
+    """
+
+    def __init__(self, profile):
+        self._profile = profile
+
+    def find_spec(self, fullname, path=None, target=None):
+        for finder in sys.meta_path:
+            if finder is self or not hasattr(finder, 'find_spec'):
+                continue
+            spec = finder.find_spec(fullname, path, target)
+            if spec is not None:
+                if spec.loader is not None and hasattr(spec.loader, 'exec_module'):
+                    spec.loader = _TimedLoader(spec.loader, self._profile)
+                return spec
+        return None
+
+
+COLD_START_PROFILE = ColdStartProfile() if PROFILE_ENABLED else None
+
+if COLD_START_PROFILE is not None:
+    sys.meta_path.insert(0, _TimingFinder(COLD_START_PROFILE))
+
+
+def record_invocation(start, writer=print):
+    """
+    Called by the framework after each invocation: records and logs the profile after the first one, if profiling is enabled
+    """
+    if COLD_START_PROFILE is not None and COLD_START_PROFILE.record_first_invocation((time.perf_counter() - start) * 1000):
+        COLD_START_PROFILE.emit(writer)
+
+
+class LazyResource:
+    """
+    A resource (SDK client, dataset, ...) built on first use by factory() and shared afterwards, thread-safe
+
+    Attribute access is forwarded to the resource, so a LazyResource can stand in for e.g. a boto3 client
+    """
+
+    def __init__(self, name: str, factory):
+        self._name = name
+        self._factory = factory
+        self._resource = None
+        self._built = False
+        self._lock = threading.Lock()
+
+    @property
+    def name(self) -> str:
+        return self._name
+
+    @property
+    def built(self) -> bool:
+        return self._built
+
+    def get(self):
+        if not self._built:
+            with self._lock:
+                if not self._built:
+                    start = time.perf_counter()
+                    self._resource = self._factory()
+                    self._built = True
+                    if COLD_START_PROFILE is not None:
+                        COLD_START_PROFILE.record_init_phase(self._name, (time.perf_counter() - start) * 1000)
+        return self._resource
+
+    def reset(self):
+        """
+        Drop the resource, so the next use builds it again (e.g. after a dataset was replaced)
+        """
+        with self._lock:
+            self._resource = None
+            self._built = False
+
+    def __getattr__(self, name):
+        return getattr(self.get(), name)
+
+    def __repr__(self):
+        return f"LazyResource({self._name!r}, built={self._built})"
@@ -0,0 +1,344 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+import hashlib
+import json
+import threading
+import time
+from bisect import bisect_right
+from collections import OrderedDict
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from functools import lru_cache
+
+from udq_utils.udq_cursor import Cursor, CursorCodec
+from udq_utils.udq_models import IoTTwinMakerUdqRequest, OrderBy
+
+# ---------------------------------------------------------------------------
+#   Incremental sliding-window fetch for dashboards that poll "last N minutes"
+#
+#   A SlidingWindowCache assigned to IoTTwinMakerUnifiedDataQuery.window_cache keeps the values already fetched for each
+#   (query scope, property) in a time-partitioned segment: the covered time range (start, end] and, per property reference,
+#   the sorted timestamps and values inside it. A request overlapping a segment only queries the connector for the
+#   uncovered delta (e.g. the last 5 s of a 1 h window refreshed every 5 s) and is answered from the merged segment in the
+#   requested OrderBy
+#
+#   The connector is queried with regular UDQ sub-requests for the delta windows (all pages, ascending), so any reader
+#   works unchanged as long as it honors the request window. The last settle_seconds (60 s by default) before now are
+#   never kept, as values may still be arriving for them: they are fetched again by the next window. Values arriving in
+#   the backend later than settle_seconds after their timestamp are not seen by windows that were already fetched, raise
+#   settle_seconds for such backends
+#
+#   Fetches run outside the cache lock. Requests for the same (query scope, property) wait for each other, so a delta is
+#   fetched once, while requests for other properties and scopes are served concurrently
+# ---------------------------------------------------------------------------
+
+# prefix of the nextTokens returned when a window served from the cache is paged by maxResults
+WINDOW_TOKEN_PREFIX = 'udqwin:'
+
+DEFAULT_MAX_SEGMENTS = 1000
+DEFAULT_MAX_VALUES_PER_SEGMENT = 200_000
+DEFAULT_SETTLE_SECONDS = 60
+
+NANOS_PER_SECOND = 1_000_000_000
+NANOS_PER_MILLI = 1_000_000
+
+
+@lru_cache(maxsize=4096)
+def _epoch_seconds(base: str) -> int:
+    return int(datetime.fromisoformat(base.replace(' ', 'T')).replace(tzinfo=timezone.utc).timestamp())
+
+
+def iso8601_to_epoch_ns(timestamp: str) -> int:
+    """
+    Parse a UTC ISO8601 timestamp with up to nanosecond precision, e.g. '2022-04-06T00:17:45.419000000Z'
+    """
+    if timestamp.endswith('Z'):
+        timestamp = timestamp[:-1]
+    elif timestamp.endswith('+00:00'):
+        timestamp = timestamp[:-6]
+    base, _, fraction = timestamp.partition('.')
+    nanos = int((fraction + '000000000')[:9]) if fraction else 0
+    return _epoch_seconds(base) * NANOS_PER_SECOND + nanos
+
+
+def epoch_ns_to_iso8601(epoch_ns: int) -> str:
+    """
+    Format epoch nanoseconds as a UTC ISO8601 timestamp with millisecond precision (truncated)
+    """
+    seconds, nanos = divmod(epoch_ns, NANOS_PER_SECOND)
+    return datetime.fromtimestamp(seconds, timezone.utc).strftime('%Y-%m-%dT%H:%M:%S') + '.%03dZ' % (nanos // NANOS_PER_MILLI)
+
+
+class _TimeBound:
+    """
+    A window boundary, kept both as epoch nanoseconds for comparisons and as the ISO8601 string sent to connectors
+    """
+    __slots__ = ('ns', 'iso')
+
+    def __init__(self, ns: int, iso: str):
+        self.ns = ns
+        self.iso = iso
+
+    @staticmethod
+    def parse(iso: str):
+        return _TimeBound(iso8601_to_epoch_ns(iso), iso)
+
+
+class _PropertySegment:
+    """
+    The values of one property for a query scope within the covered window (start, end], per property reference
+    """
+    __slots__ = ('start', 'end', 'series', 'num_values')
+
+    def __init__(self, start: _TimeBound, end: _TimeBound):
+        self.start = start
+        self.end = end
+        self.series = {} # IoTTwinMakerReference -> ([epoch ns], [ISO8601 timestamp], [value]) sorted by time
+        self.num_values = 0
+
+    def merge(self, fetched_series, start: _TimeBound, end: _TimeBound):
+        """
+        Merge series fetched for (start, end], a window adjacent to the covered one, and extend the coverage
+        """
+        prepend = start.ns < self.start.ns
+        for reference, (timestamps_ns, timestamps, values) in fetched_series.items():
+            series = self.series.get(reference)
+            if series is None:
+                self.series[reference] = (timestamps_ns, timestamps, values)
+            elif prepend:
+                self.series[reference] = (timestamps_ns + series[0], timestamps + series[1], values + series[2])
+            else:
+                series[0].extend(timestamps_ns)
+                series[1].extend(timestamps)
+                series[2].extend(values)
+            self.num_values += len(timestamps_ns)
+        if prepend:
+            self.start = start
+        else:
+            self.end = end
+
+    def truncate_after(self, end: _TimeBound):
+        """
+        Shrink the coverage to end at `end`, dropping later values so they are fetched again
+        """
+        for reference, (timestamps_ns, timestamps, values) in self.series.items():
+            hi = bisect_right(timestamps_ns, end.ns)
+            if hi < len(timestamps_ns):
+                self.num_values -= len(timestamps_ns) - hi
+                del timestamps_ns[hi:], timestamps[hi:], values[hi:]
+        self.end = end
+
+    def truncate_before(self, start: _TimeBound):
+        """
+        Shrink the coverage to start (exclusively) at `start`, dropping older values
+        """
+        for reference, (timestamps_ns, timestamps, values) in self.series.items():
+            lo = bisect_right(timestamps_ns, start.ns)
+            if lo:
+                self.num_values -= lo
+                del timestamps_ns[:lo], timestamps[:lo], values[:lo]
+        self.start = start
+
+
+def _scope_key(request) -> str:
+    """
+    Fingerprint of everything that determines a property's values apart from the window and page
+    """
+    fields = [
+        request.udq_context['workspace_id'],
+        request.entity_id,
+        request.component_name,
+        request.component_type_id,
+        request.udq_context['properties'],
+        request.property_filters,
+    ]
+    return hashlib.sha256(json.dumps(fields, sort_keys=True, separators=(',', ':'), default=str).encode('utf-8')).hexdigest()
+
+
+class SlidingWindowCache:
+    """
+    Time-partitioned segment cache per (query scope, property), serving overlapping windows from memory and fetching
+    only the uncovered delta from the connector
+
+    Segments are evicted least recently used beyond max_segments, and trimmed to the latest requested window once they
+    hold more than max_values_per_segment values
+    """
+
+    def __init__(self, max_segments: int = DEFAULT_MAX_SEGMENTS, max_values_per_segment: int = DEFAULT_MAX_VALUES_PER_SEGMENT,
+                 settle_seconds: float = DEFAULT_SETTLE_SECONDS, clock=time.time):
+        self.max_segments = max_segments
+        self.max_values_per_segment = max_values_per_segment
+        self.settle_seconds = settle_seconds
+        self._clock = clock
+        self._segments = OrderedDict() # (scope key, property name) -> _PropertySegment
+        self._segment_locks = {} # (scope key, property name) -> [lock held while reading or updating the segment, number of users]
+        self._lock = threading.Lock()
+        self._cursor_codec = CursorCodec()
+
+    def __len__(self):
+        return len(self._segments)
+
+    def accepts(self, request) -> bool:
+        """
+        Whether the request can be served from the cache: first pages, and later pages of windows the cache served
+        """
+        return not request.next_token or request.next_token.startswith(WINDOW_TOKEN_PREFIX)
+
+    def query(self, request, fetch):
+        """
+        Serve the request from the cached segments, calling fetch(sub_request) -> IoTTwinMakerUdqResponse /
+        IoTTwinMakerUdqColumnarResponse for the uncovered windows
+
+        :return: an IoTTwinMakerUdqColumnarResponse with the values of the requested window
+        """
+        from udq_utils.udq import IoTTwinMakerUdqColumnarResponse
+
+        start = _TimeBound.parse(request.start_time)
+        end = _TimeBound.parse(request.end_time)
+        scope_key = _scope_key(request)
+
+        references, reference_ids, timestamps, values = [], [], [], []
+        for selected_property in request.selected_properties:
+            key = (scope_key, selected_property)
+            with self._segment_lock(key):
+                segment = self._get_segment(request, key, selected_property, start, end, fetch)
+
+                # slice the requested window out of the segment
+                for reference, (series_ns, series_timestamps, series_values) in segment.series.items():
+                    lo = bisect_right(series_ns, start.ns)
+                    hi = bisect_right(series_ns, end.ns)
+                    if lo == hi:
+                        continue
+                    window_timestamps = series_timestamps[lo:hi]
+                    window_values = series_values[lo:hi]
+                    if request.order_by == OrderBy.DESCENDING:
+                        window_timestamps.reverse()
+                        window_values.reverse()
+                    reference_ids.extend([len(references)] * (hi - lo))
+                    references.append(reference)
+                    timestamps.extend(window_timestamps)
+                    values.extend(window_values)
+
+                # values close to "now" may still be arriving, leave them uncovered so the next window fetches them again
+                settled_ns = int((self._clock() - self.settle_seconds) * NANOS_PER_SECOND) // NANOS_PER_MILLI * NANOS_PER_MILLI
+                if segment.end.ns > settled_ns:
+                    segment.truncate_after(segment.start if settled_ns <= segment.start.ns else _TimeBound(settled_ns, epoch_ns_to_iso8601(settled_ns)))
+                if segment.num_values > self.max_values_per_segment:
+                    segment.truncate_before(min(start, segment.end, key=lambda bound: bound.ns))
+
+        request.metrics.add_count('WindowCacheValues', len(values))
+
+        # page by maxResults, resuming at an offset into the window
+        next_token = None
+        if request.max_rows:
+            offset = self._decode_offset(request)
+            if offset + request.max_rows < len(values):
+                next_token = WINDOW_TOKEN_PREFIX + self._cursor_codec.encode(Cursor(0, offset + request.max_rows), request)
+            page = slice(offset, offset + request.max_rows)
+            reference_ids, timestamps, values = reference_ids[page], timestamps[page], values[page]
+
+        return IoTTwinMakerUdqColumnarResponse(references, reference_ids, timestamps, values, next_token)
+
+    def _decode_offset(self, request) -> int:
+        if not request.next_token:
+            return 0
+        token = request.next_token[len(WINDOW_TOKEN_PREFIX):]
+        return self._cursor_codec.decode(request, token).row_offset
+
+    @contextmanager
+    def _segment_lock(self, key):
+        """
+        Hold the lock of a segment while it is read or updated (including the connector fetches), the cache lock is only
+        taken to look up and insert entries
+        """
+        with self._lock:
+            entry = self._segment_locks.get(key)
+            if entry is None:
+                entry = self._segment_locks[key] = [threading.Lock(), 0]
+            entry[1] += 1
+        try:
+            with entry[0]:
+                yield
+        finally:
+            with self._lock:
+                entry[1] -= 1
+                if not entry[1]:
+                    del self._segment_locks[key]
+
+    def _get_segment(self, request, key, selected_property, start, end, fetch) -> _PropertySegment:
+        """
+        The segment of key covering (start, end], after fetching the uncovered windows. Called holding the segment lock
+        """
+        with self._lock:
+            segment = self._segments.get(key)
+
+        # windows disjoint from the covered one start a new segment, rather than caching a gap
+        if segment is not None and (start.ns > segment.end.ns or end.ns < segment.start.ns):
+            segment = None
+
+        if segment is None:
+            segment = _PropertySegment(start, start)
+            self._fetch_into(request, segment, selected_property, start, end, fetch)
+        else:
+            if start.ns < segment.start.ns:
+                self._fetch_into(request, segment, selected_property, start, segment.start, fetch)
+            if end.ns > segment.end.ns:
+                self._fetch_into(request, segment, selected_property, segment.end, end, fetch)
+
+        with self._lock:
+            self._segments[key] = segment
+            self._segments.move_to_end(key)
+            while len(self._segments) > self.max_segments:
+                self._segments.popitem(last=False)
+        return segment
+
+    def _fetch_into(self, request, segment, selected_property, start, end, fetch):
+        """
+        Fetch (start, end] for one property from the connector and merge it into the segment
+        """
+        fetched_series = {}
+        next_token = None
+        while True:
+            sub_request = _sub_request(request, selected_property, start, end, next_token)
+            response = fetch(sub_request)
+            for reference, timestamp, value in response.iterate_values():
+                series = fetched_series.get(reference)
+                if series is None:
+                    series = fetched_series[reference] = ([], [], [])
+                series[0].append(iso8601_to_epoch_ns(timestamp))
+                series[1].append(timestamp)
+                series[2].append(value)
+            next_token = response.next_token
+            if not next_token:
+                break
+
+        # connectors may return rows in any order, segments keep each series sorted by time
+        for reference, (timestamps_ns, timestamps, values) in fetched_series.items():
+            if any(timestamps_ns[i] > timestamps_ns[i + 1] for i in range(len(timestamps_ns) - 1)):
+                order = sorted(range(len(timestamps_ns)), key=timestamps_ns.__getitem__)
+                fetched_series[reference] = ([timestamps_ns[i] for i in order], [timestamps[i] for i in order], [values[i] for i in order])
+
+        request.metrics.add_count('WindowCacheFetchedValues', sum(len(series[0]) for series in fetched_series.values()))
+        segment.merge(fetched_series, start, end)
+
+
+def _sub_request(request, selected_property, start: _TimeBound, end: _TimeBound, next_token):
+    """
+    A copy of the request for one property over (start, end], ascending and unbounded so the connector returns all values
+    """
+    event = dict(request.event)
+    event['selectedProperties'] = [selected_property]
+    event['startTime'] = start.iso
+    event['endTime'] = end.iso
+    event['startDateTime'] = start.ns / NANOS_PER_SECOND
+    event['endDateTime'] = end.ns / NANOS_PER_SECOND
+    event['orderByTime'] = 'ASCENDING'
+    event.pop('maxResults', None)
+    event.pop('nextToken', None)
+    if next_token:
+        event['nextToken'] = next_token
+    sub_request = IoTTwinMakerUdqRequest.parse(event)
+    sub_request._metrics = request.metrics
+    return sub_request
+
@@ -9,6 +9,7 @@ import { aws_iam as iam } from 'aws-cdk-lib';
 import { aws_logs as logs } from 'aws-cdk-lib';
 import { aws_lambda as lambda } from 'aws-cdk-lib';
 import { aws_timestream as timestream } from 'aws-cdk-lib';
+import { aws_secretsmanager as secretsmanager } from 'aws-cdk-lib';
 
 export class TimestreamTelemetryCdkLambdasStack extends Stack {
   constructor(scope: Construct, id: string, props?: StackProps) {
@@ -39,6 +40,28 @@ export class TimestreamTelemetryCdkLambdasStack extends Stack {
       new CfnOutput(this, "TimestreamDatabaseName", { value: `${timestreamDB.databaseName}` });
       new CfnOutput(this, "TimestreamTableName", { value: `${timestreamTable.tableName}` });
 
+      // opt-in (cdk deploy -c telemetryRollups=true) 1 minute and 1 hour rollups of the numeric telemetry, maintained by
+      // TimestreamTelemetryImporter (build_rollups, create_rollup_scheduled_queries)
+      const telemetryRollups = this.node.tryGetContext('telemetryRollups') == 'true';
+      const rollupTables = !telemetryRollups ? [] : ['1m', '1h'].map((interval) => {
+        const rollupTable = new timestream.CfnTable(this, `Telemetry${interval}`, {
+          tableName: `Telemetry_${interval}`,
+          databaseName: timestreamDB.databaseName!,
+          retentionProperties: {
+            memoryStoreRetentionPeriodInHours: (24*30).toString(10),
+            magneticStoreRetentionPeriodInDays: (365).toString(10)
+          }
+        });
+        rollupTable.node.addDependency(timestreamDB);
+        return `${interval}:${rollupTable.tableName}`;
+      });
+
+      // random key signing the nextTokens of the reader (see udq_utils.udq_cursor), generated once per deployment and
+      // read by the reader at runtime, so it's neither in the template nor in the function configuration
+      const udqCursorSecret = new secretsmanager.Secret(this, 'udqCursorSecret', {
+        generateSecretString: { passwordLength: 48, excludePunctuation: true },
+      });
+
       // udq reader lambda
       const timestreamReaderUDQ = new PythonFunction(this, 'timestreamReaderUDQ', {
         functionName: `iottwinmaker-${this.stackName}-tsDataReader`,
@@ -59,8 +82,11 @@ export class TimestreamTelemetryCdkLambdasStack extends Stack {
         environment: {
           "TIMESTREAM_DATABASE_NAME": `${timestreamDB.databaseName}`,
           "TIMESTREAM_TABLE_NAME": `${timestreamTable.tableName}`,
+          ...(telemetryRollups ? { "TIMESTREAM_ROLLUP_TABLES": rollupTables.join(',') } : {}),
+          "UDQ_CURSOR_SECRET_ARN": udqCursorSecret.secretArn,
         }
       });
+      udqCursorSecret.grantRead(timestreamReaderUDQ);
       new CfnOutput(this, "TimestreamReaderUDQLambdaArn", { value: timestreamReaderUDQ.functionArn });
     }
   }
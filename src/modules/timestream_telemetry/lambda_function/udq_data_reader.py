@@ -1,22 +1,105 @@
 # Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved. 2021
 # SPDX-License-Identifier: Apache-2.0
 
+import heapq
+import json
 import logging
 import os
+import re
 import sys
-from datetime import datetime
+from datetime import datetime, timezone
+from functools import lru_cache
+from itertools import repeat
+from operator import itemgetter
 
-import boto3
+# imported first so UDQ_COLD_START_PROFILE can time the imports below
+from udq_utils.udq_profile import LazyResource
 
-from udq_utils.udq import SingleEntityReader, MultiEntityReader, IoTTwinMakerDataRow, IoTTwinMakerUdqResponse
+from udq_utils.udq import SingleEntityReader, MultiEntityReader, IoTTwinMakerDataRow, IoTTwinMakerUdqResponse, IoTTwinMakerUdqColumnarResponse
 from udq_utils.udq_models import IoTTwinMakerUDQEntityRequest, IoTTwinMakerUDQComponentTypeRequest, OrderBy, IoTTwinMakerReference, \
-    EntityComponentPropertyRef, ExternalIdPropertyRef
+    IoTTwinMakerReferenceTable
 
 from udq_utils.sql_detector import SQLDetector
+from udq_utils.udq_config_cache import ConfigCache
+from udq_utils.udq_cursor import CompositeCursorCodec
+from udq_utils.udq_downsample import MINMAX, VALUES_PER_MINMAX_BUCKET
+from udq_utils.udq_filters import parse_property_filters, compile_property_filters
+from udq_utils.udq_latest_cache import default_latest_value_cache
+from udq_utils.udq_metrics import NULL_QUERY_METRICS
+from udq_utils.udq_prefetch import default_page_prefetcher
+from udq_utils.udq_window_cache import iso8601_to_epoch_ns
 
 LOGGER = logging.getLogger()
 LOGGER.setLevel(logging.INFO)
 
+# property data types stored as measure_value::double, which can be aggregated in Timestream
+NUMERIC_DATA_TYPES = ('DOUBLE', 'INTEGER', 'LONG')
+
+# property data type -> the Timestream column its values are stored in
+VALUE_COLUMNS = {
+    'DOUBLE': 'measure_value::double',
+    'INTEGER': 'measure_value::double',
+    'LONG': 'measure_value::double',
+    'STRING': 'measure_value::varchar',
+    'BOOLEAN': 'measure_value::boolean',
+}
+
+# columns selected for properties without a known data type, a row's value is the first non-null one of them
+DEFAULT_VALUE_COLUMNS = ('measure_value::double', 'measure_value::varchar')
+VALUE_COLUMN_PRECEDENCE = ('measure_value::varchar', 'measure_value::double', 'measure_value::boolean')
+
+# UDQ filter value type -> Timestream column compared against, numbers are stored as doubles
+FILTER_VALUE_COLUMNS = {
+    'stringValue': 'measure_value::varchar',
+    'doubleValue': 'measure_value::double',
+    'integerValue': 'measure_value::double',
+    'longValue': 'measure_value::double',
+    'booleanValue': 'measure_value::boolean',
+}
+
+# run one query per selected measure concurrently and merge their rows on time, instead of one query ORing all measures
+PER_MEASURE_QUERIES = os.environ.get('TIMESTREAM_PER_MEASURE_QUERIES', '').lower() in ('1', 'true', 'yes')
+
+# split selections of properties stored in different columns into one query per column, merged on time
+TYPED_SUB_QUERIES = os.environ.get('TIMESTREAM_TYPED_SUB_QUERIES', '').lower() in ('1', 'true', 'yes')
+
+# seconds the value columns of the table are cached for, with typed_sub_queries: a table only has the measure_value::<type>
+# columns of the types it has ingested, selecting another one fails the query
+TABLE_SCHEMA_TTL_SECONDS = float(os.environ.get('TIMESTREAM_TABLE_SCHEMA_TTL_SECONDS', 300))
+
+# prefix of the composite nextTokens (one Timestream NextToken per sub-query) of merged sub-queries
+SUB_QUERY_TOKEN_PREFIX = 'udqsq:'
+
+# measure_name of the multi-measure records holding the properties as columns, if the table stores multi-measure records
+MULTI_MEASURE_NAME = os.environ.get('TIMESTREAM_MULTI_MEASURE_NAME') or None
+
+# property names usable as (quoted) multi-measure column names
+MULTI_MEASURE_ATTRIBUTE_PATTERN = re.compile(r'^[A-Za-z0-9_.:\-]+$')
+
+# rollup tables of the numeric measures as "<interval>:<table>" entries, e.g. "1m:Telemetry_1m,1h:Telemetry_1h"
+# (maintained by TimestreamTelemetryImporter.build_rollups / create_rollup_scheduled_queries), empty to only query raw data
+ROLLUP_TABLES = os.environ.get('TIMESTREAM_ROLLUP_TABLES', '')
+
+# tier reported for queries of the raw telemetry table
+RAW_TIER = 'raw'
+
+ROLLUP_INTERVAL_PATTERN = re.compile(r'^(\d+)(ms|s|m|h|d)$')
+ROLLUP_INTERVAL_UNIT_MS = {'ms': 1, 's': 1000, 'm': 60_000, 'h': 3_600_000, 'd': 86_400_000}
+
+
+def parse_rollup_tables(spec: str) -> list:
+    """
+    Parses a TIMESTREAM_ROLLUP_TABLES value into [(interval, interval in milliseconds, table name)], finest interval first
+    """
+    tiers = []
+    for entry in filter(None, (entry.strip() for entry in (spec or '').split(','))):
+        interval, _, table_name = entry.partition(':')
+        match = ROLLUP_INTERVAL_PATTERN.match(interval.strip())
+        if match is None or not table_name.strip():
+            raise ValueError(f"Invalid rollup table [{entry}], expected <interval>:<table> e.g. 1m:Telemetry_1m")
+        tiers.append((interval.strip(), int(match.group(1)) * ROLLUP_INTERVAL_UNIT_MS[match.group(2)], table_name.strip()))
+    return sorted(tiers, key=lambda tier: tier[1])
+
 # ---------------------------------------------------------------------------
 #   Sample implementation of an AWS IoT TwinMaker UDQ Connector against AWS Timestream
 #   consists of the EntityReader and IoTTwinMakerDataRow implementations
@@ -29,11 +112,44 @@ class TimestreamReader(SingleEntityReader, MultiEntityReader):
     It supports both single-entity queries and multi-entity queries and contains 2 utility functions to read from Timestream
     and convert the results into a IoTTwinMakerUdqResponse object
     """
-    def __init__(self, query_client, database_name, table_name):
+
+    # opt-in background prefetch of the next Timestream page, see udq_utils.udq_prefetch
+    page_prefetcher = default_page_prefetcher()
+
+    # opt-in cache of the latest values of all assets of a type shared by latest-value requests, see udq_utils.udq_latest_cache
+    latest_value_cache = default_latest_value_cache()
+
+    def __init__(self, query_client, database_name, table_name, per_measure_queries=PER_MEASURE_QUERIES, executor=None,
+                 typed_sub_queries=TYPED_SUB_QUERIES, multi_measure_name=MULTI_MEASURE_NAME, rollup_tables=ROLLUP_TABLES):
         self.query_client = query_client
         self.database_name = database_name
         self.table_name = table_name
         self.sqlDetector = SQLDetector()
+        self.per_measure_queries = per_measure_queries
+        self.typed_sub_queries = typed_sub_queries
+        self.multi_measure_name = multi_measure_name
+        self.rollup_tiers = parse_rollup_tables(rollup_tables)
+        self.executor = executor if executor is not None else QUERY_EXECUTOR
+        self.sub_query_cursor_codec = CompositeCursorCodec(SUB_QUERY_TOKEN_PREFIX)
+        self.table_schema_cache = ConfigCache(TABLE_SCHEMA_TTL_SECONDS)
+
+    # overrides IoTTwinMakerUnifiedDataQuery.metrics_dimensions
+    def metrics_dimensions(self, request) -> dict:
+        dimensions = super().metrics_dimensions(request)
+        dimensions['TimestreamTable'] = f"{self.database_name}.{self.table_name}"
+        return dimensions
+
+    # overrides IoTTwinMakerUnifiedDataQuery.pushes_down_downsampling
+    def pushes_down_downsampling(self, request) -> bool:
+        """
+        Min/max downsampling of numeric properties is pushed into the query with bin(), LTTB is left to the framework. Each
+        bucket row yields up to VALUES_PER_MINMAX_BUCKET values, so pages of fewer maxResults are downsampled by the framework
+        """
+        if request.downsampling.method != MINMAX or self.multi_measure_name:
+            return False
+        if request.max_rows and request.max_rows < VALUES_PER_MINMAX_BUCKET:
+            return False
+        return all(self._data_type(request, selected_property) in NUMERIC_DATA_TYPES for selected_property in request.selected_properties)
 
     # overrides SingleEntityReader.entity_query abstractmethod
     def entity_query(self, request: IoTTwinMakerUDQEntityRequest) -> IoTTwinMakerUdqResponse:
@@ -44,35 +160,10 @@ class TimestreamReader(SingleEntityReader, MultiEntityReader):
         """
         LOGGER.info("TimestreamReader entity_query")
 
-        selected_properties = request.selected_properties
-        property_filter = request.property_filters[0] if request.property_filters else None
-        filter_clause = f"AND measure_value::varchar {property_filter['operator']} '{property_filter['value']['stringValue']}'" if property_filter else ""
-
         telemetry_asset_type = request.udq_context['properties']['telemetryAssetType']['value']['stringValue']
         telemetry_asset_id = request.udq_context['properties']['telemetryAssetId']['value']['stringValue']
 
-        sample_sel_properties = [f"p{x}" for x in range(0, len(selected_properties))] # e.g. "p0", "p1", ...
-        sample_measure_name_clause = " OR ".join([f"measure_name = '{x}'" for x in sample_sel_properties])
-        measure_name_clause = " OR ".join([f"measure_name = '{x}'" for x in selected_properties])
-        if property_filter:
-            sample_query = f"""SELECT TelemetryAssetId, measure_name, time, measure_value::double, measure_value::varchar FROM "CookieFactoryTelemetry"."Telemetry"  WHERE time > from_iso8601_timestamp('2021-10-18T21:42:58') AND time <= from_iso8601_timestamp('2021-10-18T21:43:35') AND TelemetryAssetType = 'test' AND TelemetryAssetId = 'test' AND ({sample_measure_name_clause}) AND measure_value::varchar {property_filter['operator']} 'abc'  ORDER BY time ASC"""
-        else:
-            sample_query = f"""SELECT TelemetryAssetId, measure_name, time, measure_value::double, measure_value::varchar FROM "CookieFactoryTelemetry"."Telemetry"  WHERE time > from_iso8601_timestamp('2021-10-18T21:42:58') AND time <= from_iso8601_timestamp('2021-10-18T21:43:35') AND TelemetryAssetType = 'test' AND TelemetryAssetId = 'test' AND ({sample_measure_name_clause})   ORDER BY time ASC"""
-
-        query_string = f"SELECT TelemetryAssetId, measure_name, time, measure_value::double, measure_value::varchar" \
-                       f""" FROM "{self.database_name}"."{self.table_name}" """ \
-                       f""" WHERE time > from_iso8601_timestamp('{request.start_time}')""" \
-                       f""" AND time <= from_iso8601_timestamp('{request.end_time}')""" \
-                       f""" AND TelemetryAssetType = '{telemetry_asset_type}'""" \
-                       f""" AND TelemetryAssetId = '{telemetry_asset_id}'""" \
-                       f""" AND ({measure_name_clause})""" \
-                       f""" {filter_clause} """ \
-                       f""" ORDER BY time {'ASC' if request.order_by == OrderBy.ASCENDING else 'DESC'}"""
-
-        self.sqlDetector.detectInjection(sample_query, query_string)
-
-        page = self._run_timestream_query(query_string, request.next_token, request.max_rows)
-        return self._convert_timestream_query_page_to_udq_response(page, request.entity_id, request.component_name, telemetry_asset_type)
+        return self._query_timestream(request, telemetry_asset_type, telemetry_asset_id)
 
     # overrides MultiEntityReader.component_type_query abstractmethod
     def component_type_query(self, request: IoTTwinMakerUDQComponentTypeRequest) -> IoTTwinMakerUdqResponse:
@@ -83,34 +174,651 @@ class TimestreamReader(SingleEntityReader, MultiEntityReader):
         """
         LOGGER.info("TimestreamReader component_type_query")
 
-        selected_properties = request.selected_properties
-        property_filter = request.property_filters[0] if request.property_filters else None
-        filter_clause = f"AND measure_value::varchar {property_filter['operator']} '{property_filter['value']['stringValue']}'" if property_filter else ""
         telemetry_asset_type = request.udq_context['properties']['telemetryAssetType']['value']['stringValue']
 
-        sample_sel_properties = [f"p{x}" for x in range(0, len(selected_properties))] # e.g. "p0", "p1", ...
-        sample_measure_name_clause = " OR ".join([f"measure_name = '{x}'" for x in sample_sel_properties])
-        measure_name_clause = " OR ".join([f"measure_name = '{x}'" for x in selected_properties])
-        if property_filter:
-            sample_query = f"""SELECT TelemetryAssetId, measure_name, time, measure_value::double, measure_value::varchar FROM "CookieFactoryTelemetry"."Telemetry"  WHERE time > from_iso8601_timestamp('2021-10-18T21:42:58') AND time <= from_iso8601_timestamp('2021-10-18T21:43:35') AND TelemetryAssetType = 'test' AND ({sample_measure_name_clause}) AND measure_value::varchar {property_filter['operator']} 'abc'  ORDER BY time ASC"""
+        return self._query_timestream(request, telemetry_asset_type)
+
+    def _query_timestream(self, request, telemetry_asset_type, telemetry_asset_id=None):
+        """
+        Utility function: serves a request from multi-measure records, with merged sub-queries, or with a single query
+        selecting only the value columns of the selected properties' data types
+        """
+        if self.multi_measure_name:
+            return self._multi_measure_query(request, telemetry_asset_type, telemetry_asset_id)
+
+        if self._is_latest_value_request(request):
+            return self._latest_value_query(request, telemetry_asset_type, telemetry_asset_id)
+
+        sub_query_properties = self._sub_query_properties(request)
+        if sub_query_properties is not None:
+            return self._merged_sub_queries(request, telemetry_asset_type, telemetry_asset_id, sub_query_properties)
+
+        with request.metrics.phase('BuildQuery'):
+            query_string = self._build_query_string(request, telemetry_asset_type, telemetry_asset_id,
+                                                    value_columns=self._value_columns(request, request.selected_properties))
+
+        # a downsampled bucket row yields up to VALUES_PER_MINMAX_BUCKET values, a page of max_rows // 4 rows at most maxResults
+        max_rows = request.max_rows
+        if max_rows and request.downsampling is not None and self.pushes_down_downsampling(request):
+            max_rows = max_rows // VALUES_PER_MINMAX_BUCKET
+        with request.metrics.phase('BackendQuery'):
+            page = self._get_page(query_string, request.next_token, max_rows, request.metrics)
+        self._prefetch_page(query_string, page.get('NextToken'), max_rows)
+        with request.metrics.phase('RowBuild'):
+            return self._convert_page(request, page, telemetry_asset_type)
+
+    @staticmethod
+    def _data_type(request, property_name):
+        return request.udq_context['properties'].get(property_name, {}).get('definition', {}).get('dataType', {}).get('type')
+
+    def _value_columns(self, request, properties) -> tuple:
+        """
+        Utility function: the value columns to select for the given properties, the columns of their data types, plus
+        DEFAULT_VALUE_COLUMNS if some have no known data type
+
+        With typed_sub_queries, which split selections by value column, only the columns the table has are selected, or
+        all the value columns it has if it has none of these
+        """
+        columns = {VALUE_COLUMNS.get(self._data_type(request, property_name)) for property_name in properties}
+        if None in columns:
+            columns.update(DEFAULT_VALUE_COLUMNS)
+        table_columns = self._table_value_columns() if self.typed_sub_queries else None
+        if table_columns is not None:
+            columns = (columns & table_columns) or table_columns or columns
+        return tuple(column for column in dict.fromkeys(VALUE_COLUMNS.values()) if column in columns)
+
+    def _table_value_columns(self):
+        """
+        Utility function: the measure_value::<type> columns of the table, or None if they couldn't be described
+
+        The DESCRIBE query only runs on cold containers or once the cached columns are too old to be refreshed in the
+        background (see ConfigCache), process_query_async runs it off the event loop with the rest of the query
+        """
+        return self.table_schema_cache.get((self.database_name, self.table_name), self._describe_value_columns)
+
+    def _describe_value_columns(self):
+        database_name = str(self.database_name).replace('"', '""')
+        table_name = str(self.table_name).replace('"', '""')
+        try:
+            page = self._run_timestream_query(f'DESCRIBE "{database_name}"."{table_name}"', None, None)
+            decoder = TimestreamPageDecoder.for_schema(page['ColumnInfo'])
+            return frozenset(name for name in decoder.decode_column(page['Rows'], 'Column') if name.startswith('measure_value::'))
+        except Exception as err:
+            LOGGER.warning("Could not describe the value columns of %s.%s, selecting them by data type: %s", self.database_name, self.table_name, err)
+            return None
+
+    def _convert_page(self, request, page, telemetry_asset_type):
+        if request.downsampling is not None and self.pushes_down_downsampling(request):
+            return self._convert_downsampled_query_page_to_udq_response(page, request.entity_id, request.component_name, telemetry_asset_type,
+                                                                        request.order_by, request.reference_table)
+        return self._convert_timestream_query_page_to_udq_columnar_response(page, request.entity_id, request.component_name, telemetry_asset_type,
+                                                                            request.reference_table)
+
+    def _sub_query_properties(self, request):
+        """
+        Utility function: the selected properties of each sub-query if the request is served by merged sub-queries (see
+        _merged_sub_queries), or None for a single query
+
+        - with per_measure_queries, each selected property has its own sub-query
+        - with typed_sub_queries, properties stored in different value columns are split into one sub-query per column
+
+        Pages of merged sub-queries are always continued that way, other NextTokens belong to a single query
+        """
+        selected_properties = request.selected_properties
+        resuming = self.sub_query_cursor_codec.accepts(request.next_token)
+        if (request.next_token and not resuming) or len(selected_properties) < 2 \
+                or (request.downsampling is not None and self.pushes_down_downsampling(request)):
+            sub_query_properties = None
+        elif self.per_measure_queries:
+            sub_query_properties = [[selected_property] for selected_property in selected_properties]
+        elif self.typed_sub_queries:
+            by_column = {}
+            for selected_property in selected_properties:
+                by_column.setdefault(VALUE_COLUMNS.get(self._data_type(request, selected_property)), []).append(selected_property)
+            sub_query_properties = list(by_column.values()) if len(by_column) > 1 else None
         else:
-            sample_query = f"""SELECT TelemetryAssetId, measure_name, time, measure_value::double, measure_value::varchar FROM "CookieFactoryTelemetry"."Telemetry"  WHERE time > from_iso8601_timestamp('2021-10-18T21:42:58') AND time <= from_iso8601_timestamp('2021-10-18T21:43:35') AND TelemetryAssetType = 'test' AND ({sample_measure_name_clause})   ORDER BY time ASC"""
+            sub_query_properties = None
+
+        if resuming and sub_query_properties is None:
+            # a single query resumed at a row offset, e.g. after a latest-value response
+            sub_query_properties = [list(selected_properties)]
+        return sub_query_properties
+
+    @staticmethod
+    def _is_latest_value_request(request) -> bool:
+        """
+        Whether the request asks for the latest value of one property (e.g. an alarm or status tile), see _latest_value_query
+        """
+        return request.order_by == OrderBy.DESCENDING and request.max_rows == 1 and not request.next_token \
+            and len(request.selected_properties) == 1 and not request.property_filters
+
+    def _latest_value_query(self, request, telemetry_asset_type, telemetry_asset_id=None) -> IoTTwinMakerUdqColumnarResponse:
+        """
+        Utility function: serves a latest-value request with a max_by(value, time) query grouped by TelemetryAssetId instead
+        of sorting the window. With the (opt-in) latest_value_cache, the query covers all assets of the type and the
+        requests for the other assets (one per tile) are served from the cache, up to its TTL behind the ingested data
+
+        The nextToken resumes the regular descending query without the returned row
+        """
+        selected_property = request.selected_properties[0]
+        start_ns = iso8601_to_epoch_ns(request.start_time)
+        cache = self.latest_value_cache
+        cache_key = (self.database_name, self.table_name, telemetry_asset_type, selected_property)
+        latest = None
+        if cache is not None:
+            latest = cache.get(cache_key, start_ns, iso8601_to_epoch_ns(request.end_time), telemetry_asset_id)
+            request.metrics.add_count('LatestValueCacheHits' if latest is not None else 'LatestValueCacheMisses')
+
+        if latest is None:
+            with request.metrics.phase('BuildQuery'):
+                query_string = self._build_latest_value_query_string(request, telemetry_asset_type,
+                                                                     telemetry_asset_id if cache is None else None)
+            with request.metrics.phase('BackendQuery'):
+                scanned = self._scan_latest_values(query_string, request.metrics)
+            if cache is not None:
+                cache.put(cache_key, start_ns, scanned)
+            if telemetry_asset_id is None:
+                latest = scanned
+            else:
+                latest = {telemetry_asset_id: scanned[telemetry_asset_id]} if telemetry_asset_id in scanned else {}
+
+        references, reference_ids, timestamps, values = [], [], [], []
+        if latest:
+            asset_id, (_, timestamp, value) = max(latest.items(), key=lambda item: item[1][0])
+            single_entity = bool(request.entity_id and request.component_name)
+            references.append(TimestreamDataRow.get_reference(request.reference_table, request.entity_id, request.component_name,
+                                                              telemetry_asset_type, selected_property, None if single_entity else asset_id))
+            reference_ids.append(0)
+            timestamps.append(timestamp)
+            values.append(value)
+        next_token = self.sub_query_cursor_codec.encode([[None, None, [selected_property, asset_id, timestamp]]], request) if latest else None
+        return IoTTwinMakerUdqColumnarResponse(references, reference_ids, timestamps, values, next_token)
+
+    def _build_latest_value_query_string(self, request, telemetry_asset_type, telemetry_asset_id=None) -> str:
+        """
+        Utility function: builds the Timestream query for the latest value of the selected property per TelemetryAssetId, e.g.
+
+        SELECT TelemetryAssetId, measure_name, max(time) AS time, max_by(measure_value::varchar, time) AS "measure_value::varchar"
+        FROM "db"."table"
+        WHERE time > from_iso8601_timestamp('{start_time}') AND time <= from_iso8601_timestamp('{end_time}')
+            AND TelemetryAssetType = '{telemetry_asset_type}' AND measure_name = '{p0}'
+        GROUP BY TelemetryAssetId, measure_name
+        """
+        literals = {
+            'start_time': request.start_time,
+            'end_time': request.end_time,
+            'telemetry_asset_type': telemetry_asset_type,
+            'p0': request.selected_properties[0],
+        }
+        if telemetry_asset_id is not None:
+            literals['telemetry_asset_id'] = telemetry_asset_id
+
+        value_columns = ", ".join([f'max_by({value_column}, time) AS "{value_column}"'
+                                   for value_column in self._value_columns(request, request.selected_properties)])
+        asset_id_clause = " AND TelemetryAssetId = '{telemetry_asset_id}'" if telemetry_asset_id is not None else ""
+        database_name = str(self.database_name).replace('{', '{{').replace('}', '}}')
+        table_name = str(self.table_name).replace('{', '{{').replace('}', '}}')
+        template = f"SELECT TelemetryAssetId, measure_name, max(time) AS time, {value_columns}" \
+                   f""" FROM "{database_name}"."{table_name}" """ \
+                   f""" WHERE time > from_iso8601_timestamp('{{start_time}}')""" \
+                   f""" AND time <= from_iso8601_timestamp('{{end_time}}')""" \
+                   f""" AND TelemetryAssetType = '{{telemetry_asset_type}}'""" \
+                   f"""{asset_id_clause}""" \
+                   f""" AND measure_name = '{{p0}}'""" \
+                   f""" GROUP BY TelemetryAssetId, measure_name"""
+        return self.sqlDetector.compileQuery(template).render(**literals)
+
+    def _scan_latest_values(self, query_string, metrics) -> dict:
+        """
+        Utility function: runs a latest-value query through all its pages
+
+        :return: {TelemetryAssetId: (time epoch ns, ISO8601 timestamp, value)}
+        """
+        latest = {}
+        page = self._run_timestream_query(query_string, None, None, metrics)
+        while True:
+            rows = page['Rows']
+            if rows:
+                decoder = TimestreamPageDecoder.for_schema(page['ColumnInfo'])
+                _, asset_ids, timestamps, values = self._decode_udq_columns(decoder, rows)
+                latest.update(zip(asset_ids, zip(decoder.decode_column(rows, 'time'), timestamps, values)))
+            if 'NextToken' not in page:
+                return latest
+            page = self._run_timestream_query(query_string, page['NextToken'], None, metrics)
+
+    def _merged_sub_queries(self, request, telemetry_asset_type, telemetry_asset_id, sub_query_properties) -> IoTTwinMakerUdqColumnarResponse:
+        """
+        Utility function: runs one query per group of selected properties concurrently (each selecting only the value columns
+        of its properties) and streams a k-way merge of their rows (each already sorted on time by Timestream) in the
+        requested order, up to maxResults rows
+
+        The nextToken is a composite cursor holding, per sub-query, the Timestream NextToken following the page the merge
+        stopped in and the rows of that page not returned yet, or None once the sub-query is exhausted. The next request
+        merges these buffered rows first and continues the sub-query from its own NextToken, so no Timestream page is
+        fetched twice. A sub-query starting over can also hold a row already returned (see _latest_value_query), dropped
+        from its first page
+        """
+        descending = request.order_by == OrderBy.DESCENDING
+        if request.next_token:
+            positions = self.sub_query_cursor_codec.decode(request)
+            if len(positions) != len(sub_query_properties):
+                raise Exception(f"Invalid nextToken[{request.next_token}] for this request")
+        else:
+            positions = [[None, None] for _ in sub_query_properties]
+
+        with request.metrics.phase('BuildQuery'):
+            query_strings = [self._build_query_string(request, telemetry_asset_type, telemetry_asset_id, properties,
+                                                      self._value_columns(request, properties))
+                             for properties in sub_query_properties]
+
+        metrics = request.metrics
+        max_rows = request.max_rows
+        sub_queries = [i for i, position in enumerate(positions) if position is not None]
+        metrics.add_count('SubQueries', len(sub_queries))
+        # per sub-query: [decoded columns of the current page or buffered rows, index of the next row, NextToken of the following page]
+        streams = {}
+        for i in sub_queries:
+            next_token, buffered_rows = positions[i][:2]
+            if buffered_rows:
+                streams[i] = [self._decode_buffered_rows(buffered_rows, descending), 0, next_token]
+        with metrics.phase('BackendQuery'):
+            futures = {i: self.executor.submit(self._fetch_sub_query_page, query_strings[i], positions[i][0], max_rows, metrics)
+                       for i in sub_queries if i not in streams}
+            pages = {i: future.result() for i, future in futures.items()}
+
+        with metrics.phase('RowBuild'):
+            heap = []
+            for i in sub_queries:
+                if i in pages:
+                    columns = self._decode_sub_query_page(pages[i], descending)
+                    if len(positions[i]) > 2:
+                        columns = self._drop_returned_row(columns, positions[i][2])
+                    streams[i] = [columns, 0, pages[i].get('NextToken')]
+                self._push_sub_query_row(heap, i, streams[i])
+
+            references, reference_ids, timestamps, values = [], [], [], []
+            reference_index = {}
+            while heap and (not max_rows or len(timestamps) < max_rows):
+                _, i = heapq.heappop(heap)
+                stream = streams[i]
+                index = stream[1]
+                measure_names, asset_ids, page_timestamps, page_values, keys = stream[0]
+                stream[1] += 1
+
+                reference_key = (measure_names[index], asset_ids[index])
+                reference_id = reference_index.get(reference_key)
+                if reference_id is None:
+                    reference_id = reference_index[reference_key] = len(references)
+                    references.append(TimestreamDataRow.get_reference(request.reference_table, request.entity_id, request.component_name,
+                                                                      telemetry_asset_type, reference_key[0], reference_key[1]))
+                reference_ids.append(reference_id)
+                timestamps.append(page_timestamps[index])
+                values.append(page_values[index])
+
+                if stream[1] == len(keys) and stream[2] and (not max_rows or len(timestamps) < max_rows):
+                    # the merge needs this sub-query's next row before it can emit anything else
+                    with metrics.phase('BackendQuery'):
+                        page = self._fetch_sub_query_page(query_strings[i], stream[2], max_rows, metrics)
+                    stream[:] = [self._decode_sub_query_page(page, descending), 0, page.get('NextToken')]
+                self._push_sub_query_row(heap, i, stream)
+
+        next_positions = [None] * len(sub_query_properties)
+        for i, (columns, index, next_token) in streams.items():
+            buffered_rows = [column[index:] for column in columns[:4]] if index < len(columns[4]) else None
+            if buffered_rows or next_token:
+                next_positions[i] = [next_token, buffered_rows]
+                self._prefetch_page(query_strings[i], next_token, max_rows)
+        next_token = self.sub_query_cursor_codec.encode(next_positions, request) if any(next_positions) else None
+        return IoTTwinMakerUdqColumnarResponse(references, reference_ids, timestamps, values, next_token)
+
+    def _fetch_sub_query_page(self, query_string, next_token, max_rows, metrics):
+        """
+        Utility function: fetches the first non-empty page of a sub-query from next_token
+        """
+        page = self._get_page(query_string, next_token, max_rows, metrics)
+        while not page['Rows'] and 'NextToken' in page:
+            page = self._run_timestream_query(query_string, page['NextToken'], max_rows, metrics)
+        return page
+
+    @staticmethod
+    def _decode_sub_query_page(page, descending):
+        """
+        Utility function: decodes a page of a sub-query into (measure names, TelemetryAssetIds, ISO8601 timestamps,
+        values, merge keys), the merge keys are the epoch nanosecond times, negated for descending order
+        """
+        decoder = TimestreamPageDecoder.for_schema(page['ColumnInfo'])
+        measure_names, asset_ids, timestamps, values = TimestreamReader._decode_udq_columns(decoder, page['Rows'])
+        keys = decoder.decode_column(page['Rows'], 'time')
+        if descending:
+            keys = [-key for key in keys]
+        return measure_names, asset_ids, timestamps, values, keys
+
+    @staticmethod
+    def _decode_buffered_rows(buffered_rows, descending):
+        """
+        Utility function: the decoded columns of the rows of a sub-query buffered in a nextToken, see _decode_sub_query_page
+        """
+        measure_names, asset_ids, timestamps, values = buffered_rows
+        keys = [iso8601_to_epoch_ns(timestamp) for timestamp in timestamps]
+        if descending:
+            keys = [-key for key in keys]
+        return measure_names, asset_ids, timestamps, values, keys
+
+    @staticmethod
+    def _drop_returned_row(columns, returned_row):
+        """
+        Utility function: drops a (measure name, TelemetryAssetId, ISO8601 timestamp) row already returned from the first
+        rows of decoded columns (the rows sharing their first time, in any order)
+        """
+        measure_names, asset_ids, timestamps, _, keys = columns
+        for j in range(len(keys)):
+            if keys[j] != keys[0]:
+                break
+            if [measure_names[j], asset_ids[j], timestamps[j]] == returned_row:
+                return tuple(column[:j] + column[j + 1:] for column in columns)
+        return columns
 
-        query_string = f"SELECT TelemetryAssetId, measure_name, time, measure_value::double, measure_value::varchar" \
-                       f""" FROM "{self.database_name}"."{self.table_name}" """ \
-                       f""" WHERE time > from_iso8601_timestamp('{request.start_time}')""" \
-                       f""" AND time <= from_iso8601_timestamp('{request.end_time}')""" \
-                       f""" AND TelemetryAssetType = '{telemetry_asset_type}'""" \
-                       f""" AND ({measure_name_clause})""" \
-                       f""" {filter_clause} """ \
-                       f""" ORDER BY time {'ASC' if request.order_by == OrderBy.ASCENDING else 'DESC'}"""
+    @staticmethod
+    def _push_sub_query_row(heap, sub_query_index, stream):
+        index = stream[1]
+        keys = stream[0][4]
+        if index < len(keys):
+            heapq.heappush(heap, (keys[index], sub_query_index))
+
+    @staticmethod
+    def _decode_udq_columns(decoder, rows, with_asset_ids=True):
+        """
+        Utility function: decodes rows into the (measure names, TelemetryAssetIds, ISO8601 timestamps, values) columns of a
+        UDQ response. The value of a row is its first non-null value column in VALUE_COLUMN_PRECEDENCE order, like
+        TimestreamDataRow.get_value, projected queries select a single value column
+
+        The TelemetryAssetIds are only decoded if with_asset_ids (they are None otherwise)
+        """
+        if not rows:
+            return [], [] if with_asset_ids else None, [], []
+        value_columns = [name for name in VALUE_COLUMN_PRECEDENCE if name in decoder.names]
+        names = ('measure_name', 'time') + tuple(value_columns[:1]) + (('TelemetryAssetId',) if with_asset_ids else ())
+        columns = decoder.decode(rows, TimestreamPageDecoder.ISO8601, names)
+        values = columns.get(value_columns[0]) if value_columns else [None] * len(rows)
+        # the other value columns are only decoded if some rows have no value in the previous ones
+        for value_column in value_columns[1:]:
+            num_nulls = values.count(None)
+            if not num_nulls:
+                break
+            column_values = decoder.decode(rows, names=(value_column,))[value_column]
+            if num_nulls == len(values):
+                values = column_values
+            else:
+                values = [value if value is not None else column_value for value, column_value in zip(values, column_values)]
+        if None in values:
+            raise ValueError(f"Unhandled type in timestream row: {rows[values.index(None)]}")
+        return columns['measure_name'], columns.get('TelemetryAssetId'), columns['time'], values
+
+    def _multi_measure_query(self, request, telemetry_asset_type, telemetry_asset_id=None) -> IoTTwinMakerUdqColumnarResponse:
+        """
+        Utility function: serves a request from multi-measure records, where each record holds the properties as measure
+        columns. The selected properties are projected as columns of a single query and unpivoted into one value per
+        non-null column, so a page of max_rows // (number of selected properties) records yields at most maxResults values
+
+        propertyFilters constrain the values of their property only, which can't be expressed on a record holding all
+        properties, so they are evaluated in memory
+        """
+        selected_properties = request.selected_properties
+        with request.metrics.phase('BuildQuery'):
+            query_string = self._build_multi_measure_query_string(request, telemetry_asset_type, telemetry_asset_id)
+
+        max_rows = max(1, request.max_rows // max(1, len(selected_properties))) if request.max_rows else request.max_rows
+        with request.metrics.phase('BackendQuery'):
+            page = self._get_page(query_string, request.next_token, max_rows, request.metrics)
+        self._prefetch_page(query_string, page.get('NextToken'), max_rows)
+        with request.metrics.phase('RowBuild'):
+            return self._convert_multi_measure_page(request, page, telemetry_asset_type)
+
+    def _build_multi_measure_query_string(self, request, telemetry_asset_type, telemetry_asset_id=None) -> str:
+        """
+        Utility function: builds the Timestream query selecting the selected properties' measure columns of the
+        multi-measure records, e.g.
 
-        self.sqlDetector.detectInjection(sample_query, query_string)
+        SELECT TelemetryAssetId, time, "temperature", "alarm_status" FROM "db"."table"
+        WHERE time > from_iso8601_timestamp('{start_time}') AND time <= from_iso8601_timestamp('{end_time}')
+            AND TelemetryAssetType = '{telemetry_asset_type}' AND TelemetryAssetId = '{telemetry_asset_id}'
+            AND measure_name = '{multi_measure_name}'
+        ORDER BY time ASC
 
-        page = self._run_timestream_query(query_string, request.next_token, request.max_rows)
-        return self._convert_timestream_query_page_to_udq_response(page, request.entity_id, request.component_name, telemetry_asset_type)
+        Property names become column identifiers of the query shape, so only names matching MULTI_MEASURE_ATTRIBUTE_PATTERN
+        are accepted
+        """
+        for selected_property in request.selected_properties:
+            if not MULTI_MEASURE_ATTRIBUTE_PATTERN.match(selected_property):
+                raise Exception(f"Unsupported property name[{selected_property}] for multi-measure records")
+
+        literals = {
+            'start_time': request.start_time,
+            'end_time': request.end_time,
+            'telemetry_asset_type': telemetry_asset_type,
+            'multi_measure_name': self.multi_measure_name,
+        }
+        if telemetry_asset_id is not None:
+            literals['telemetry_asset_id'] = telemetry_asset_id
+
+        measure_columns = ", ".join([f'"{selected_property}"' for selected_property in request.selected_properties])
+        asset_id_clause = " AND TelemetryAssetId = '{telemetry_asset_id}'" if telemetry_asset_id is not None else ""
+        database_name = str(self.database_name).replace('{', '{{').replace('}', '}}')
+        table_name = str(self.table_name).replace('{', '{{').replace('}', '}}')
+        template = f"SELECT TelemetryAssetId, time, {measure_columns}" \
+                   f""" FROM "{database_name}"."{table_name}" """ \
+                   f""" WHERE time > from_iso8601_timestamp('{{start_time}}')""" \
+                   f""" AND time <= from_iso8601_timestamp('{{end_time}}')""" \
+                   f""" AND TelemetryAssetType = '{{telemetry_asset_type}}'""" \
+                   f"""{asset_id_clause}""" \
+                   f""" AND measure_name = '{{multi_measure_name}}'""" \
+                   f""" ORDER BY time {'ASC' if request.order_by == OrderBy.ASCENDING else 'DESC'}"""
+        return self.sqlDetector.compileQuery(template).render(**literals)
+
+    @staticmethod
+    def _convert_multi_measure_page(request, query_page, telemetry_asset_type) -> IoTTwinMakerUdqColumnarResponse:
+        """
+        Utility function: handles converting a page of multi-measure records into a IoTTwinMakerUdqColumnarResponse, with
+        the values of each record in selected property order, skipping null and filtered out values
+        """
+        LOGGER.info("Query result has %s rows, next token is %s", len(query_page['Rows']), query_page.get('NextToken'))
+        LOGGER.debug("Query result is %s", query_page)
+        reference_table = request.reference_table if request.reference_table is not None else IoTTwinMakerReferenceTable()
+        single_entity = bool(request.entity_id and request.component_name)
+        selected_properties = request.selected_properties
+        decoder = TimestreamPageDecoder.for_schema(query_page['ColumnInfo'])
+        columns = decoder.decode(query_page['Rows'], TimestreamPageDecoder.ISO8601,
+                                 ('time',) + (() if single_entity else ('TelemetryAssetId',)) + tuple(selected_properties))
+        row_timestamps = columns['time']
+        asset_ids = columns.get('TelemetryAssetId') or [None] * len(row_timestamps)
+        filters = parse_property_filters(request.property_filters)
+        property_columns = [(selected_property, columns.get(selected_property) or [None] * len(row_timestamps),
+                             [property_filter for property_filter in filters if property_filter.property_name in (None, selected_property)])
+                            for selected_property in selected_properties]
+
+        references, reference_ids, timestamps, values = [], [], [], []
+        reference_index = {}
+        for j, timestamp in enumerate(row_timestamps):
+            for selected_property, column, filters in property_columns:
+                value = column[j]
+                if value is None or not all(property_filter.matches(value) for property_filter in filters):
+                    continue
+                reference_key = (selected_property, asset_ids[j])
+                reference_id = reference_index.get(reference_key)
+                if reference_id is None:
+                    reference_id = reference_index[reference_key] = len(references)
+                    references.append(TimestreamDataRow.get_reference(reference_table, request.entity_id, request.component_name,
+                                                                      telemetry_asset_type, selected_property, asset_ids[j]))
+                reference_ids.append(reference_id)
+                timestamps.append(timestamp)
+                values.append(value)
+        return IoTTwinMakerUdqColumnarResponse(references, reference_ids, timestamps, values, query_page.get('NextToken'))
+
+    def _build_query_string(self, request, telemetry_asset_type, telemetry_asset_id=None, selected_properties=None,
+                            value_columns=DEFAULT_VALUE_COLUMNS) -> str:
+        """
+        Utility function: builds the Timestream query for a UDQ request, or for a subset of its selected properties
+
+        The query shape only depends on the number of selected properties, the filters' operators and value types, whether
+        we filter on a telemetryAssetId, the selected value columns and the order direction. Each shape is compiled once by the SQLDetector, and per
+        request only the substituted literal values are validated against injection
+
+        Every propertyFilters entry is pushed down as a predicate on the rows of its measure, see udq_utils.udq_filters
+        """
+        if selected_properties is None:
+            selected_properties = request.selected_properties
+        # filters on properties that aren't queried are no-ops, leave them out of the query
+        filters = [property_filter for property_filter in parse_property_filters(request.property_filters)
+                   if property_filter.property_name is None or property_filter.property_name in selected_properties]
+        filter_clause, filter_literals = compile_property_filters(filters, property_column='measure_name', value_columns=FILTER_VALUE_COLUMNS)
+
+        literals = {
+            'start_time': request.start_time,
+            'end_time': request.end_time,
+            'telemetry_asset_type': telemetry_asset_type,
+        }
+        literals.update({f"p{i}": selected_property for i, selected_property in enumerate(selected_properties)})
+        if telemetry_asset_id is not None:
+            literals['telemetry_asset_id'] = telemetry_asset_id
+        literals.update(filter_literals)
+        downsampled = request.downsampling is not None and self.pushes_down_downsampling(request)
+        rollup_tier = None
+        if downsampled:
+            start_ns, end_ns = iso8601_to_epoch_ns(request.start_time), iso8601_to_epoch_ns(request.end_time)
+            bucket_width_ms = request.downsampling.bucket_width_ms(start_ns, end_ns)
+            literals['bucket_width'] = f"{bucket_width_ms}ms"
+            rollup_tier = self._select_rollup_tier(bucket_width_ms, filters, start_ns, end_ns)
+        request.metrics.set_property('TimestreamTier', rollup_tier[0] if rollup_tier else RAW_TIER)
+
+        template = self._get_query_template(len(selected_properties), filter_clause, telemetry_asset_id is not None, request.order_by, downsampled,
+                                            value_columns, rollup_tier[2] if rollup_tier else None)
+        return template.render(**literals)
+
+    def _select_rollup_tier(self, bucket_width_ms, filters, start_ns=None, end_ns=None):
+        """
+        Utility function: the coarsest rollup tier (interval, interval in milliseconds, table name) whose interval fits in
+        a bucket of the downsampled query, or None to aggregate the raw data (short windows, or no rollup tables)
+
+        The bucket width follows from the requested window and number of points, so a 30 day panel reads hourly rollups
+        while a 1 hour one reads the raw table. Rollup rows are selected by their interval start, so the window edges are
+        resolved to the tier interval. Rollups hold aggregates, so filters on values are only applied to raw data. Tiers
+        whose rollups don't cover the whole window (e.g. not built back to its start yet, or not caught up with live data
+        at its end) are skipped, so no data of the window is left out
+        """
+        if filters:
+            return None
+        rollup_tier = None
+        for tier in self.rollup_tiers:
+            if tier[1] <= bucket_width_ms and (start_ns is None or self._rollup_covers(tier, start_ns, end_ns)):
+                rollup_tier = tier
+        return rollup_tier
+
+    def _rollup_covers(self, tier, start_ns, end_ns) -> bool:
+        """
+        Utility function: whether the rollup table of a tier (its time range cached like the table schema) covers the
+        whole window (start_ns, end_ns]: its first interval starts at or before the window start and its last interval
+        ends at or after the window end. The scheduled rollup queries only write completed intervals, so windows ending
+        within the rollup lag of live data are read from the raw table
+        """
+        time_range = self.table_schema_cache.get((self.database_name, tier[2], 'time_range'), lambda: self._describe_time_range(tier[2]))
+        return time_range is not None and time_range[0] <= start_ns and time_range[1] + tier[1] * 1_000_000 >= end_ns
+
+    def _describe_time_range(self, table_name):
+        """
+        Utility function: the (first, last) interval start in epoch nanoseconds of a rollup table, or None if it is empty
+        or can't be queried
+        """
+        database_name = str(self.database_name).replace('"', '""')
+        table_name = str(table_name).replace('"', '""')
+        try:
+            page = self._run_timestream_query(f'SELECT min(time) AS first_time, max(time) AS last_time FROM "{database_name}"."{table_name}"', None, None)
+            decoder = TimestreamPageDecoder.for_schema(page['ColumnInfo'])
+            columns = decoder.decode(page['Rows'])
+            time_range = (columns['first_time'][0], columns['last_time'][0]) if page['Rows'] else None
+            return time_range if time_range and None not in time_range else None
+        except Exception as err:
+            LOGGER.warning("Could not query the time range of %s.%s, reading the raw table: %s", self.database_name, table_name, err)
+            return None
+
+    def _get_query_template(self, num_selected_properties, filter_clause, has_telemetry_asset_id, order_by, downsampled=False,
+                            value_columns=DEFAULT_VALUE_COLUMNS, rollup_table_name=None):
+        """
+        Utility function: returns the compiled query template for the given query shape, e.g.
+
+        SELECT TelemetryAssetId, measure_name, time, measure_value::double, measure_value::varchar FROM "db"."table"
+        WHERE time > from_iso8601_timestamp('{start_time}') AND time <= from_iso8601_timestamp('{end_time}')
+            AND TelemetryAssetType = '{telemetry_asset_type}' AND TelemetryAssetId = '{telemetry_asset_id}'
+            AND (measure_name = '{p0}' OR measure_name = '{p1}')
+            AND (measure_name <> '{f0_property}' OR measure_value::varchar = '{f0_value}')
+        ORDER BY time ASC
+
+        Only the given value columns are selected (e.g. just measure_value::double for numeric properties). Downsampled
+        queries instead select the first, min, max and last value (and their times) per measure and
+        bin(time, parse_duration('{bucket_width}')) bucket, from the rollup table if given by combining its rollup buckets
+        (each holding the first, min, max and last value and time of its interval)
+        """
+        measure_name_clause = " OR ".join([f"measure_name = '{{p{i}}}'" for i in range(num_selected_properties)])
+        asset_id_clause = " AND TelemetryAssetId = '{telemetry_asset_id}'" if has_telemetry_asset_id else ""
+        database_name = str(self.database_name).replace('{', '{{').replace('}', '}}')
+        table_name = str(rollup_table_name or self.table_name).replace('{', '{{').replace('}', '}}')
+
+        if downsampled and rollup_table_name:
+            bucket = "bin(time, parse_duration('{bucket_width}'))"
+            select_clause = f"SELECT TelemetryAssetId, measure_name, {bucket} AS bucket," \
+                            f" min(first_time) AS first_time, min_by(first_value, first_time) AS first_value," \
+                            f" min_by(min_time, min_value) AS min_time, min(min_value) AS min_value," \
+                            f" max_by(max_time, max_value) AS max_time, max(max_value) AS max_value," \
+                            f" max(last_time) AS last_time, max_by(last_value, last_time) AS last_value"
+            group_by_clause = f" GROUP BY TelemetryAssetId, measure_name, {bucket}"
+            order_by_column = "bucket"
+        elif downsampled:
+            bucket = "bin(time, parse_duration('{bucket_width}'))"
+            select_clause = f"SELECT TelemetryAssetId, measure_name, {bucket} AS bucket," \
+                            f" min(time) AS first_time, min_by(measure_value::double, time) AS first_value," \
+                            f" min_by(time, measure_value::double) AS min_time, min(measure_value::double) AS min_value," \
+                            f" max_by(time, measure_value::double) AS max_time, max(measure_value::double) AS max_value," \
+                            f" max(time) AS last_time, max_by(measure_value::double, time) AS last_value"
+            group_by_clause = f" GROUP BY TelemetryAssetId, measure_name, {bucket}"
+            order_by_column = "bucket"
+        else:
+            select_clause = f"SELECT TelemetryAssetId, measure_name, time, {', '.join(value_columns)}"
+            group_by_clause = ""
+            order_by_column = "time"
+
+        template = f"{select_clause}" \
+                   f""" FROM "{database_name}"."{table_name}" """ \
+                   f""" WHERE time > from_iso8601_timestamp('{{start_time}}')""" \
+                   f""" AND time <= from_iso8601_timestamp('{{end_time}}')""" \
+                   f""" AND TelemetryAssetType = '{{telemetry_asset_type}}'""" \
+                   f"""{asset_id_clause}""" \
+                   f""" AND ({measure_name_clause})""" \
+                   f""" {filter_clause} """ \
+                   f"""{group_by_clause}""" \
+                   f""" ORDER BY {order_by_column} {'ASC' if order_by == OrderBy.ASCENDING else 'DESC'}"""
+
+        return self.sqlDetector.compileQuery(template)
+
+    def _get_page(self, query_string, next_token, max_rows, metrics=NULL_QUERY_METRICS) -> dict:
+        """
+        Utility function: returns the page for next_token from the prefetcher if it holds it, otherwise runs the query
+        """
+        if self.page_prefetcher is not None and next_token:
+            page = self.page_prefetcher.take((query_string, next_token, max_rows))
+            metrics.add_count('PrefetchHits' if page is not None else 'PrefetchMisses')
+            if page is not None:
+                return page
+        return self._run_timestream_query(query_string, next_token, max_rows, metrics)
+
+    def _prefetch_page(self, query_string, next_token, max_rows):
+        """
+        Utility function: fetches the page for next_token in the background while the current page is returned, so the
+        follow-up request bringing the token back is served from memory
+        """
+        if self.page_prefetcher is not None and next_token:
+            self.page_prefetcher.prefetch((query_string, next_token, max_rows),
+                                          lambda: self._run_timestream_query(query_string, next_token, max_rows), self.executor)
 
-    def _run_timestream_query(self, query_string, next_token, max_rows) -> dict:
+    def _run_timestream_query(self, query_string, next_token, max_rows, metrics=NULL_QUERY_METRICS) -> dict:
         """
         Utility function: handles executing the given query_string on AWS Timestream. Returns an AWS Timestream Query Page
         see https://boto3.amazonaws.com/v1/documentation/api/latest/reference/services/timestream-query.html#TimestreamQuery.Client.query
@@ -119,17 +827,17 @@ class TimestreamReader(SingleEntityReader, MultiEntityReader):
         try:
             # Timestream SDK returns error if None is passed for NextToken and MaxRows
             if next_token and max_rows:
-                page = self.query_client.query(QueryString=query_string, NextToken=next_token, MaxRows=max_rows)
+                page = self._query(metrics, QueryString=query_string, NextToken=next_token, MaxRows=max_rows)
             elif next_token:
-                page = self.query_client.query(QueryString=query_string, NextToken=next_token)
+                page = self._query(metrics, QueryString=query_string, NextToken=next_token)
             elif max_rows:
-                page = self.query_client.query(QueryString=query_string, MaxRows=max_rows)
+                page = self._query(metrics, QueryString=query_string, MaxRows=max_rows)
                 # skip empty pages returned by Timestream
                 # passing in MaxRows but no NextToken, if we have more than MaxRows available we get back a NextToken and no results, and reissue the query
                 while 'NextToken' in page and len(page['Rows']) == 0:
-                    page = self.query_client.query(QueryString=query_string, NextToken=page['NextToken'], MaxRows=max_rows)
+                    page = self._query(metrics, QueryString=query_string, NextToken=page['NextToken'], MaxRows=max_rows)
             else:
-                page = self.query_client.query(QueryString=query_string)
+                page = self._query(metrics, QueryString=query_string)
 
             return page
 
@@ -137,22 +845,207 @@ class TimestreamReader(SingleEntityReader, MultiEntityReader):
             LOGGER.error("Exception while running query: %s", err)
             raise err
 
+    def _query(self, metrics, **kwargs) -> dict:
+        """
+        Utility function: issues a single Timestream query call and records the backend work in the request metrics
+        """
+        page = self.query_client.query(**kwargs)
+        if metrics.enabled:
+            metrics.add_count('BackendCalls')
+            metrics.add_count('BackendRows', len(page.get('Rows', [])))
+            metrics.add_count('BackendScannedBytes', page.get('QueryStatus', {}).get('CumulativeBytesScanned', 0))
+            metrics.set_property('QueryId', page.get('QueryId'))
+        return page
+
     @staticmethod
-    def _convert_timestream_query_page_to_udq_response(query_page, entity_id, component_name, telemetry_asset_type):
+    def _convert_timestream_query_page_to_udq_response(query_page, entity_id, component_name, telemetry_asset_type, reference_table=None):
         """
         Utility function: handles converting an AWS Timestream Query Page into a IoTTwinMakerUdqResponse object
         For each IoTTwinMakerDataRow, we include:
         - the raw row data from Timestream
         - the column schema from Timestream we can later use to interpret the row
         - and the entity_id, component_name, and telemetry_asset_type as context for constructing the entityPropertyReference
+        - the request's reference table, so rows for the same property share one interned entityPropertyReference
         """
         LOGGER.info("Query result is %s", query_page)
         result_rows = []
         schema = query_page['ColumnInfo']
+        if reference_table is None:
+            reference_table = IoTTwinMakerReferenceTable()
         for row in query_page['Rows']:
-            result_rows.append(TimestreamDataRow(row, schema, entity_id, component_name, telemetry_asset_type))
+            result_rows.append(TimestreamDataRow(row, schema, entity_id, component_name, telemetry_asset_type, reference_table))
         return IoTTwinMakerUdqResponse(result_rows, query_page.get('NextToken'))
 
+    @staticmethod
+    def _convert_timestream_query_page_to_udq_columnar_response(query_page, entity_id, component_name, telemetry_asset_type,
+                                                                reference_table=None) -> IoTTwinMakerUdqColumnarResponse:
+        """
+        Utility function: handles converting an AWS Timestream Query Page into a IoTTwinMakerUdqColumnarResponse
+        The page is decoded column by column with a TimestreamPageDecoder compiled for its schema, with one interned
+        entityPropertyReference per measure and TelemetryAssetId (see TimestreamDataRow for the equivalent row-based conversion)
+        """
+        LOGGER.info("Query result has %s rows, next token is %s", len(query_page['Rows']), query_page.get('NextToken'))
+        LOGGER.debug("Query result is %s", query_page)
+        if reference_table is None:
+            reference_table = IoTTwinMakerReferenceTable()
+        # single-entity references only depend on the measure
+        single_entity = bool(entity_id and component_name)
+        decoder = TimestreamPageDecoder.for_schema(query_page['ColumnInfo'])
+        measure_names, asset_ids, timestamps, values = TimestreamReader._decode_udq_columns(decoder, query_page['Rows'], not single_entity)
+
+        reference_keys = measure_names if single_entity else list(zip(measure_names, asset_ids))
+        reference_index = dict.fromkeys(reference_keys)
+        references = []
+        for reference_id, reference_key in enumerate(reference_index):
+            reference_index[reference_key] = reference_id
+            measure_name, asset_id = (reference_key, None) if single_entity else reference_key
+            references.append(TimestreamDataRow.get_reference(reference_table, entity_id, component_name, telemetry_asset_type, measure_name, asset_id))
+        reference_ids = list(map(reference_index.__getitem__, reference_keys))
+        return IoTTwinMakerUdqColumnarResponse(references, reference_ids, timestamps, values, query_page.get('NextToken'))
+
+    @staticmethod
+    def _convert_downsampled_query_page_to_udq_response(query_page, entity_id, component_name, telemetry_asset_type, order_by,
+                                                         reference_table=None) -> IoTTwinMakerUdqColumnarResponse:
+        """
+        Utility function: handles converting a page of a downsampled Timestream query into a IoTTwinMakerUdqColumnarResponse
+        Each bucket row contributes its distinct first, min, max and last values, in time order. Null values (e.g. of a
+        measure also stored as varchar) are skipped
+        """
+        LOGGER.info("Query result is %s", query_page)
+        if reference_table is None:
+            reference_table = IoTTwinMakerReferenceTable()
+        schema = query_page['ColumnInfo']
+        references, reference_ids, timestamps, values = [], [], [], []
+        reference_index = {}
+        for row in query_page['Rows']:
+            row_as_dict = dict(TimestreamDataRow._parse_datum(info, datum) for info, datum in zip(schema, row['Data']))
+            reference = TimestreamDataRow.get_reference(reference_table, entity_id, component_name, telemetry_asset_type,
+                                                        row_as_dict['measure_name'], row_as_dict['TelemetryAssetId'])
+            reference_id = reference_index.get(reference)
+            if reference_id is None:
+                reference_id = reference_index[reference] = len(references)
+                references.append(reference)
+
+            bucket_values = {}
+            for point in ('first', 'min', 'max', 'last'):
+                point_time, point_value = row_as_dict[f"{point}_time"], row_as_dict[f"{point}_value"]
+                if point_time is not None and point_value is not None:
+                    bucket_values[point_time] = point_value
+            for point_time in sorted(bucket_values, reverse=order_by == OrderBy.DESCENDING):
+                reference_ids.append(reference_id)
+                timestamps.append(point_time.replace(' ', 'T') + 'Z')
+                values.append(float(bucket_values[point_time]))
+        return IoTTwinMakerUdqColumnarResponse(references, reference_ids, timestamps, values, query_page.get('NextToken'))
+
+
+class TimestreamPageDecoder:
+    """
+    Decodes Timestream query pages into typed column arrays
+
+    The ColumnInfo schema is compiled once (see for_schema) into an accessor and a converter per column, a page is then
+    decoded column by column without building a dict per row:
+    - DOUBLE as float, BIGINT / INTEGER as int, BOOLEAN as bool, VARCHAR (and other scalar types) as str
+    - TIMESTAMP as epoch nanoseconds, or as ISO8601 strings ('2022-04-06 00:17:45.419000000' -> '2022-04-06T00:17:45.419000000Z')
+    - null values as None
+    """
+    EPOCH_NS = 'epoch_ns'
+    ISO8601 = 'iso8601'
+
+    # compiled decoders kept for the most recent ColumnInfo schemas, minutes whose epoch time each decoder keeps
+    MAX_COMPILED_SCHEMAS = 64
+    MAX_CACHED_MINUTES = 24 * 60
+
+    def __init__(self, column_schema):
+        self._names = []
+        self._accessors = []
+        self._converters = []
+        for i, info in enumerate(column_schema):
+            column_type = info['Type']
+            if 'ScalarType' not in column_type:
+                raise Exception(f"Unsupported columnType[{column_type}]")
+            self._names.append(info['Name'])
+            self._accessors.append(itemgetter(i))
+            self._converters.append(self._compile_converter(column_type['ScalarType']))
+        self._index = {name: i for i, name in enumerate(self._names)}
+        self._minute_epoch_ns = {}
+
+    @classmethod
+    def for_schema(cls, column_schema):
+        """
+        :return: the decoder compiled for this ColumnInfo schema, shared by all pages with the same schema
+        """
+        return _compiled_decoder(cls, tuple((info['Name'], json.dumps(info['Type'], sort_keys=True)) for info in column_schema))
+
+    @property
+    def names(self):
+        return self._names
+
+    def decode(self, rows, timestamps=EPOCH_NS, names=None) -> dict:
+        """
+        Decode the Rows of a page into {column name: list of values}, for all columns or the given column names present
+        """
+        data = list(map(itemgetter('Data'), rows))
+        if names is None:
+            names = self._names
+        return {name: self._decode(data, self._index[name], timestamps) for name in names if name in self._index}
+
+    def decode_column(self, rows, name, timestamps=EPOCH_NS) -> list:
+        """
+        Decode a single column of the Rows of a page
+        """
+        return self._decode(list(map(itemgetter('Data'), rows)), self._index[name], timestamps)
+
+    def _decode(self, data, i, timestamps):
+        scalars = list(map(dict.get, map(self._accessors[i], data), repeat('ScalarValue')))
+        converter = self._converters[i].get(timestamps)
+        if converter is None:
+            return scalars
+        if None in scalars:
+            return [converter(scalar) if scalar is not None else None for scalar in scalars]
+        if converter is _timestream_time_to_iso8601:
+            # inlined, saves a function call per row
+            return [scalar.replace(' ', 'T') + 'Z' for scalar in scalars]
+        return list(map(converter, scalars))
+
+    def _compile_converter(self, scalar_type) -> dict:
+        # timestamps format -> function converting a ScalarValue (None keeps the string)
+        if scalar_type == 'DOUBLE':
+            converter = float
+        elif scalar_type in ('BIGINT', 'INTEGER'):
+            converter = int
+        elif scalar_type == 'BOOLEAN':
+            converter = 'true'.__eq__
+        elif scalar_type == 'TIMESTAMP':
+            return {self.EPOCH_NS: self._epoch_ns, self.ISO8601: _timestream_time_to_iso8601}
+        else:
+            converter = None
+        return {self.EPOCH_NS: converter, self.ISO8601: converter}
+
+    def _epoch_ns(self, timestamp):
+        # e.g. '2022-04-06 00:17:45.419000000', the epoch nanoseconds of each minute are computed once
+        minute = timestamp[:16]
+        minute_ns = self._minute_epoch_ns.get(minute)
+        if minute_ns is None:
+            if len(self._minute_epoch_ns) >= self.MAX_CACHED_MINUTES:
+                self._minute_epoch_ns.clear()
+            minute_ns = self._minute_epoch_ns[minute] = \
+                int(datetime.strptime(minute, '%Y-%m-%d %H:%M').replace(tzinfo=timezone.utc).timestamp()) * 1_000_000_000
+        if len(timestamp) == 29:
+            # seconds and nanoseconds digits as one integer
+            return minute_ns + int(timestamp[17:19] + timestamp[20:])
+        fraction = timestamp[20:29]
+        return minute_ns + int(timestamp[17:19]) * 1_000_000_000 + (int(fraction.ljust(9, '0')) if fraction else 0)
+
+
+@lru_cache(maxsize=TimestreamPageDecoder.MAX_COMPILED_SCHEMAS)
+def _compiled_decoder(decoder_class, schema_key):
+    # schema_key: ((column name, JSON column type), ...) of a ColumnInfo schema
+    return decoder_class([{'Name': name, 'Type': json.loads(column_type)} for name, column_type in schema_key])
+
+
+def _timestream_time_to_iso8601(timestamp):
+    return timestamp.replace(' ', 'T') + 'Z'
+
 
 class TimestreamDataRow(IoTTwinMakerDataRow):
     """
@@ -164,13 +1057,15 @@ class TimestreamDataRow(IoTTwinMakerDataRow):
     - extract the value from a Timestream row
     """
 
-    def __init__(self, timestream_row, timestream_column_schema, entity_id=None, component_name=None, _telemetry_asset_type=None):
+    def __init__(self, timestream_row, timestream_column_schema, entity_id=None, component_name=None, _telemetry_asset_type=None,
+                 reference_table=None):
         self._timestream_row = timestream_row
         self._timestream_column_schema = timestream_column_schema
         self._row_as_dict = self._parse_row(timestream_column_schema, timestream_row)
         self._entity_id = entity_id
         self._component_name = component_name
         self._telemetry_asset_type = _telemetry_asset_type
+        self._reference_table = reference_table if reference_table is not None else IoTTwinMakerReferenceTable()
 
     # overrides IoTTwinMakerDataRow.get_iottwinmaker_reference abstractmethod
     def get_iottwinmaker_reference(self) -> IoTTwinMakerReference:
@@ -180,15 +1075,22 @@ class TimestreamDataRow(IoTTwinMakerDataRow):
         For single-entity queries, the entity_id and component_name values are passed in, use those to construct the 'EntityComponentPropertyRef'
         For multi-entity queries, we don't have the IoT TwinMaker entity_id so we return back the property identifier stored in Timestream as an 'external_id_property'
         """
-        property_name = self._row_as_dict['measure_name']
-        if self._entity_id and self._component_name:
-            return IoTTwinMakerReference(ecp=EntityComponentPropertyRef(self._entity_id, self._component_name, property_name))
+        return self.get_reference(self._reference_table, self._entity_id, self._component_name, self._telemetry_asset_type,
+                                  self._row_as_dict['measure_name'], self._row_as_dict['TelemetryAssetId'])
+
+    @staticmethod
+    def get_reference(reference_table, entity_id, component_name, telemetry_asset_type, property_name, telemetry_asset_id) -> IoTTwinMakerReference:
+        """
+        Utility function: the interned IoTTwinMakerReference for a Timestream measure, see get_iottwinmaker_reference
+        """
+        if entity_id and component_name:
+            return reference_table.entity_component_property(entity_id, component_name, property_name)
         else:
             external_id_property = {
                 # special case Alarm and map the externalId to alarm_key
-                'alarm_key' if self._telemetry_asset_type == 'Alarm' else 'telemetryAssetId': self._row_as_dict['TelemetryAssetId'],
+                'alarm_key' if telemetry_asset_type == 'Alarm' else 'telemetryAssetId': telemetry_asset_id,
             }
-            return IoTTwinMakerReference(eip=ExternalIdPropertyRef(external_id_property, property_name))
+            return reference_table.external_id_property(external_id_property, property_name)
 
     # overrides IoTTwinMakerDataRow.get_iso8601_timestamp abstractmethod
     def get_iso8601_timestamp(self) -> str:
@@ -203,12 +1105,14 @@ class TimestreamDataRow(IoTTwinMakerDataRow):
         """
         This function extracts the value from a Timestream row
 
-        Only varchar and double types are currently supported. We return the value back as a native python type
+        Only varchar, double and boolean types are currently supported. We return the value back as a native python type
         """
         if 'measure_value::varchar' in self._row_as_dict and self._row_as_dict['measure_value::varchar'] is not None:
             return self._row_as_dict['measure_value::varchar']
         elif 'measure_value::double' in self._row_as_dict and self._row_as_dict['measure_value::double'] is not None:
             return float(self._row_as_dict['measure_value::double'])
+        elif 'measure_value::boolean' in self._row_as_dict and self._row_as_dict['measure_value::boolean'] is not None:
+            return str(self._row_as_dict['measure_value::boolean']).lower() == 'true'
         else:
             raise ValueError(f"Unhandled type in timestream row: {self._row_as_dict}")
 
@@ -273,8 +1177,24 @@ class TimestreamDataRow(IoTTwinMakerDataRow):
             raise Exception(f"Unsupported columnType[{column_type}]")
 
 
-SESSION = boto3.Session()
-QUERY_CLIENT = SESSION.client('timestream-query')
+def _create_query_client():
+    # boto3 is imported and the client created on first query rather than at import, keeping them out of the cold start
+    import boto3
+    return boto3.Session().client('timestream-query')
+
+
+# shared across warm invocations once created
+QUERY_CLIENT = LazyResource('timestream-query client', _create_query_client)
+
+
+def _create_query_executor():
+    # thread pool for concurrent and background Timestream calls (per-measure queries, prefetch), created on first use and shared across warm invocations
+    from concurrent.futures import ThreadPoolExecutor
+    from udq_utils.udq_async import DEFAULT_MAX_CONCURRENCY
+    return ThreadPoolExecutor(max_workers=DEFAULT_MAX_CONCURRENCY, thread_name_prefix='timestream')
+
+
+QUERY_EXECUTOR = LazyResource('timestream query executor', _create_query_executor)
 
 # retrieve database name and table name from Lambda environment variables
 # check if running on Lambda
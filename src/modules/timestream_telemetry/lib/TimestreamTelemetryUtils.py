@@ -8,11 +8,44 @@ import sys
 import time
 from botocore.config import Config
 
+# Rollup tiers of the numeric measures, each a table of per-interval aggregates (first, min, max and last value and time,
+# sample count) named <telemetry table><suffix>. The UDQ reader serves long-range downsampled queries from the coarsest
+# tier that fits (see TIMESTREAM_ROLLUP_TABLES in udq_data_reader.py)
+#   (table suffix, interval, source tier suffix or None for the raw table, scheduled query schedule, window of each run, delay of each run)
+ROLLUP_TIERS = [
+    ('_1m', '1m', None, 'rate(5 minutes)', '5m', '1m'),
+    ('_1h', '1h', '_1m', 'rate(1 hour)', '1h', '10m'),
+]
+
+# aggregates of raw measures into a rollup interval
+RAW_ROLLUP_AGGREGATES = "min(time) AS first_time, min_by(measure_value::double, time) AS first_value, " \
+                        "min_by(time, measure_value::double) AS min_time, min(measure_value::double) AS min_value, " \
+                        "max_by(time, measure_value::double) AS max_time, max(measure_value::double) AS max_value, " \
+                        "max(time) AS last_time, max_by(measure_value::double, time) AS last_value, " \
+                        "count(*) AS sample_count"
+
+# aggregates of a finer rollup tier into a coarser rollup interval
+ROLLUP_ROLLUP_AGGREGATES = "min(first_time) AS first_time, min_by(first_value, first_time) AS first_value, " \
+                           "min_by(min_time, min_value) AS min_time, min(min_value) AS min_value, " \
+                           "max_by(max_time, max_value) AS max_time, max(max_value) AS max_value, " \
+                           "max(last_time) AS last_time, max_by(last_value, last_time) AS last_value, " \
+                           "sum(sample_count) AS sample_count"
+
+# rollup measure -> Timestream type of the multi-measure record attribute
+ROLLUP_MEASURES = {
+    'first_time': 'TIMESTAMP', 'first_value': 'DOUBLE',
+    'min_time': 'TIMESTAMP', 'min_value': 'DOUBLE',
+    'max_time': 'TIMESTAMP', 'max_value': 'DOUBLE',
+    'last_time': 'TIMESTAMP', 'last_value': 'DOUBLE',
+    'sample_count': 'BIGINT',
+}
+
 
 class TimestreamTelemetryImporter:
     def __init__(self, region_name, database_name, table_name, stack_name=None, profile=None):
         session = boto3.session.Session(profile_name=profile)
         self.timestream = session.client('timestream-write', region_name=region_name, config=Config(read_timeout=20, max_pool_connections=5000, retries={'max_attempts': 10}))
+        self.timestream_query = session.client('timestream-query', region_name=region_name)
         self.database_name = database_name
         self.table_name = table_name
         self.lambda_arn = 'arn:aws:lambda:us-east-1:{accountId}:function:timestream-telemetry-reader'
@@ -96,10 +129,122 @@ class TimestreamTelemetryImporter:
             print(f"   Ingested {counter} records from "
                   f"{datetime.datetime.fromtimestamp(earliest_record_time/1000.0, datetime.timezone.utc).strftime('%Y-%m-%d %H:%M:%S %Z')} - "
                   f"{datetime.datetime.fromtimestamp(latest_record_time/1000.0, datetime.timezone.utc).strftime('%Y-%m-%d %H:%M:%S %Z')}")
+            return earliest_record_time, latest_record_time
+
+    # Name of the rollup table of each tier, as the TIMESTREAM_ROLLUP_TABLES value of the UDQ reader
+    def rollup_tables(self):
+        return ','.join(f"{interval}:{self.table_name}{suffix}" for suffix, interval, _, _, _, _ in ROLLUP_TIERS)
+
+    # Create the timestream database if needed and recreate the rollup tables
+    def recreate_rollup_tables(self):
+        print('Recreating the timestream rollup tables for telemetry')
+        for suffix, _, _, _, _, _ in ROLLUP_TIERS:
+            try:
+                self.timestream.delete_table(DatabaseName=self.database_name, TableName=self.table_name + suffix)
+            except self.timestream.exceptions.ResourceNotFoundException as e:
+                print(f"  Table {self.table_name + suffix} didn't exist... creating new")
+
+            self.timestream.create_table(DatabaseName=self.database_name, TableName=self.table_name + suffix,
+                    RetentionProperties={'MemoryStoreRetentionPeriodInHours': 24*30, 'MagneticStoreRetentionPeriodInDays': 365})
+
+    # Query aggregating the source of a rollup tier into its interval, for rows matching time_filter
+    def rollup_query(self, suffix, time_filter):
+        _, interval, source_suffix, _, _, _ = next(tier for tier in ROLLUP_TIERS if tier[0] == suffix)
+        source_table = self.table_name + (source_suffix or '')
+        aggregates = ROLLUP_ROLLUP_AGGREGATES if source_suffix else RAW_ROLLUP_AGGREGATES
+        value_filter = "" if source_suffix else " AND measure_value::double IS NOT NULL"
+        return f"SELECT TelemetryAssetType, TelemetryAssetId, measure_name, bin(time, {interval}) AS bucket_time, {aggregates}" \
+               f' FROM "{self.database_name}"."{source_table}"' \
+               f" WHERE {time_filter}{value_filter}" \
+               f" GROUP BY TelemetryAssetType, TelemetryAssetId, measure_name, bin(time, {interval})"
+
+    # Compute the rollup tiers of the numeric telemetry between the given times, e.g. after importing historical data
+    # (ongoing ingestion is rolled up by the scheduled queries, see create_rollup_scheduled_queries)
+    def build_rollups(self, start_time_ms, end_time_ms):
+        for suffix, interval, _, _, _, _ in ROLLUP_TIERS:
+            print(f"Building the {interval} telemetry rollups")
+            query_string = self.rollup_query(suffix, f"time >= bin(from_milliseconds({int(start_time_ms)}), {interval})"
+                                                     f" AND time <= from_milliseconds({int(end_time_ms)})")
+            records = []
+            counter = 0
+            paginator = self.timestream_query.get_paginator('query')
+            for page in paginator.paginate(QueryString=query_string):
+                names = [column['Name'] for column in page['ColumnInfo']]
+                for row in page['Rows']:
+                    row_as_dict = {name: datum.get('ScalarValue') for name, datum in zip(names, row['Data'])}
+                    records.append(self._rollup_record(row_as_dict))
+                    counter = counter + 1
+
+                    if len(records) == 100:
+                        self._submit_batch(records, counter, self.table_name + suffix)
+                        records = []
+
+            if len(records) != 0:
+                self._submit_batch(records, counter, self.table_name + suffix)
+
+    # Create the scheduled queries maintaining the rollup tiers from the ingested telemetry
+    # The execution role needs to query the telemetry and write the rollup tables, see
+    # https://docs.aws.amazon.com/timestream/latest/developerguide/scheduledqueries.html
+    def create_rollup_scheduled_queries(self, execution_role_arn, notification_topic_arn, error_report_bucket_name):
+        for suffix, interval, _, schedule, window, delay in ROLLUP_TIERS:
+            # each run aggregates the completed intervals since the previous run, delayed for late data and finer tiers
+            window_end = f"bin(@scheduled_runtime - {delay}, {interval})"
+            query_string = self.rollup_query(suffix, f"time >= {window_end} - {window} AND time < {window_end}")
+            self.timestream_query.create_scheduled_query(
+                Name=f"{self.database_name}-{self.table_name}{suffix}-rollup",
+                QueryString=query_string,
+                ScheduleConfiguration={'ScheduleExpression': schedule},
+                NotificationConfiguration={'SnsConfiguration': {'TopicArn': notification_topic_arn}},
+                TargetConfiguration={'TimestreamConfiguration': {
+                    'DatabaseName': self.database_name,
+                    'TableName': self.table_name + suffix,
+                    'TimeColumn': 'bucket_time',
+                    'DimensionMappings': [
+                        {'Name': 'TelemetryAssetType', 'DimensionValueType': 'VARCHAR'},
+                        {'Name': 'TelemetryAssetId', 'DimensionValueType': 'VARCHAR'},
+                    ],
+                    'MeasureNameColumn': 'measure_name',
+                    'MultiMeasureMappings': {
+                        'MultiMeasureAttributeMappings': [{'SourceColumn': name, 'MeasureValueType': measure_type}
+                                                          for name, measure_type in ROLLUP_MEASURES.items()],
+                    },
+                }},
+                ScheduledQueryExecutionRoleArn=execution_role_arn,
+                ErrorReportConfiguration={'S3Configuration': {'BucketName': error_report_bucket_name}},
+            )
+            print(f"   Created the {interval} rollup scheduled query, running {schedule}")
+
+    # Multi-measure rollup record of a rollup query result row
+    def _rollup_record(self, row_as_dict):
+        measure_values = []
+        for name, measure_type in ROLLUP_MEASURES.items():
+            value = row_as_dict[name]
+            if value is None:
+                continue
+            if measure_type == 'TIMESTAMP':
+                value = str(self._timestamp_ms(value))
+            measure_values.append({'Name': name, 'Value': value, 'Type': measure_type})
+        return {
+            'Dimensions': [
+                {'Name': 'TelemetryAssetType', 'Value': row_as_dict['TelemetryAssetType']},
+                {'Name': 'TelemetryAssetId', 'Value': row_as_dict['TelemetryAssetId']},
+            ],
+            'MeasureName': row_as_dict['measure_name'],
+            'MeasureValueType': 'MULTI',
+            'MeasureValues': measure_values,
+            'Time': str(self._timestamp_ms(row_as_dict['bucket_time'])),
+        }
+
+    # e.g. '2022-04-06 00:17:45.419000000' -> 1649204265419
+    @staticmethod
+    def _timestamp_ms(timestamp):
+        seconds, _, fraction = timestamp.partition('.')
+        parsed = datetime.datetime.strptime(seconds, '%Y-%m-%d %H:%M:%S').replace(tzinfo=datetime.timezone.utc)
+        return int(parsed.timestamp()) * 1000 + int((fraction + '000')[:3])
 
-    def _submit_batch(self, records, counter):
+    def _submit_batch(self, records, counter, table_name=None):
         try:
-            result = self.timestream.write_records(DatabaseName=self.database_name, TableName=self.table_name,
+            result = self.timestream.write_records(DatabaseName=self.database_name, TableName=table_name or self.table_name,
                                                Records=records, CommonAttributes={})
             print("   Processed [%d] records. WriteRecords Status: [%s]" % (counter,
                                                                          result['ResponseMetadata']['HTTPStatusCode']))
@@ -29,6 +29,7 @@ def parse_args():
     parser.add_argument('--telemetry-table-name', required=False, default='Telemetry', help='timestream telemetry table name')
     parser.add_argument('--telemetry-stack-name', required=False, default=None, help='Name of the Cloudformation stack where CookieFactory resources (like Timestream and Lambda) were created')
     parser.add_argument('--telemetry-rebase-time', default=False, required=False, action='store_true', dest="telemetry_rebase_time", help='Rebase the imported data to start from now.')
+    parser.add_argument('--telemetry-rollups', default=False, required=False, action='store_true', dest="telemetry_rollups", help='Also build the 1 minute and 1 hour rollup tables of the imported telemetry (see TIMESTREAM_ROLLUP_TABLES of the Timestream UDQ reader).')
     parser.add_argument('--content-start-time', default=None, type=int, required=False, dest="content_start_time", help='Rebase the imported content to start from this time. For samples, tries to lookup the last used time from workspace description. Otherwise defaults to 10 minutes before this script was run.')
 
     parser.add_argument('--delete-entities', default=False, required=False, action='store_true', dest="delete_entities", help='Delete all entities from the workspace.')
@@ -165,7 +166,11 @@ def main():
     if args.import_telemetry or args.import_all:
         print('Importing sample telemetry data...')
         telemetry.recreate_table()
-        telemetry.import_csv(content_path('sample_data/telemetry/telemetry.csv'), rebase_time_ms=content_start_time_ms)
+        imported_time_range = telemetry.import_csv(content_path('sample_data/telemetry/telemetry.csv'), rebase_time_ms=content_start_time_ms)
+        if args.telemetry_rollups:
+            telemetry.recreate_rollup_tables()
+            telemetry.build_rollups(*imported_time_range)
+            print(f"   Set TIMESTREAM_ROLLUP_TABLES={telemetry.rollup_tables()} on the Timestream UDQ reader to use the rollups")
 
     # Import video data
     if args.import_video or args.import_all:
@@ -14,6 +14,7 @@ import * as timestream from "aws-cdk-lib/aws-timestream";
 import * as iottwinmaker from "aws-cdk-lib/aws-iottwinmaker";
 import * as assets from "aws-cdk-lib/aws-s3-assets";
 import * as cognito from "aws-cdk-lib/aws-cognito";
+import * as secretsmanager from "aws-cdk-lib/aws-secretsmanager";
 import { CfnOutput } from "aws-cdk-lib/core";
 import {Construct} from "constructs";
 import CognitoAuthRole from "./CognitoAuthRole";
@@ -504,6 +505,12 @@ export class CookieFactoryV3Stack extends cdk.Stack {
             compatibleRuntimes: [lambda.Runtime.PYTHON_3_10],
         });
 
+        // random key signing the nextTokens of the UDQ readers (see udq_utils.udq_cursor), generated once per deployment and
+        // read by the readers at runtime, so it's neither in the template nor in the function configurations
+        const udqCursorSecret = new secretsmanager.Secret(this, 'udqCursorSecret', {
+            generateSecretString: { passwordLength: 48, excludePunctuation: true },
+        });
+
         //region - sample infrastructure content for telemetry data in Timestream
         const timestreamDB = new timestream.CfnDatabase(this, "TimestreamTelemetry", {
             databaseName: `${this.stackName}`
@@ -553,11 +560,15 @@ export class CookieFactoryV3Stack extends cdk.Stack {
             environment: {
                 "TIMESTREAM_DATABASE_NAME": `${timestreamDB.databaseName}`,
                 "TIMESTREAM_TABLE_NAME": `${timestreamTable.tableName}`,
+                "UDQ_CURSOR_SECRET_ARN": udqCursorSecret.secretArn,
             }
         });
+        udqCursorSecret.grantRead(timestreamReaderUDQ);
         //endregion
 
         //region - sample infrastructure content for synthetic cookieline telemetry data
+        // the layer provides numpy to memory-map the replay dataset compiled by synthetic_replay_connector/build_replay_dataset.py
+        // (pandas is only used by the build step, not at runtime)
         // https://aws-sdk-pandas.readthedocs.io/en/stable/layers.html
         const pandasLayer = lambda.LayerVersion.fromLayerVersionArn(this,
           'awsPandasLayer', `arn:aws:lambda:${this.region}:336392948345:layer:AWSSDKPandas-Python310:11`)
@@ -586,9 +597,11 @@ export class CookieFactoryV3Stack extends cdk.Stack {
                 "TELEMETRY_DATA_FILE_NAME": 'demoTelemetryData.json',
                 "TELEMETRY_DATA_TIME_INTERVAL_SECONDS": '10',
                 "TELEMETRY_DATA_S3_FILE_BUCKET": telemetryDataAsset.s3BucketName,
-                "TELEMETRY_DATA_S3_FILE_KEY": telemetryDataAsset.s3ObjectKey
+                "TELEMETRY_DATA_S3_FILE_KEY": telemetryDataAsset.s3ObjectKey,
+                "UDQ_CURSOR_SECRET_ARN": udqCursorSecret.secretArn,
             }
         });
+        udqCursorSecret.grantRead(syntheticDataUDQ);
         //endregion
 
         // TMDT application construct
@@ -0,0 +1,138 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved. 2023
+# SPDX-License-Identifier: Apache-2.0
+
+# Compiles the data samples listed in replay_sources.json into the replay dataset loaded by synthetic_udq_reader.py: a
+# manifest routing components to datasets (see replay_catalog.py), and per dataset an index.json and one .npy file per
+# property, memory-mapped by the reader on first use so that parsing, re-mapping and pivoting the samples (and pandas)
+# stay out of the Lambda runtime.
+#
+# Each replay_sources.json dataset gives its source file and format, the column naming its entities and the entity
+# mapping turning those names into entity ids, its sample interval, and optionally the component names it serves and the
+# dataset replayed instead while the workspace generates error states. Re-run after changing a sample or its sources:
+#
+#     python build_replay_dataset.py [--sources replay_sources.json] [--output-dir replay_dataset]
+
+import argparse
+import json
+import os
+import shutil
+
+import pandas as pd
+
+from replay_catalog import write_manifest
+from replay_index import ReplayIndex
+
+DATA_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_SOURCES_FILE = os.path.join(DATA_DIR, 'replay_sources.json')
+DEFAULT_OUTPUT_DIR = os.path.join(DATA_DIR, 'replay_dataset')
+
+
+# re-map alarm status values to match IoT TwinMaker's com.amazon.iottwinmaker.alarm.basic component type
+def remap_alarm_status(row):
+    if row['Alarming']:
+        return 'ACTIVE'
+    else:
+        return 'NORMAL'
+
+
+def load_simulator_frame(path):
+    """
+    Read a JSON lines telemetry sample of the CookieLine simulator into a pandas dataframe
+    """
+    with open(path, 'r') as f:
+        data = [json.loads(line.strip()) for line in f if line.strip()]
+
+    telemetry_df = pd.DataFrame(data)
+
+    # sample data cleaning operations for the simulator data
+    telemetry_df['alarm_status'] = telemetry_df.apply(remap_alarm_status, axis=1)
+    telemetry_df['AlarmMessage'] = telemetry_df["Alarm Message"] # Note: no spaces allowed in property names
+    return telemetry_df
+
+
+def load_attribute_frame(path):
+    """
+    Read a csv sample with one row per timestamp, asset and attribute into a pandas dataframe with a column per attribute
+    """
+    attribute_df = pd.read_csv(path)
+    attribute_df = attribute_df.pivot(index=['timestamp', 'asset_name'], columns='attribute_name', values='attribute_value')
+    attribute_df = attribute_df.reset_index()
+    attribute_df['Time'] = pd.to_datetime(attribute_df['timestamp'], unit='s').astype(str)
+    return attribute_df
+
+
+# source format -> loader of the source into a dataframe with one row per sample
+SOURCE_FORMATS = {
+    'simulator_jsonl': load_simulator_frame,
+    'attribute_csv': load_attribute_frame,
+}
+
+
+def load_dataset_frame(dataset, source, entity_mappings):
+    """
+    Load the source of a dataset and map its entity names to entity ids (entityId column)
+    """
+    loader = SOURCE_FORMATS.get(source['format'])
+    if loader is None:
+        raise Exception(f"Unsupported format [{source['format']}] of dataset [{dataset}], supported: {list(SOURCE_FORMATS)}")
+    frame = loader(os.path.join(DATA_DIR, source['source']))
+
+    entity_mapping = entity_mappings[source['entity_mapping']]
+    entity_names = frame[source['entity_column']]
+    unmapped = sorted(set(entity_names[~entity_names.isin(entity_mapping.keys())].astype(str)))
+    if unmapped:
+        raise Exception(f"No entity id for {unmapped} of dataset [{dataset}] in the entity mapping [{source['entity_mapping']}]")
+    frame['entityId'] = entity_names.map(entity_mapping)
+
+    if source['format'] == 'attribute_csv':
+        # interpolate periods with no values with the last value carried forward
+        frame = frame.set_index(frame['entityId'].rename(None)).ffill().bfill()
+    return frame
+
+
+def build_replay_dataset(sources_file, output_dir):
+    """
+    Compile every dataset of sources_file into output_dir, replacing its previous content
+
+    :return: the manifest entries of the datasets
+    """
+    with open(sources_file, 'r') as f:
+        sources = json.load(f)
+    if os.path.isdir(output_dir):
+        shutil.rmtree(output_dir)
+    os.makedirs(output_dir)
+
+    datasets = {}
+    for dataset, source in sources['datasets'].items():
+        frame = load_dataset_frame(dataset, source, sources['entity_mappings'])
+        path = os.path.splitext(source['source'])[0] if dataset == source['source'] else dataset
+        ReplayIndex.from_frame(frame, source['interval_seconds']).save(os.path.join(output_dir, path))
+        datasets[dataset] = {'path': path, 'interval_seconds': source['interval_seconds'],
+                             'component_names': source.get('component_names', [])}
+        if source.get('error_states_dataset'):
+            datasets[dataset]['error_states_dataset'] = source['error_states_dataset']
+        print(f"{dataset}: {frame['entityId'].nunique()} entities, {len(frame.columns) - 1} properties")
+
+    for dataset, entry in datasets.items():
+        if entry.get('error_states_dataset', dataset) not in datasets:
+            raise Exception(f"Unknown error states dataset [{entry['error_states_dataset']}] of dataset [{dataset}]")
+    if sources['default_dataset'] not in datasets:
+        raise Exception(f"Unknown default dataset [{sources['default_dataset']}]")
+    write_manifest(output_dir, sources['default_dataset'], datasets)
+    return datasets
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Compiles the synthetic replay data samples into the replay dataset loaded by the connector.')
+    parser.add_argument('--sources', required=False, default=DEFAULT_SOURCES_FILE, help='datasets to compile, defaults to replay_sources.json next to this module')
+    parser.add_argument('--output-dir', required=False, default=DEFAULT_OUTPUT_DIR, help='replay dataset directory, defaults to replay_dataset next to this module')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    build_replay_dataset(args.sources, args.output_dir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved. 2023
+# SPDX-License-Identifier: Apache-2.0
+
+import json
+import os
+import threading
+
+# manifest of a compiled replay dataset directory (see build_replay_dataset.py and replay_sources.json), e.g.
+#
+#   {"version": 2,
+#    "default_dataset": "demoTelemetryData.json",
+#    "datasets": {"rateEquipment": {"path": "rateEquipment", "interval_seconds": 5, "component_names": ["rateEquipment"],
+#                                   "error_states_dataset": "rateEquipment_errors"}, ...}}
+#
+# Components are replayed from the dataset listing them in component_names, other components from the default dataset.
+# A dataset with an error_states_dataset is replaced by it while the workspace generates error states
+MANIFEST_FILE_NAME = 'manifest.json'
+MANIFEST_VERSION = 2
+
+
+class ReplayCatalog:
+    """
+    The datasets of a compiled replay dataset directory, each memory-mapped on first use and shared afterwards, so a
+    container only pays for the datasets it serves
+    """
+
+    def __init__(self, directory: str, default_dataset: str = None, default_interval_seconds: int = None):
+        """
+        :param default_dataset: overrides the default dataset of the manifest, ignored if it isn't in the manifest
+        :param default_interval_seconds: overrides the sample interval the default dataset was compiled with
+        """
+        self._directory = directory
+        self._manifest = read_manifest(directory)
+        self._datasets = self._manifest['datasets']
+        self._default_dataset = self._manifest['default_dataset']
+        if default_dataset and default_dataset != self._default_dataset:
+            if default_dataset in self._datasets:
+                self._default_dataset = default_dataset
+            else:
+                print(f"No dataset [{default_dataset}] in the replay dataset [{directory}], defaulting to [{self._default_dataset}]")
+        self._default_interval_seconds = default_interval_seconds
+        self._component_datasets = {component_name: dataset for dataset, entry in self._datasets.items()
+                                    for component_name in entry.get('component_names', [])}
+        self._indexes = {}
+        self._lock = threading.Lock()
+
+    @property
+    def dataset_names(self):
+        return list(self._datasets)
+
+    @property
+    def default_dataset(self) -> str:
+        return self._default_dataset
+
+    def dataset_for(self, component_name: str) -> str:
+        return self._component_datasets.get(component_name, self._default_dataset)
+
+    def error_states_dataset(self, dataset: str):
+        """
+        :return: the dataset replayed instead of dataset while generating error states, or None
+        """
+        return self._entry(dataset).get('error_states_dataset')
+
+    def index(self, dataset: str):
+        """
+        The ReplayIndex of a dataset, loaded on first use
+        """
+        index = self._indexes.get(dataset)
+        if index is None:
+            entry = self._entry(dataset)
+            with self._lock:
+                index = self._indexes.get(dataset)
+                if index is None:
+                    index = self._load(dataset, entry)
+                    self._indexes[dataset] = index
+        return index
+
+    def loaded_datasets(self):
+        return list(self._indexes)
+
+    def _entry(self, dataset):
+        entry = self._datasets.get(dataset)
+        if entry is None:
+            raise Exception(f"No dataset [{dataset}] in the replay dataset [{self._directory}]")
+        return entry
+
+    def _load(self, dataset, entry):
+        from replay_index import ReplayIndex
+        interval_seconds = self._default_interval_seconds if dataset == self._default_dataset else None
+        return ReplayIndex.load(os.path.join(self._directory, entry['path']), interval_seconds)
+
+
+def read_manifest(directory: str) -> dict:
+    manifest_path = os.path.join(directory, MANIFEST_FILE_NAME)
+    if not os.path.exists(manifest_path):
+        raise Exception(f"No replay dataset manifest [{manifest_path}], run build_replay_dataset.py to compile it")
+    with open(manifest_path, 'r') as f:
+        manifest = json.load(f)
+    if manifest.get('version') != MANIFEST_VERSION:
+        raise Exception(f"Unsupported replay dataset manifest version [{manifest.get('version')}], expected {MANIFEST_VERSION}")
+    return manifest
+
+
+def write_manifest(directory: str, default_dataset: str, datasets: dict):
+    with open(os.path.join(directory, MANIFEST_FILE_NAME), 'w') as f:
+        json.dump({'version': MANIFEST_VERSION, 'default_dataset': default_dataset, 'datasets': datasets}, f, indent=1)
@@ -0,0 +1,187 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved. 2023
+# SPDX-License-Identifier: Apache-2.0
+
+import json
+import os
+
+import numpy as np
+
+# description of a compiled dataset (entities, properties and vocabularies), next to its .npy columns
+INDEX_FILE_NAME = 'index.json'
+
+
+class ReplayIndex:
+    """
+    Replay index of a telemetry sample: one contiguous array of values per property, holding the rows of each entity as a
+    contiguous range, all sampled every interval_seconds and replayed in a loop over time
+
+    The point at epoch second t (aligned to the interval) of a window starting at start_seconds is the sample row
+    (start_seconds % (num_rows * interval_seconds)) // interval_seconds + (t - aligned start) // interval_seconds,
+    modulo num_rows, so a page of points is a vectorized slice of the arrays whatever the dataset size
+
+    Non-numeric columns are dictionary-encoded: the array holds integer codes into a vocabulary of values, so every column
+    can be saved as a plain .npy file and memory-mapped when loaded. Map values (e.g. {"Dough": 120}) are saved in their
+    vocabulary as JSON strings, decoded back to dicts when loaded
+    """
+
+    def __init__(self, interval_seconds: int, entities: dict, columns: dict, map_columns=()):
+        """
+        :param entities: {entity id: (first row, number of rows)}
+        :param columns: {property name: (1-d numpy array of values or codes, object array vocabulary of the codes or None)}
+        :param map_columns: names of the columns whose vocabulary holds map values
+        """
+        self._interval_seconds = interval_seconds
+        self._entities = entities
+        self._columns = columns
+        self._map_columns = frozenset(map_columns)
+
+    @staticmethod
+    def from_frame(frame, interval_seconds: int, entity_column: str = 'entityId'):
+        """
+        Builds the index of a pandas dataframe with one row per sample and a column per property, the rows of each entity
+        in replay order
+        """
+        groups = frame.groupby(entity_column, sort=False).indices
+        entities = {}
+        first_row = 0
+        for entity_id, rows in groups.items():
+            entities[entity_id] = (first_row, len(rows))
+            first_row += len(rows)
+        order = np.concatenate(list(groups.values())) if groups else np.empty(0, dtype=np.int64)
+
+        columns = {}
+        map_columns = []
+        for property_name in frame.columns:
+            if property_name == entity_column:
+                continue
+            column = frame[property_name].iloc[order]
+            if column.dtype.kind in 'biuf':
+                columns[property_name] = (np.ascontiguousarray(column.to_numpy()), None)
+                continue
+            is_map = column.map(type).eq(dict).any()
+            if is_map:
+                # dicts can't be factorized, their JSON strings can
+                map_columns.append(property_name)
+                column = column.map(_encode_map)
+            codes, vocabulary = column.factorize(use_na_sentinel=False)
+            vocabulary = vocabulary.tolist()
+            if is_map:
+                vocabulary = list(map(_decode_map, vocabulary))
+            columns[property_name] = (codes.astype(_code_dtype(len(vocabulary))), _vocabulary_array(vocabulary))
+        return ReplayIndex(interval_seconds, entities, columns, map_columns)
+
+    @staticmethod
+    def load(directory: str, interval_seconds: int = None):
+        """
+        Loads an index saved into directory, memory-mapping its columns
+
+        :param interval_seconds: overrides the sample interval the index was saved with
+        """
+        index_path = os.path.join(directory, INDEX_FILE_NAME)
+        if not os.path.exists(index_path):
+            raise Exception(f"No replay index [{index_path}], run build_replay_dataset.py to compile it")
+        with open(index_path, 'r') as f:
+            saved = json.load(f)
+        entities = {entity_id: tuple(rows) for entity_id, rows in saved['entities'].items()}
+        columns = {}
+        map_columns = []
+        for property_name, column in saved['properties'].items():
+            values = np.load(os.path.join(directory, column['file']), mmap_mode='r')
+            vocabulary = column.get('vocabulary')
+            if vocabulary is not None and column.get('encoding') == 'json':
+                map_columns.append(property_name)
+                vocabulary = list(map(_decode_map, vocabulary))
+            columns[property_name] = (values, None if vocabulary is None else _vocabulary_array(vocabulary))
+        return ReplayIndex(interval_seconds or saved['interval_seconds'], entities, columns, map_columns)
+
+    def save(self, directory: str):
+        """
+        Saves the columns of the index as .npy files into directory, described by its index.json
+        """
+        os.makedirs(directory, exist_ok=True)
+        properties = {}
+        for i, (property_name, (values, vocabulary)) in enumerate(self._columns.items()):
+            file_name = f"{i}.npy"
+            np.save(os.path.join(directory, file_name), np.ascontiguousarray(values), allow_pickle=False)
+            properties[property_name] = {'file': file_name}
+            if vocabulary is not None:
+                vocabulary = vocabulary.tolist()
+                if property_name in self._map_columns:
+                    properties[property_name]['encoding'] = 'json'
+                    vocabulary = list(map(_encode_map, vocabulary))
+                properties[property_name]['vocabulary'] = vocabulary
+        with open(os.path.join(directory, INDEX_FILE_NAME), 'w') as f:
+            json.dump({
+                'interval_seconds': self._interval_seconds,
+                'entities': {entity_id: list(rows) for entity_id, rows in self._entities.items()},
+                'properties': properties,
+            }, f, indent=1)
+
+    @property
+    def entity_ids(self):
+        return list(self._entities)
+
+    @property
+    def property_names(self):
+        return list(self._columns)
+
+    @property
+    def interval_seconds(self) -> int:
+        return self._interval_seconds
+
+    def num_points(self, start_seconds: float, end_seconds: float) -> int:
+        """
+        Number of points replayed in the window (start_seconds, end_seconds]
+        """
+        return int((end_seconds - start_seconds) / self._interval_seconds)
+
+    def replay(self, entity_id, property_name, start_seconds: float, row_offset: int, num_points: int, descending: bool = False):
+        """
+        Replays num_points values of a property from the row_offset-th point of the window starting at start_seconds,
+        going back in time from that point if descending
+
+        :return: (ISO8601 timestamps, python-native values)
+        """
+        values, vocabulary = self._values(entity_id, property_name)
+        interval = self._interval_seconds
+        if descending:
+            offsets = np.arange(row_offset, row_offset - num_points, -1, dtype=np.int64)
+        else:
+            offsets = np.arange(row_offset, row_offset + num_points, dtype=np.int64)
+
+        start_row = int((start_seconds % (len(values) * interval)) / interval)
+        replayed = values[(start_row + offsets) % len(values)]
+        replayed = (replayed if vocabulary is None else vocabulary[replayed]).tolist()
+
+        epoch_seconds = int(start_seconds / interval) * interval + offsets * interval
+        timestamps = [timestamp + 'Z' for timestamp in np.datetime_as_string(epoch_seconds.astype('datetime64[s]'), unit='us').tolist()]
+        return timestamps, replayed
+
+    def _values(self, entity_id, property_name):
+        rows = self._entities.get(entity_id)
+        if not rows or not rows[1]:
+            raise Exception(f"No replay data for entity [{entity_id}]")
+        column = self._columns.get(property_name)
+        if column is None:
+            raise Exception(f"No replay data for property [{property_name}] of entity [{entity_id}]")
+        values, vocabulary = column
+        return values[rows[0]:rows[0] + rows[1]], vocabulary
+
+
+def _code_dtype(vocabulary_size):
+    return np.uint16 if vocabulary_size <= np.iinfo(np.uint16).max + 1 else np.uint32
+
+
+def _encode_map(value):
+    # maps as JSON strings, other values (e.g. NaN for rows without the property) as is
+    return json.dumps(value) if isinstance(value, dict) else value
+
+
+def _decode_map(value):
+    return json.loads(value) if isinstance(value, str) else value
+
+
+def _vocabulary_array(values):
+    vocabulary = np.empty(len(values), dtype=object)
+    vocabulary[:] = values
+    return vocabulary
@@ -1,26 +1,38 @@
 # Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved. 2023
 # SPDX-License-Identifier: Apache-2.0
 
-from udq_utils.udq import SingleEntityReader, MultiEntityReader, IoTTwinMakerDataRow, IoTTwinMakerUdqResponse
+# imported first so UDQ_COLD_START_PROFILE can time the imports below
+from udq_utils.udq_profile import LazyResource
+
+from udq_utils.udq import SingleEntityReader, MultiEntityReader, IoTTwinMakerUdqResponse, IoTTwinMakerUdqColumnarResponse
 from udq_utils.udq_models import IoTTwinMakerUDQEntityRequest, IoTTwinMakerUDQComponentTypeRequest, OrderBy, IoTTwinMakerReference, \
     EntityComponentPropertyRef
-from datetime import datetime, timedelta
-import json
-import pandas as pd
+from udq_utils.udq_cursor import Cursor, CursorCodec
+from udq_utils.udq_config_cache import default_config_cache
+import logging
 import os
-import boto3
-from botocore.config import Config
 
-session = boto3.session.Session()
-session_config = Config(
-    user_agent="cookiefactory_v3/1.0.0"
-)
-iottm = session.client(service_name='iottwinmaker', config=session_config)
+LOGGER = logging.getLogger(__name__)
+
+# the data samples listed in replay_sources.json are compiled by build_replay_dataset.py into a replay dataset next to
+# this module, resolved so that it can be loaded lazily whatever the working directory
+DATA_DIR = os.path.dirname(os.path.abspath(__file__))
+REPLAY_DATASET_DIR = os.path.join(DATA_DIR, 'replay_dataset')
+
+
+# boto3 and numpy are imported, and the client and replay indexes loaded, on first use rather than at import, keeping
+# them out of the cold start. Each LazyResource is then shared across warm invocations
+def _create_iottwinmaker_client():
+    import boto3
+    from botocore.config import Config
+
+    session = boto3.session.Session()
+    session_config = Config(
+        user_agent="cookiefactory_v3/1.0.0"
+    )
+    return session.client(service_name='iottwinmaker', config=session_config)
 
-# for debugging
-pd.set_option('display.max_rows', 500)
-pd.set_option('display.max_columns', 500)
-pd.set_option('display.width', 1000)
+iottm = LazyResource('iottwinmaker client', _create_iottwinmaker_client)
 
 # read the telemetry data interval
 DATA_INTERVAL = 10
@@ -29,195 +41,115 @@ try:
 except:
     pass # use default interval
 
-# read the telemetry data sample into a pandas dataframe for serving queries
-data = []
+# entity holding the synthetic data controls (e.g. generate_error_states) of the workspace
+SYNTHETICS_ENTITY_ID = 'Equipment_5c9e83d2-1880-4f83-affd-9a27f80d39f7'
 
-try:
-    telemetryDataFileName = os.environ['TELEMETRY_DATA_FILE_NAME']
-    if telemetryDataFileName is None or telemetryDataFileName.strip() == '':
-        telemetryDataFileName = 'demoTelemetryData.json'
+# control flags are read from IoT TwinMaker at most once per UDQ_CONFIG_TTL_SECONDS per container, and refreshed in the
+# background while stale (see udq_utils.udq_config_cache)
+control_flags = default_config_cache()
+
+
+def _load_generate_error_states(workspace_id):
+    entity = iottm.get_entity(workspaceId=workspace_id, entityId=SYNTHETICS_ENTITY_ID)
+    return entity['components']['synthetics']['properties']['generate_error_states']['value']['booleanValue']
+
+
+def generate_error_states(workspace_id) -> bool:
+    """
+    Whether datasets are replaced by their error states dataset (see replay_catalog.py), False if the control flag can't be read
+    """
+    try:
+        return control_flags.get(('generate_error_states', workspace_id), lambda: _load_generate_error_states(workspace_id))
+    except Exception:
+        LOGGER.warning("Failed to read the generate_error_states flag of workspace [%s], replaying the regular datasets", workspace_id,
+                       exc_info=True)
+        return False
+
+
+def _create_replay_catalog():
+    """
+    Open the compiled replay dataset (see replay_catalog.py), its datasets are memory-mapped when first requested
+    """
+    from replay_catalog import ReplayCatalog
+
+    # TELEMETRY_DATA_FILE_NAME and TELEMETRY_DATA_TIME_INTERVAL_SECONDS select and time the default (telemetry) dataset
+    telemetryDataFileName = os.environ.get('TELEMETRY_DATA_FILE_NAME')
     print(f"telemetryDataFileName: {telemetryDataFileName}")
-    with open(telemetryDataFileName, 'r') as f:
-        lines = f.readlines()
-        for line in lines:
-            data.append(json.loads(line.strip()))
-except:
-    with open('demoTelemetryData.json', 'r') as f:
-        lines = f.readlines()
-        for line in lines:
-            data.append(json.loads(line.strip()))
-
-df = pd.DataFrame(data)
-
-# sample data cleaning operations for the csv data
-
-# re-mapping of entity names to entity_ids for CookieLine1 telemetry data
-simulatorName_to_entityId = {
-    "plasticLiner": "PLASTIC_LINER_a77e76bc-53f3-420d-8b2f-76103c810fac",
-    "boxErector": "BOX_ERECTOR_142496af-df2e-490e-aed5-2580eaf75e40",
-    "labelingBelt": "LABELING_BELT_5f98ffd2-ced1-48dd-a111-e3503b4e8532",
-    "freezingTunnel": "FREEZER_TUNNEL_e12e0733-f5df-4604-8f10-417f49e6d298",
-    "boxSealer": "BOX_SEALER_ad434a34-4363-4a36-8153-20bd7189951d",
-    "cookieFormer": "COOKIE_FORMER_19556bfd-469c-40bc-a389-dbeab255c144",
-    "conveyorRight": "CONVEYOR_RIGHT_TURN_c4f2df3d-26a2-45c5-a6c9-02ca00eb4af6",
-    "verticalConveyor": "VERTICAL_CONVEYOR_d5423f7f-379c-4a97-aae0-3a5c0bcc9116",
-    "conveyorLeft": "CONVEYOR_LEFT_TURN_b28f2ca9-b6a7-44cd-a62d-7f76fc17ba45",
-    "conveyorStraight": "CONVEYOR_STRIGHT_9c62c546-f8ef-489d-9938-d46a12c97f32",
-}
-def remap_ids(row):
-    return simulatorName_to_entityId[row['Name']]
-
-df['entityId'] = df.apply(remap_ids, axis=1)
-
-# re-map alarm status values to match IoT TwinMaker's com.amazon.iottwinmaker.alarm.basic component type
-def remap_alarm_status(row):
-    if row['Alarming']:
-        return 'ACTIVE'
-    else:
-        return 'NORMAL'
-
-df['alarm_status'] = df.apply(remap_alarm_status, axis=1)
-df['AlarmMessage'] = df["Alarm Message"] # Note: no spaces allowed in property names
-
-# csv handling
-df2_rateeq = pd.read_csv('data.csv')
-df2_rateeq = df2_rateeq.pivot(index=['timestamp', 'asset_name'], columns='attribute_name', values='attribute_value')
-df2_rateeq = df2_rateeq.reset_index()
-# re-mapping of entity names to entity_ids for CookieLine1 telemetry data
-rateeq_to_entityId = {
-    "Box Erector": "BOX_ERECTOR_142496af-df2e-490e-aed5-2580eaf75e40",
-    "Box Sealer": "BOX_SEALER_ad434a34-4363-4a36-8153-20bd7189951d",
-    "Conveyor Left Turn": "CONVEYOR_LEFT_TURN_b28f2ca9-b6a7-44cd-a62d-7f76fc17ba45",
-    "Conveyor Right Turn": "CONVEYOR_RIGHT_TURN_c4f2df3d-26a2-45c5-a6c9-02ca00eb4af6",
-    "Cookie Former": "COOKIE_FORMER_19556bfd-469c-40bc-a389-dbeab255c144",
-    "Cookie Inspector": "INSPECTOR_POST_FREEZER_TUNNEL_999d8796-55f1-4791-af53-fc210038686f",
-    "Freezer Tunnel": "FREEZER_TUNNEL_e12e0733-f5df-4604-8f10-417f49e6d298",
-    "Labeller": "LABELING_BELT_5f98ffd2-ced1-48dd-a111-e3503b4e8532",
-    "Line 1": "COOKIE_LINE_5ce9f1d5-61b0-433f-a850-53fa7ca27aa1",
-    "Liner Inserter": "PLASTIC_LINER_a77e76bc-53f3-420d-8b2f-76103c810fac",
-    "Vertical Conveyor": "VERTICAL_CONVEYOR_d5423f7f-379c-4a97-aae0-3a5c0bcc9116",
-}
-def remap_rateeq_ids(row):
-    return rateeq_to_entityId[row['asset_name']]
-df2_rateeq['entityId'] = df2_rateeq.apply(remap_rateeq_ids, axis=1)
-df2_rateeq['_entityId'] = df2_rateeq['entityId']
-df2_rateeq['Time'] = pd.to_datetime(df2_rateeq['timestamp'], unit='s').astype(str)
-
-# interpolate periods with no values with last value carried forward for the same entityId
-# for propName in ['Alarm_State', 'Alarm_Text', 'Bad', 'Bad_Parts_1Min', 'Blocked', 'Blocked_Time_1Min', 'Down', 'Down_Time_1Min', 'Good', 'Good_Parts_1Min', 'Max_Level', 'Min_Level', 'Moisture', 'Shift', 'Speed', 'Starved', 'Starved_Time_1Min', 'State', 'Temperature', 'Total', 'Total_Parts_1Min']:
-#     df2_rateeq[propName] = df2_rateeq.groupby('entityId')[propName].apply(lambda x: x.ffill().bfill())
-df2_rateeq = df2_rateeq.set_index('_entityId')
-df2_rateeq = df2_rateeq.ffill()
-df2_rateeq = df2_rateeq.bfill()
-
-
-
-df2_rateeq_err = pd.read_csv('error_data.csv')
-df2_rateeq_err = df2_rateeq_err.pivot(index=['timestamp', 'asset_name'], columns='attribute_name', values='attribute_value')
-df2_rateeq_err = df2_rateeq_err.reset_index()
-# re-mapping of entity names to entity_ids for CookieLine1 telemetry data
-def remap_rateeq_ids(row):
-    return rateeq_to_entityId[row['asset_name']]
-df2_rateeq_err['entityId'] = df2_rateeq_err.apply(remap_rateeq_ids, axis=1)
-df2_rateeq_err['_entityId'] = df2_rateeq_err['entityId']
-df2_rateeq_err['Time'] = pd.to_datetime(df2_rateeq_err['timestamp'], unit='s').astype(str)
-
-# interpolate periods with no values with last value carried forward for the same entityId
-# for propName in ['Alarm_State', 'Alarm_Text', 'Bad', 'Bad_Parts_1Min', 'Blocked', 'Blocked_Time_1Min', 'Down', 'Down_Time_1Min', 'Good', 'Good_Parts_1Min', 'Max_Level', 'Min_Level', 'Moisture', 'Shift', 'Speed', 'Starved', 'Starved_Time_1Min', 'State', 'Temperature', 'Total', 'Total_Parts_1Min']:
-#     df2_rateeq_err[propName] = df2_rateeq_err.groupby('entityId')[propName].apply(lambda x: x.ffill().bfill())
-df2_rateeq_err = df2_rateeq_err.set_index('_entityId')
-df2_rateeq_err = df2_rateeq_err.ffill()
-df2_rateeq_err = df2_rateeq_err.bfill()
-
-
-class RenderIoTTwinMakerDataRow(IoTTwinMakerDataRow):
-
-    def __init__(self, dt, value, property_name, component_name, entity_id):
-        self.dt = dt
-        self.value = value
-        self.property_name = property_name
-        self.component_name = component_name
-        self.entity_id = entity_id
-        pass
-
-    def get_iottwinmaker_reference(self) -> IoTTwinMakerReference:
-        # Note: this synthetic data generator is currently specific to CookieLine
-        return IoTTwinMakerReference(ecp=EntityComponentPropertyRef(
-            entity_id=self.entity_id,
-            component_name=self.component_name,
-            property_name=self.property_name
-        ))
-
-    def get_iso8601_timestamp(self) -> str:
-        return self.dt.strftime('%Y-%m-%dT%H:%M:%S.%fZ')
-
-    def get_value(self):
-        return self.value
+    return ReplayCatalog(REPLAY_DATASET_DIR, default_dataset=telemetryDataFileName,
+                         default_interval_seconds=DATA_INTERVAL if 'TELEMETRY_DATA_TIME_INTERVAL_SECONDS' in os.environ else None)
+
+
+replay_catalog = LazyResource('replay catalog', _create_replay_catalog)
+
 
 class RenderValuesReader(SingleEntityReader, MultiEntityReader):
     def __init__(self):
-        pass
+        self.cursor_codec = CursorCodec()
 
-    def entity_query(self, request: IoTTwinMakerUDQEntityRequest) -> IoTTwinMakerUdqResponse:
-        return IoTTwinMakerUdqResponse(rows=self._get_data_rows(request))
+    def entity_query(self, request: IoTTwinMakerUDQEntityRequest) -> IoTTwinMakerUdqColumnarResponse:
+        return self._get_data_columns(request)
 
     def component_type_query(self, request: IoTTwinMakerUDQComponentTypeRequest) -> IoTTwinMakerUdqResponse:
         # Note: this synthetic data generator currently only supports single-entity queries
         #       alarm data will not appear in scenes from GetAlarms query
         return IoTTwinMakerUdqResponse([], None)
 
-    def _get_data_rows(self, request):
-        start_dt = request.start_datetime
-        end_dt = request.end_datetime
+    def _get_data_columns(self, request) -> IoTTwinMakerUdqColumnarResponse:
+        """
+        Returns a page of at most max_rows data points, and the nextToken to resume from (None for the last page)
+
+        The page position (selected property index, row offset in the requested window) is kept in a signed cursor token,
+        so each page is sliced directly from its offset in the replay index, without re-generating the points of earlier pages.
+        With orderByTime DESCENDING the row offset counts back from the last point of the window, so a latest value request
+        (maxResults 1) only replays that point whatever the window length
+        """
+        start_seconds = request.start_datetime.timestamp()
+        end_seconds = request.end_datetime.timestamp()
         max_rows = request.max_rows
-
-        data_rows = []
-
-        for selected_property in request.selected_properties:
-            if request.component_name == 'rateEquipment':
-                try:
-                    workspace = request.udq_context['workspace_id']
-                    return_errors = iottm.get_entity(workspaceId=workspace, entityId='Equipment_5c9e83d2-1880-4f83-affd-9a27f80d39f7')['components']['synthetics']['properties']['generate_error_states']['value']['booleanValue']
-                    if return_errors:
-                        df2 = df2_rateeq_err.copy()
-                    else:
-                        df2 = df2_rateeq.copy()
-                except Error as e:
-                    print(e)
-                    df2 = df2_rateeq.copy()
-                data_interval = 5
-            else:
-                df2 = df.copy()
-                data_interval = DATA_INTERVAL
-            df2.reset_index()
-
-            '''e.g.
-                00 = {dict: 1} {'Speed': 6}
-                01 = {dict: 1} {'Speed': 10}
-                02 = {dict: 1} {'Speed': 3}
-            '''
-            data_index = df2[df2['entityId'] == request.entity_id][[selected_property, 'Time']].set_index('Time').to_dict('records')
-
-            # determine the relative start point in the data set to generate synthetic data for, as well as number of data points to return
-            epoch_start_in_seconds = start_dt.timestamp()
-            sample_time_range_length_in_seconds = (len(data_index) * (data_interval))
-            start_interval_bin = epoch_start_in_seconds % sample_time_range_length_in_seconds
-            start_interval_bin_in_index = int(start_interval_bin / (data_interval))
-            number_of_datapoints = min(max_rows, int((end_dt.timestamp() - start_dt.timestamp()) / (data_interval)))
-
-            # generate data response by repeatedly iterating over the data sample
-            curr_dt = datetime.fromtimestamp(int(start_dt.timestamp() / (data_interval)) * (data_interval))
-            curr_index = start_interval_bin_in_index
-            for i in range(number_of_datapoints):
-                dt = curr_dt
-                value = data_index[curr_index][selected_property]
-
-                data_rows.append(RenderIoTTwinMakerDataRow(dt, value, selected_property, request.component_name, request.entity_id))
-
-                curr_dt = dt + timedelta(seconds=data_interval)
-                curr_index = (curr_index + 1) % len(data_index)
-
-        return data_rows
+        descending = request.order_by == OrderBy.DESCENDING
+
+        cursor = self.cursor_codec.decode(request)
+        remaining_rows = max_rows if max_rows else float('inf')
+
+        references, reference_ids, timestamps, values = [], [], [], []
+        next_token = None
+
+        # the dataset is selected once for all the properties of the request
+        dataset = replay_catalog.dataset_for(request.component_name)
+        error_states_dataset = replay_catalog.error_states_dataset(dataset)
+        if error_states_dataset and generate_error_states(request.udq_context['workspace_id']):
+            dataset = error_states_dataset
+        replay_index = replay_catalog.index(dataset)
+
+        for property_index in range(cursor.property_index, len(request.selected_properties)):
+            selected_property = request.selected_properties[property_index]
+            row_offset = cursor.row_offset if property_index == cursor.property_index else 0
+            if remaining_rows <= 0:
+                next_token = self.cursor_codec.encode(Cursor(property_index, row_offset), request)
+                break
+
+            # replay the data sample in a loop from the window start (or back from its end), resuming at the cursor's row offset
+            total_datapoints = replay_index.num_points(start_seconds, end_seconds)
+            number_of_datapoints = max(0, min(remaining_rows, total_datapoints - row_offset))
+            if number_of_datapoints:
+                first_point = total_datapoints - 1 - row_offset if descending else row_offset
+                property_timestamps, property_values = replay_index.replay(request.entity_id, selected_property, start_seconds, first_point,
+                                                                           number_of_datapoints, descending)
+                reference_ids.extend([len(references)] * number_of_datapoints)
+                references.append(IoTTwinMakerReference(ecp=EntityComponentPropertyRef(
+                    entity_id=request.entity_id,
+                    component_name=request.component_name,
+                    property_name=selected_property
+                )))
+                timestamps.extend(property_timestamps)
+                values.extend(property_values)
+
+            remaining_rows -= number_of_datapoints
+            if row_offset + number_of_datapoints < total_datapoints:
+                next_token = self.cursor_codec.encode(Cursor(property_index, row_offset + number_of_datapoints), request)
+                break
+
+        return IoTTwinMakerUdqColumnarResponse(references, reference_ids, timestamps, values, next_token)
 
 RENDER_READER = RenderValuesReader()
 